@@ -0,0 +1,301 @@
+"""
+batch_runs.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Runs lots of recipe generations from one process, so the knowledge base,
+food2vec vectors and fitness workers are only loaded once. The runs are read
+from a JSONL file, one JSON object per line, like:
+
+    {"iterations": 50, "seed": 1, "output": "recipe1.md"}
+    {"iterations": 20, "seed": 2, "output": "recipe2.md", "recipes": [0, 3, 4]}
+
+"iterations" and "output" are required; "seed" defaults to the run's position
+in the file (from 0, not counting blank lines), "recipes" picks a subset of
+the inspiring set (by position), "exclude" lists ingredients the recipe
+mustn't have, and "mating" and "offspring" override the command line
+defaults. Several runs go at once: each generation, the new recipes of all of
+them are scored together, and each run's recipe is written out as soon as
+it's finished. Each run gets the same recipe as a single run would after
+random.seed(seed). A run that fails is reported with its error, and the
+others carry on.
+
+Usage: python batch_runs.py runs.jsonl
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import collections
+
+import cookie_generation
+
+INSPIRING_SET_FILE = "inspiring_set.json"
+# How many runs go at once by default.
+MAX_CONCURRENT_RUNS = 8
+
+class BatchRun:
+    """
+    BatchRun class: one run from the batch file, along with how far it's got.
+    The run has its own random number generator state, which is swapped in
+    whenever it's making new recipes.
+    """
+    def __init__(self, number, spec, inspiring_set, mating, offspring, compact=False):
+        self.number = number
+        self.iterations = int(spec["iterations"])
+        self.output = spec.get("output")
+        self.seed = spec.get("seed", number)
+        self.mating = spec.get("mating", mating)
+        self.offspring = spec.get("offspring", offspring)
+        if self.iterations < 0:
+            raise ValueError("Run {0}: iterations can't be negative".format(number))
+        if self.mating not in cookie_generation.MATING_SCHEMES:
+            raise ValueError("Run {0}: unknown mating scheme {1!r}".format(number,
+                                                                         self.mating))
+        if self.offspring is not None and (not isinstance(self.offspring, int)
+                                           or isinstance(self.offspring, bool)
+                                           or self.offspring < 1):
+            raise ValueError("Run {0}: offspring should be a whole number of at least "
+                             "1".format(number))
+        # Recipes with any ingredient containing one of these are thrown away.
+        self.exclude = [str(name).lower() for name in spec.get("exclude", [])]
+        indices = spec.get("recipes", range(len(inspiring_set)))
+        try:
+            self.recipes_list = [cookie_generation.convert_format(inspiring_set[i], compact)
+                                 for i in indices]
+        except (IndexError, TypeError) as error:
+            raise ValueError("Run {0}: recipes should be positions in the inspiring "
+                             "set".format(number)) from error
+        if len(self.recipes_list) < 2:
+            raise ValueError("Run {0}: needs at least two recipes".format(number))
+        self.recipes_list = self.allowed(self.recipes_list)
+        if len(self.recipes_list) < 2:
+            raise ValueError("Run {0}: fewer than two recipes without the excluded "
+                             "ingredients".format(number))
+        self.generation = 0
+        self.new_recipes = []
+        self.rng_state = random.Random(self.seed).getstate()
+        self.start_time = None
+        # The exception the run failed with, if it failed.
+        self.error = None
+
+    def is_finished(self):
+        """
+        Checks whether the run has done all of its generations.
+        """
+        return self.generation >= self.iterations
+
+    def allowed(self, recipe_list):
+        """
+        Gets the recipes in a list that have none of the excluded ingredients.
+
+        Arguments:
+            recipe_list: The recipes to check.
+        """
+        if not self.exclude:
+            return recipe_list
+        return [recipe for recipe in recipe_list
+                if not any(excluded in ingredient.lower()
+                           for ingredient in recipe.get_ingredient_names()
+                           for excluded in self.exclude)]
+
+    def make_offspring(self, fitness_cache=None, fitness_pool=None):
+        """
+        Makes this generation's new recipes, using the run's own random state.
+        Any with excluded ingredients are thrown away (and the parents make up
+        the numbers when the fittest are selected).
+
+        Arguments:
+            fitness_cache: The FitnessCache shared by the batch, if any.
+            fitness_pool: The FitnessPool shared by the batch, if any.
+        """
+        if self.generation == 0:
+            # The starting population isn't sorted fittest first.
+            self.recipes_list = cookie_generation.rank_parents(
+                self.recipes_list, self.mating, fitness_cache, fitness_pool)
+        random.setstate(self.rng_state)
+        new_recipes = cookie_generation.make_offspring(self.recipes_list, self.mating,
+                                                       self.offspring)
+        self.rng_state = random.getstate()
+        self.new_recipes = self.allowed(new_recipes)
+
+    def select(self, fitness_cache, fitness_pool, known_fitness=None):
+        """
+        Ranks this generation's new recipes and keeps the fittest.
+
+        Arguments:
+            fitness_cache: The FitnessCache shared by the batch.
+            fitness_pool: The FitnessPool shared by the batch.
+            known_fitness: Fitness levels of the new recipes that have
+                already been scored (from score_into_cache), if any.
+        """
+        new_recipes, parent_fitness = cookie_generation.refill_population(
+            self.new_recipes, self.recipes_list, len(self.recipes_list), fitness_cache)
+        parent_fitness.update(known_fitness or dict())
+        rank = cookie_generation.recipe_rankings(new_recipes, fitness_cache, fitness_pool,
+                                                 top_k=len(self.recipes_list),
+                                                 known_fitness=parent_fitness)
+        self.recipes_list = [r[0] for r in rank]
+        self.new_recipes = []
+        self.generation += 1
+
+    def get_result(self):
+        """
+        Gets the run's fittest recipe and its title.
+        """
+        random.setstate(self.rng_state)
+        recipe = self.recipes_list[0]
+        return recipe, cookie_generation.get_recipe_title(recipe, self.iterations)
+
+    def write(self):
+        """
+        Writes the run's fittest recipe to its output file.
+        """
+        recipe, title = self.get_result()
+        with open(self.output, "w") as output_file:
+            output_file.write(recipe.get_recipe(title))
+
+def read_specs(filename):
+    """
+    Reads the run specs from a JSONL file, skipping blank lines.
+
+    Arguments:
+        filename: The JSONL file.
+    """
+    with open(filename, "r") as spec_file:
+        specs = [json.loads(line) for line in spec_file if line.strip()]
+    for number, spec in enumerate(specs):
+        if "iterations" not in spec or "output" not in spec:
+            raise ValueError("Run {0}: needs iterations and output".format(number))
+    return specs
+
+def step_runs(runs, fitness_cache, fitness_pool=None):
+    """
+    Runs a generation of each of a bunch of runs. The new recipes of all of
+    them are scored in one trip to the fitness workers. A run that raises an
+    exception doesn't stop the others: returns a dictionary of the runs that
+    failed, and the exceptions they raised.
+
+    Arguments:
+        runs: The BatchRuns to step (none of which should be finished).
+        fitness_cache: The FitnessCache shared by the runs.
+        fitness_pool: The FitnessPool shared by the runs, if any.
+    """
+    failed = dict()
+    for run in runs:
+        try:
+            run.make_offspring(fitness_cache, fitness_pool)
+        except Exception as error: # pylint: disable=broad-except
+            failed[run] = error
+    runs = [run for run in runs if run not in failed]
+    try:
+        known_fitness = cookie_generation.score_into_cache(
+            [recipe for run in runs for recipe in run.new_recipes], fitness_cache,
+            fitness_pool)
+    except Exception: # pylint: disable=broad-except
+        # Score each run's recipes on their own, to find out whose they were.
+        known_fitness = dict()
+        for run in runs:
+            try:
+                known_fitness.update(cookie_generation.score_into_cache(
+                    run.new_recipes, fitness_cache, fitness_pool))
+            except Exception as error: # pylint: disable=broad-except
+                failed[run] = error
+    for run in runs:
+        if run in failed:
+            continue
+        try:
+            run.select(fitness_cache, fitness_pool, known_fitness)
+        except Exception as error: # pylint: disable=broad-except
+            failed[run] = error
+    return failed
+
+def run_batch(specs, inspiring_set, fitness_pool=None, max_concurrent=MAX_CONCURRENT_RUNS,
+              mating="all-pairs", offspring=None,
+              cache_size=cookie_generation.FITNESS_CACHE_SIZE, compact=False):
+    """
+    Runs a batch of runs, yielding each run as it finishes. A run that fails
+    is yielded straight away with its error set (and nothing written), and
+    the others carry on.
+
+    Arguments:
+        specs: The run specs (dictionaries).
+        inspiring_set: The inspiring set, as loaded from inspiring_set.json.
+        fitness_pool: FitnessPool to score the recipes of every run with.
+        max_concurrent: How many runs to have going at once.
+        mating: Default mating scheme for the runs.
+        offspring: Default number of new recipes per generation.
+        cache_size: Size of the FitnessCache shared by all of the runs.
+        compact: Whether the runs should use CompactRecipes.
+    """
+    fitness_cache = cookie_generation.FitnessCache(cache_size)
+    waiting = collections.deque(BatchRun(number, spec, inspiring_set, mating, offspring,
+                                         compact)
+                                for number, spec in enumerate(specs))
+    active = []
+    while waiting or active:
+        while waiting and len(active) < max_concurrent:
+            run = waiting.popleft()
+            run.start_time = time.perf_counter()
+            active.append(run)
+
+        failed = step_runs([run for run in active if not run.is_finished()], fitness_cache,
+                           fitness_pool)
+        for run, error in failed.items():
+            active.remove(run)
+            run.error = error
+            yield run
+
+        for run in [run for run in active if run.is_finished()]:
+            active.remove(run)
+            try:
+                run.write()
+            except OSError as error:
+                run.error = error
+            yield run
+
+def main():
+    """
+    Main function - runs every run in a batch file.
+    """
+    parser = argparse.ArgumentParser(description="Runs a batch of cookie recipe generations.")
+    parser.add_argument("specs", type=str, help="JSONL file of runs.")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_RUNS,
+                        help="Number of runs to have going at once.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of fitness worker processes (defaults to the "
+                        "number of CPUs).")
+    parser.add_argument("--cache-size", type=int, default=cookie_generation.FITNESS_CACHE_SIZE,
+                        help="Number of recipe fitness levels to remember.")
+    parser.add_argument("--mating", choices=sorted(cookie_generation.MATING_SCHEMES),
+                        default="all-pairs", help="Default mating scheme for the runs.")
+    parser.add_argument("--offspring", type=int, default=None,
+                        help="Default number of new recipes per generation.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Keep the recipes as CompactRecipes, which take much less "
+                        "memory.")
+
+    args = parser.parse_args()
+
+    specs = read_specs(args.specs)
+    with open(INSPIRING_SET_FILE, "r") as iset_file:
+        inspiring_set = json.load(iset_file)
+
+    failures = 0
+    with cookie_generation.FitnessPool(args.workers) as fitness_pool:
+        for run in run_batch(specs, inspiring_set, fitness_pool, args.max_concurrent,
+                             args.mating, args.offspring, args.cache_size, args.compact):
+            result = {"run": run.number, "output": run.output,
+                      "iterations": run.iterations, "seed": run.seed,
+                      "seconds": round(time.perf_counter() - run.start_time, 3)}
+            if run.error is not None:
+                result["error"] = repr(run.error)
+                failures += 1
+            print(json.dumps(result))
+            sys.stdout.flush()
+    if failures:
+        sys.exit("{0} of {1} runs failed.".format(failures, len(specs)))
+
+if __name__ == "__main__":
+    main()
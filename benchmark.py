@@ -0,0 +1,432 @@
+"""
+benchmark.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Benchmarks the hot paths of the genetic algorithm (the fitness functions,
+recombination, ranking and whole generations) on synthetic inspiring sets of
+different sizes, and the ingredient line parser (in lines per second) on a
+recorded corpus of ingredient lines. It runs offline: unless told otherwise,
+it generates a small food2vec vector file covering our knowledge base and
+uses that instead of the real vectors. Results are saved as JSON, and can be
+compared to a stored baseline so that regressions are flagged.
+
+Usage:
+    python benchmark.py --save-baseline
+    python benchmark.py --baseline benchmark_baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import importlib
+import statistics
+import tracemalloc
+
+import numpy as np
+
+import knowledge_base
+
+# Population sizes to benchmark by default.
+DEFAULT_SIZES = [20, 200, 1000]
+# Ingredients in each synthetic recipe by default.
+DEFAULT_INGREDIENTS = 12
+# Size of the generated food2vec vectors.
+VECTOR_DIMENSIONS = 32
+# Corpus of ingredient lines scraped from recipe pages (one line per line,
+# with a blank line after each recipe), and how many lines to parse per call.
+INGREDIENT_LINES_FILE = "ingredient_lines.txt"
+DEFAULT_LINE_COUNTS = [100, 10000]
+
+# Each benchmark makes at least MIN_CALLS calls, and keeps going until it has
+# run for the minimum time or made MAX_CALLS calls.
+MIN_CALLS = 3
+MAX_CALLS = 1000
+MIN_SECONDS = 0.5
+# Calls made (with tracemalloc on) to measure peak memory.
+MEMORY_CALLS = 3
+
+RESULTS_FILE = "benchmark_results.json"
+BASELINE_FILE = "benchmark_baseline.json"
+# How much slower (or hungrier) than the baseline counts as a regression.
+REGRESSION_THRESHOLD = 0.25
+
+# Amounts (in ounces) used for the synthetic recipes.
+SYNTHETIC_AMOUNTS = [0.02125, 0.17, 0.5, 1.0, 2.0, 4.0, 8.0, 10.0]
+
+def synthetic_ingredients():
+    """
+    Gets the ingredient names that synthetic recipes are made from: all of
+    those in the substitution data, apart from ones that would get a recipe
+    banned.
+    """
+    kb = knowledge_base.get_knowledge_base()
+    # Imported here, so that cookie_generation isn't loaded before we've picked
+    # which food2vec vectors it should use.
+    banned = importlib.import_module("cookie_generation").BANNED_CATEGORIES
+    return sorted(name for name, sub in kb.sub_data.items()
+                  if name and sub.get("category") not in banned)
+
+def generate_inspiring_set(num_recipes, num_ingredients=DEFAULT_INGREDIENTS, seed=0):
+    """
+    Generates a synthetic inspiring set, in the same format as
+    inspiring_set.json: a list of recipes, each a list of [ingredient, amount]
+    pairs.
+
+    Arguments:
+        num_recipes: How many recipes to make.
+        num_ingredients: How many ingredients each recipe has.
+        seed: Seed for the random number generator, so sets can be remade.
+    """
+    rng = random.Random(seed)
+    ingredients = synthetic_ingredients()
+    num_ingredients = min(num_ingredients, len(ingredients))
+    return [[[ingredient, rng.choice(SYNTHETIC_AMOUNTS)]
+             for ingredient in rng.sample(ingredients, num_ingredients)]
+            for _ in range(num_recipes)]
+
+def write_synthetic_vectors(folder, dimensions=VECTOR_DIMENSIONS, seed=0):
+    """
+    Writes a small set of random (unit length) food2vec vectors, covering every
+    name in the knowledge base, as a .npy matrix and vocabulary file. Returns
+    the name of the .npy file.
+
+    Arguments:
+        folder: Folder to write the files into.
+        dimensions: Length of each vector.
+        seed: Seed for the random number generator.
+    """
+    kb = knowledge_base.get_knowledge_base()
+    names = set(kb.sub_data) | set(kb.trans_data) | set(kb.markov_states) | set(kb.embed_names)
+    words = sorted({str(name).strip().capitalize() for name in names if str(name).strip()})
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((len(words), dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    matrix_file = os.path.join(folder, "syntheticVecs.npy")
+    np.save(matrix_file, vectors)
+    with open(vocabulary_file(matrix_file), "w", encoding="utf-8") as vocab_file:
+        for word in words:
+            vocab_file.write(word + "\n")
+    return matrix_file
+
+def vocabulary_file(matrix_file):
+    """
+    Gets the name of the vocabulary file that goes with a vector matrix file
+    (the same as food2vec.vocabulary_file, which we can't import early).
+
+    Arguments:
+        matrix_file: The .npy file of vectors.
+    """
+    return os.path.splitext(matrix_file)[0] + ".vocab"
+
+def time_calls(call, min_seconds=MIN_SECONDS):
+    """
+    Calls a function repeatedly (after one call to warm up), returning the time
+    each call took in seconds.
+
+    Arguments:
+        call: Function to call; it's given the number of the call.
+        min_seconds: How long to keep calling it for (at least MIN_CALLS times).
+    """
+    # The first call warms up the caches, so it isn't counted.
+    call(0)
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < MAX_CALLS and (
+            len(latencies) < MIN_CALLS or time.perf_counter() - start < min_seconds):
+        call_start = time.perf_counter()
+        call(len(latencies))
+        latencies.append(time.perf_counter() - call_start)
+    return latencies
+
+def peak_memory(call, calls=MEMORY_CALLS):
+    """
+    Gets the peak memory (in bytes) allocated during a few calls of a function.
+    This is done separately from the timing, as tracemalloc slows things down.
+
+    Arguments:
+        call: Function to call; it's given the number of the call.
+        calls: How many times to call it.
+    """
+    tracemalloc.start()
+    try:
+        for i in range(calls):
+            call(i)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def summarize(latencies, items_per_call, peak_bytes):
+    """
+    Summarizes the timings of a benchmark as a dictionary.
+
+    Arguments:
+        latencies: Time taken by each call, in seconds.
+        items_per_call: How many recipes (or pairs) each call handles.
+        peak_bytes: Peak memory allocated during a call.
+    """
+    total = sum(latencies)
+    return {"calls": len(latencies),
+            "items_per_call": items_per_call,
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "median_ms": statistics.median(latencies) * 1000,
+            "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+            "min_ms": min(latencies) * 1000,
+            "throughput": len(latencies) * items_per_call / total if total else 0.0,
+            "peak_kib": peak_bytes / 1024}
+
+def population_benchmarks(cookie_generation, recipes, fitness_pool=None):
+    """
+    Gets the benchmarks to run on a population, as a list of (name, call,
+    items per call) tuples.
+
+    Arguments:
+        cookie_generation: The cookie_generation module.
+        recipes: The population to benchmark on.
+        fitness_pool: FitnessPool to rank recipes with, if any.
+    """
+    size = len(recipes)
+
+    def each_recipe(method):
+        return lambda i: method(recipes[i % size])
+
+    def combine(i):
+        rng = random.Random(i)
+        recipe1, recipe2 = rng.sample(recipes, 2)
+        recipe1.new_recipe_combo(recipe2)
+
+    def rank(_):
+        cookie_generation.recipe_rankings(recipes, fitness_pool=fitness_pool)
+
+    # Generations are run one after another, as they would be by main().
+    state = {"population": list(recipes),
+             "cache": cookie_generation.FitnessCache()}
+    def generation(_):
+        state["population"] = cookie_generation.genetic_iteration(
+            state["population"], state["cache"], fitness_pool, "tournament", size)
+
+    recipe_class = type(recipes[0])
+    return [("fitness_level", each_recipe(recipe_class.fitness_level), 1),
+            ("pair_score", each_recipe(recipe_class.pair_score), 1),
+            ("result_score", each_recipe(recipe_class.result_score), 1),
+            ("food2vec_score", each_recipe(recipe_class.food2vec_score), 1),
+            ("new_recipe_combo", combine, 1),
+            ("recipe_rankings", rank, size),
+            ("genetic_iteration", generation, size)]
+
+def read_ingredient_lines(filename=INGREDIENT_LINES_FILE):
+    """
+    Reads a corpus of ingredient lines, returning a list of the lines of each
+    recipe.
+
+    Arguments:
+        filename: The corpus file.
+    """
+    with open(filename, "r", encoding="utf-8") as lines_file:
+        recipes = [[line for line in recipe.splitlines() if line.strip()]
+                   for recipe in lines_file.read().split("\n\n")]
+    return [recipe for recipe in recipes if recipe]
+
+def run_parser_benchmarks(filename=INGREDIENT_LINES_FILE, line_counts=None,
+                          min_seconds=MIN_SECONDS):
+    """
+    Benchmarks parse_ingredient_lines on a corpus of ingredient lines, repeated
+    until there are enough lines, returning a dictionary of results keyed by
+    "parse_ingredient_lines/lines". The throughput is in lines per second.
+
+    Arguments:
+        filename: The corpus file.
+        line_counts: How many lines to parse per call.
+        min_seconds: Minimum time to spend on each benchmark.
+    """
+    ingredient_parser = importlib.import_module("ingredient_parser")
+    corpus = read_ingredient_lines(filename)
+    results = dict()
+    for line_count in line_counts or DEFAULT_LINE_COUNTS:
+        recipes = []
+        num_lines = 0
+        while num_lines < line_count:
+            recipe = corpus[len(recipes) % len(corpus)]
+            recipes.append(recipe)
+            num_lines += len(recipe)
+
+        def call(_, recipes=recipes):
+            for recipe in recipes:
+                ingredient_parser.parse_ingredient_lines(recipe)
+
+        latencies = time_calls(call, min_seconds)
+        key = "parse_ingredient_lines/{0}".format(line_count)
+        results[key] = summarize(latencies, num_lines, peak_memory(call))
+        print_result(key, results[key])
+    return results
+
+def run_benchmarks(sizes, num_ingredients=DEFAULT_INGREDIENTS, seed=0,
+                   min_seconds=MIN_SECONDS, workers=None, compact=False):
+    """
+    Runs every benchmark on a synthetic population of each size, returning a
+    dictionary of results keyed by "benchmark/size".
+
+    Arguments:
+        sizes: Population sizes to benchmark.
+        num_ingredients: How many ingredients each synthetic recipe has.
+        seed: Seed for the random number generators.
+        min_seconds: Minimum time to spend on each benchmark.
+        workers: Number of fitness worker processes to rank with (None to rank
+            in this process).
+        compact: Whether to benchmark CompactRecipes rather than Recipes.
+    """
+    cookie_generation = importlib.import_module("cookie_generation")
+    fitness_pool = cookie_generation.FitnessPool(workers) if workers else None
+    results = dict()
+    try:
+        for size in sizes:
+            inspiring_set = generate_inspiring_set(max(size, 2), num_ingredients, seed)
+            for name, call, items_per_call in population_benchmarks(
+                    cookie_generation, [cookie_generation.convert_format(recipe, compact)
+                                        for recipe in inspiring_set], fitness_pool):
+                random.seed(seed)
+                latencies = time_calls(call, min_seconds)
+                peak_bytes = peak_memory(call)
+                key = "{0}/{1}".format(name, size)
+                results[key] = summarize(latencies, items_per_call, peak_bytes)
+                print_result(key, results[key])
+    finally:
+        if fitness_pool:
+            fitness_pool.close()
+    return results
+
+def print_result(key, result, note=""):
+    """
+    Prints one line of results.
+
+    Arguments:
+        key: Name of the benchmark and population size.
+        result: Summary of the benchmark.
+        note: Anything to add at the end of the line.
+    """
+    print("{0:<24} {1:>10.3f} ms {2:>12.1f}/s {3:>12.1f} KiB {4}".format(
+        key, result["median_ms"], result["throughput"], result["peak_kib"], note).rstrip())
+
+def compare_results(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares results to a baseline, returning a list of (benchmark, metric,
+    baseline value, new value) tuples for every regression: a median latency
+    or peak memory more than threshold times higher than the baseline's.
+
+    Arguments:
+        results: The new results.
+        baseline: The baseline results.
+        threshold: Fraction of the baseline a metric may grow by.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in ("median_ms", "peak_kib"):
+            old_value = baseline[key][metric]
+            if result[metric] > old_value * (1 + threshold):
+                regressions.append((key, metric, old_value, result[metric]))
+    return regressions
+
+def main():
+    """
+    Main function - runs the benchmarks, saves the results and compares them
+    to the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the genetic algorithm.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Population sizes to benchmark.")
+    parser.add_argument("--ingredients", type=int, default=DEFAULT_INGREDIENTS,
+                        help="Number of ingredients in each synthetic recipe.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the synthetic data and the genetic algorithm.")
+    parser.add_argument("--min-time", type=float, default=MIN_SECONDS,
+                        help="Minimum number of seconds to spend on each benchmark.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Rank recipes with this many fitness worker processes "
+                        "(by default, ranking is done in this process).")
+    parser.add_argument("--compact", action="store_true",
+                        help="Benchmark CompactRecipes instead of Recipes.")
+    parser.add_argument("--vectors", default=None,
+                        help="food2vec vectors to use, instead of generating some.")
+    parser.add_argument("--output", default=RESULTS_FILE,
+                        help="Where to save the results.")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help="Baseline results to compare to.")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Fraction slower than the baseline that counts as a "
+                        "regression.")
+    parser.add_argument("--ingredient-lines", default=INGREDIENT_LINES_FILE,
+                        help="Corpus of ingredient lines to benchmark the parser on.")
+    parser.add_argument("--line-counts", type=int, nargs="+", default=DEFAULT_LINE_COUNTS,
+                        help="Numbers of ingredient lines to parse per call.")
+    parser.add_argument("--write-inspiring-set", metavar="FILE", default=None,
+                        help="Just write a synthetic inspiring set (of the first size) "
+                        "to FILE.")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # cookie_generation loads the vectors when it's imported, so they have
+        # to be picked before then.
+        os.environ["FOOD2VEC_VECTORS"] = args.vectors or write_synthetic_vectors(
+            folder, seed=args.seed)
+
+        if args.write_inspiring_set:
+            with open(args.write_inspiring_set, "w") as iset_file:
+                json.dump(generate_inspiring_set(args.sizes[0], args.ingredients,
+                                                 args.seed), iset_file)
+            return 0
+
+        results = run_benchmarks(args.sizes, args.ingredients, args.seed,
+                                 args.min_time, args.workers, args.compact)
+        results.update(run_parser_benchmarks(args.ingredient_lines, args.line_counts,
+                                             args.min_time))
+
+    report = {"config": {"sizes": args.sizes,
+                         "ingredients": args.ingredients,
+                         "seed": args.seed,
+                         "workers": args.workers,
+                         "compact": args.compact,
+                         "ingredient_lines": args.ingredient_lines,
+                         "line_counts": args.line_counts,
+                         "synthetic_vectors": not args.vectors,
+                         "python": platform.python_version(),
+                         "platform": platform.platform()},
+              "results": results}
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print("Saved results to {0}.".format(args.output))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print("Saved baseline to {0}.".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {0} to compare to.".format(args.baseline))
+        return 0
+    with open(args.baseline, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline["config"] != report["config"]:
+        print("Warning: the baseline was run with a different configuration.")
+
+    regressions = compare_results(results, baseline["results"], args.threshold)
+    for key, metric, old_value, new_value in regressions:
+        print("REGRESSION {0} {1}: {2:.3f} -> {3:.3f}".format(key, metric, old_value,
+                                                              new_value))
+    if not regressions:
+        print("No regressions against {0}.".format(args.baseline))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+checkpoints.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Saves the state of a run of the genetic algorithm (the population, the state
+of the random number generator and the run's configuration) every so often, so
+an interrupted run can be resumed. Checkpoints are compressed .npz files, with
+every ingredient and category name stored once, and are written atomically by
+a background thread so the generation loop never waits on the disk.
+"""
+
+import os
+import json
+import glob
+import queue
+import tempfile
+import threading
+
+import numpy as np
+
+from knowledge_base import StringPool, unpack_strings
+
+# Bump this whenever the layout of a checkpoint changes.
+CHECKPOINT_VERSION = 1
+CHECKPOINT_PATTERN = "checkpoint-{0:06d}.npz"
+# How many of the latest checkpoints to keep.
+CHECKPOINTS_KEPT = 3
+
+class Checkpoint:
+    """
+    Checkpoint class: the state of a run after a number of generations. The
+    population is packed into arrays as soon as the checkpoint is made, as the
+    recipes themselves keep changing while the run goes on.
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.header = json.loads(arrays["header"].tobytes().decode("utf-8"))
+
+    @staticmethod
+    def from_population(generation, recipe_list, rng_state, config):
+        """
+        Makes a checkpoint from a population of recipes.
+
+        Arguments:
+            generation: How many generations have been run.
+            recipe_list: The population (anything with get_recipe_dict).
+            rng_state: State of the random module, from random.getstate().
+            config: Dictionary of the run's configuration (must be JSON).
+        """
+        pool = StringPool()
+        category_ids = []
+        ingredient_ids = []
+        amounts = []
+        recipe_offsets = [0]
+        for recipe in recipe_list:
+            for category, ingredients in recipe.get_recipe_dict().items():
+                for ingredient, amount in ingredients:
+                    category_ids.append(pool.get_id(str(category)))
+                    ingredient_ids.append(pool.get_id(str(ingredient)))
+                    amounts.append(amount.get_num())
+            recipe_offsets.append(len(ingredient_ids))
+
+        rng_version, rng_internal_state, rng_gauss = rng_state
+        header = {"version": CHECKPOINT_VERSION,
+                  "generation": generation,
+                  "config": config,
+                  "rng_version": rng_version,
+                  "rng_gauss": rng_gauss}
+        arrays = {"category_ids": np.array(category_ids, dtype=np.int32),
+                  "ingredient_ids": np.array(ingredient_ids, dtype=np.int32),
+                  "amounts": np.array(amounts, dtype=np.float64),
+                  "recipe_offsets": np.array(recipe_offsets, dtype=np.int64),
+                  "rng_state": np.array(rng_internal_state, dtype=np.uint32),
+                  "header": np.frombuffer(json.dumps(header).encode("utf-8"),
+                                          dtype=np.uint8)}
+        arrays["strings"], arrays["string_offsets"] = pool.to_arrays()
+        return Checkpoint(arrays)
+
+    @property
+    def generation(self):
+        """
+        How many generations had been run when the checkpoint was made.
+        """
+        return self.header["generation"]
+
+    @property
+    def config(self):
+        """
+        The configuration of the run.
+        """
+        return self.header["config"]
+
+    def get_rng_state(self):
+        """
+        Gets the state of the random module, to pass to random.setstate().
+        """
+        return (self.header["rng_version"], tuple(self.arrays["rng_state"].tolist()),
+                self.header["rng_gauss"])
+
+    def get_recipe_dicts(self):
+        """
+        Gets the population, as a list with a dictionary for each recipe that
+        maps each category to a list of (ingredient name, amount) tuples.
+        """
+        strings = unpack_strings(self.arrays["strings"], self.arrays["string_offsets"])
+        categories = [strings[i] for i in self.arrays["category_ids"].tolist()]
+        ingredients = [strings[i] for i in self.arrays["ingredient_ids"].tolist()]
+        amounts = self.arrays["amounts"].tolist()
+        offsets = self.arrays["recipe_offsets"].tolist()
+
+        recipe_dicts = []
+        for start, end in zip(offsets, offsets[1:]):
+            recipe_dict = dict()
+            for i in range(start, end):
+                recipe_dict.setdefault(categories[i], []).append((ingredients[i], amounts[i]))
+            recipe_dicts.append(recipe_dict)
+        return recipe_dicts
+
+    def save(self, filename):
+        """
+        Saves the checkpoint. The file is written atomically, so a run that's
+        interrupted while saving never leaves half a checkpoint behind.
+
+        Arguments:
+            filename: Where to save the checkpoint.
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        file_handle, temp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_handle, "wb") as checkpoint_file:
+                np.savez_compressed(checkpoint_file, **self.arrays)
+            # mkstemp only lets us read the file.
+            os.chmod(temp_filename, 0o644)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    @staticmethod
+    def load(filename):
+        """
+        Loads a checkpoint.
+
+        Arguments:
+            filename: The checkpoint to load.
+        """
+        with np.load(filename, allow_pickle=False) as checkpoint_file:
+            checkpoint = Checkpoint({name: checkpoint_file[name]
+                                     for name in checkpoint_file.files})
+        if checkpoint.header.get("version") != CHECKPOINT_VERSION:
+            raise ValueError("{0} is from a different version of the checkpoint "
+                             "format".format(filename))
+        return checkpoint
+
+def checkpoint_files(folder):
+    """
+    Gets the checkpoints in a folder, oldest first.
+
+    Arguments:
+        folder: The folder to look in.
+    """
+    return sorted(glob.glob(os.path.join(folder, CHECKPOINT_PATTERN.replace("{0:06d}", "*"))))
+
+def latest_checkpoint(folder):
+    """
+    Gets the name of the latest checkpoint in a folder, or None if there isn't
+    one.
+
+    Arguments:
+        folder: The folder to look in.
+    """
+    files = checkpoint_files(folder)
+    return files[-1] if files else None
+
+class CheckpointWriter:
+    """
+    CheckpointWriter class: saves checkpoints to a folder on a background
+    thread, deleting all but the latest few. Any error while saving is raised
+    the next time a checkpoint is submitted, or when the writer is closed.
+    """
+    def __init__(self, folder, kept=CHECKPOINTS_KEPT):
+        self.folder = folder
+        self.kept = kept
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        Saves checkpoints from the queue until it gets None.
+        """
+        while True:
+            checkpoint = self.queue.get()
+            if checkpoint is None:
+                return
+            try:
+                checkpoint.save(os.path.join(self.folder,
+                                             CHECKPOINT_PATTERN.format(checkpoint.generation)))
+                for old_file in checkpoint_files(self.folder)[:-self.kept]:
+                    os.remove(old_file)
+            except Exception as error: # pylint: disable=broad-except
+                self.error = error
+
+    def check(self):
+        """
+        Raises the error from the last checkpoint that failed to save, if any.
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, checkpoint):
+        """
+        Queues a checkpoint to be saved, without waiting for it.
+
+        Arguments:
+            checkpoint: The Checkpoint to save.
+        """
+        self.check()
+        self.queue.put(checkpoint)
+
+    def close(self):
+        """
+        Waits for every queued checkpoint to be saved, and stops the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -5,6 +5,7 @@ CSCI 3725, PQ3
 Generates cookie recipes from an inspiring set and knowledge base!
 """
 
+import time
 import random
 import argparse
 import os
@@ -12,42 +13,188 @@ import shutil
 import json
 import math
 import itertools
-import statistics
+import contextlib
+import traceback
+import collections
+import multiprocessing
 
-import inflect
 import numpy as np
-from joblib import Parallel, delayed
 from tqdm import tqdm
 
 
 import recipe_markov
 import food2vec
-
-# Opens both the translation and substitution data.
-with open('translation_dict2.json', 'r') as json_file:
-    TRANS_DATA = json.load(json_file)
-with open('sub_dict2.json', 'r') as json_file:
-    SUB_DATA = json.load(json_file)
+import shared_tables
+import run_metrics
+import profiling
+import checkpoints
+import knowledge_base
+from ingredient_registry import REGISTRY
+
+# Gets both the translation and substitution data, and the word embeddings,
+# from the knowledge base snapshot.
+KB = knowledge_base.get_knowledge_base()
+TRANS_DATA = KB.trans_data
+SUB_DATA = KB.sub_data
 
 UT = food2vec.Word2VecUtils()
 
 
-WORD_EMBED_VALS = np.load('ingred_word_emb.npy', allow_pickle=True).item()
-INGRED_CATEGORIES = np.load('ingred_categories.npy', allow_pickle=True).item()
-INGREDIENT_LIST = sorted(WORD_EMBED_VALS.keys())
+WORD_EMBED_VALS = KB.word_embed_vals
+INGRED_CATEGORIES = KB.ingred_categories
+INGREDIENT_LIST = KB.embed_names
+
+# The embeddings compiled into one contiguous matrix (a row per ingredient, in
+# INGREDIENT_LIST order), plus a lookup from ingredient name to its row.
+INGREDIENT_INDEX = {ingredient: row for row, ingredient in enumerate(INGREDIENT_LIST)}
+EMBED_MATRIX = KB.embed_matrix
+
+REGISTRY.add_vocabulary("subs", SUB_DATA)
+REGISTRY.add_vocabulary("embedding", INGREDIENT_LIST)
+
+# Default number of recipe fitness levels to remember between generations.
+FITNESS_CACHE_SIZE = 10000
+
+# Categories of ingredients that we don't allow in our cookies.
+BANNED_CATEGORIES = ["nuts", "seeds", "liquor", "liqueurs", "brandy", "wines",
+                     "aperitif", "beer", "bitters", "fflakfat"]
+# Fitness level of a recipe with a banned ingredient in it.
+BANNED_FITNESS = (float("inf"), -float("inf"), -float("inf"))
 
+# How many recipes compete to be each parent in tournament selection.
+TOURNAMENT_SIZE = 3
+
+# Where checkpoints go, and how many generations apart they are by default.
+ITERATIONS_FOLDER = "iterations"
+CHECKPOINT_INTERVAL = 10
+
+# How many generations islands run between migrations by default, and how many
+# recipes migrate from each island.
+MIGRATION_INTERVAL = 5
+MIGRANTS = 2
 
 
 def similarity(ing_1, ing_2):
     """Returns the similarity between two ingredients based on our data."""
-    embed_ing_1 = WORD_EMBED_VALS[ing_1]
-    embed_ing_2 = WORD_EMBED_VALS[ing_2]
+    embed_ing_1 = EMBED_MATRIX[INGREDIENT_INDEX[ing_1]]
+    embed_ing_2 = EMBED_MATRIX[INGREDIENT_INDEX[ing_2]]
     return np.dot(embed_ing_1, embed_ing_2)
 
+def embedding_rows(ingredients):
+    """
+    Finds the rows of EMBED_MATRIX that correspond to a list of ingredients.
+    Ingredients that aren't in the model directly are approximated: any kind of
+    flour counts as wheat, otherwise each word of the name that is in the model
+    is used.
+
+    Arguments:
+        ingredients: The ingredients (or ingredient names) to look up.
+    """
+    rows = []
+    for ingredient in ingredients:
+        row = INGREDIENT_INDEX.get(str(ingredient))
+        if row is not None:
+            rows.append(row)
+        elif "flour" in str(ingredient):
+            rows.append(INGREDIENT_INDEX["wheat"])
+        else:
+            for ingredient_part in str(ingredient).split(" "):
+                if ingredient_part in INGREDIENT_INDEX:
+                    rows.append(INGREDIENT_INDEX[ingredient_part])
+    return rows
+
+def get_pair_score(ingredients):
+    """
+    Gets the mean similarity of every pair of ingredients in a list, using the
+    embedding matrix.
+
+    Arguments:
+        ingredients: The ingredients (or ingredient names) of a recipe.
+    """
+    rows = embedding_rows(ingredients)
+    if len(rows) < 2:
+        return 0.25 # If we can't find similarities.
+
+    # Every pairwise similarity at once: the upper triangle of the Gram
+    # matrix holds each ingredient pair exactly once.
+    embeddings = EMBED_MATRIX[rows]
+    gram = embeddings @ embeddings.T
+    return float(np.mean(gram[np.triu_indices(len(rows), 1)], dtype=np.float64))
+
+def is_banned(ingredients):
+    """
+    Checks whether any of a list of ingredients is prohibited (kiwi, alcohol or
+    nuts).
+
+    Arguments:
+        ingredients: The ingredients (or ingredient names) of a recipe.
+    """
+    for ingredient in ingredients:
+        translation = TRANS_DATA.get(str(ingredient))
+        if not translation:
+            # Some ingredients are plural, but plural forms may not appear
+            # in translation dictionary, hence we would convert to a singular
+            # and see whether it's in there or not.
+            translation = TRANS_DATA.get(REGISTRY.singular(ingredient))
+        if translation:
+            if translation == "kiwi fruit":
+                return True
+
+            if SUB_DATA[translation]["category"] in BANNED_CATEGORIES:
+                return True
+    return False
+
+def add_timing(timings, name, start):
+    """
+    Adds the time since start to a dictionary of timings (if we're keeping
+    them), and returns the current time so the next timing can start from it.
+
+    Arguments:
+        timings: Dictionary of times in seconds, or None.
+        name: Which time to add to.
+        start: When the thing being timed started (from time.perf_counter).
+    """
+    now = time.perf_counter()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + now - start
+    return now
+
+def get_fitness_levels(ingredient_lists, timings=None):
+    """
+    Gets the fitness levels (result score, pair score and food2vec score) of a
+    bunch of recipes, given as lists of ingredient names. The Markov chain
+    result scores of all of the allowed recipes are worked out in one batch.
+
+    Arguments:
+        ingredient_lists: List of the ingredient names of each recipe.
+        timings: Dictionary to add the time spent on each part of the fitness
+            function to, if any.
+    """
+    start = time.perf_counter()
+    fitness_levels = [BANNED_FITNESS] * len(ingredient_lists)
+    allowed = [i for i, ingredients in enumerate(ingredient_lists)
+               if not is_banned(ingredients)]
+    allowed_lists = [ingredient_lists[i] for i in allowed]
+    start = add_timing(timings, "banned_check", start)
+    # Each part of the fitness is worked out for every recipe in turn, so each
+    # can be timed on its own.
+    result_scores = recipe_markov.get_probability_batch(allowed_lists)
+    start = add_timing(timings, "result_score", start)
+    pair_scores = [get_pair_score(ingredients) for ingredients in allowed_lists]
+    start = add_timing(timings, "pair_score", start)
+    food2vec_scores = [UT.food2vec_score(ingredients) for ingredients in allowed_lists]
+    add_timing(timings, "food2vec_score", start)
+
+    for i, fitness in zip(allowed, zip(result_scores, pair_scores, food2vec_scores)):
+        fitness_levels[i] = fitness
+    return fitness_levels
+
 class Category:
     """
     Defines a category.
     """
+    __slots__ = ("category_name",)
+
     def __init__(self, category_name):
         self.category_name = category_name
 
@@ -61,6 +208,8 @@ class Ingredient:
     """
     Defines an ingredient.
     """
+    __slots__ = ("ingredient_name",)
+
     def __init__(self, ingredient_name):
         self.ingredient_name = ingredient_name
 
@@ -76,6 +225,8 @@ class Amount:
     """
     Defines an amount of an ingredient.
     """
+    __slots__ = ("amount",)
+
     def __init__(self, amount):
         self.amount = float(amount)
 
@@ -182,6 +333,13 @@ class Recipe:
         """
         return list(itertools.chain.from_iterable(self.recipe_dict.values()))
 
+    def get_ingredient_names(self):
+        """
+        Gets a list of the names of all of the ingredients in the recipe.
+        """
+        return [str(ingredient) for ingredient, _ in
+                itertools.chain.from_iterable(self.recipe_dict.values())]
+
     def get_ingredient_amount(self, category, ingredient):
         """
         For an ingredient in a category, get its amount.
@@ -208,11 +366,7 @@ class Recipe:
         all of the ingredients, and returns the score that the food2vec
         model gives.
         """
-        query = []
-        for ingredient, _ in itertools.chain.from_iterable(self.recipe_dict.values()):
-            query.append(str(ingredient))
-
-        return UT.food2vec_score(query)
+        return UT.food2vec_score(self.get_ingredient_names())
 
     def result_score(self):
         """
@@ -221,10 +375,7 @@ class Recipe:
         the popularity of the ingredients in the recipe. We therefore generate a
         score to show how popular the ingredients are together.
         """
-        query = []
-        for ingredient, _ in itertools.chain.from_iterable(self.recipe_dict.values()):
-            query.append(str(ingredient))
-        return recipe_markov.get_probability(query)
+        return recipe_markov.get_probability(self.get_ingredient_names())
 
     def pair_score(self):
         """
@@ -233,27 +384,7 @@ class Recipe:
         by using Prof Harmon's model. It will return the mean similarity score
         of all possible ingredient pairs.
         """
-        ingredients_in_model = []
-        for ingredient, _ in itertools.chain.from_iterable(self.recipe_dict.values()):
-            if str(ingredient) in INGREDIENT_LIST:
-                ingredients_in_model.append(ingredient)
-            elif "flour" in str(ingredient):
-                ingredients_in_model.append("wheat")
-            else:
-                for ingredient_part in str(ingredient).split(" "):
-                    if ingredient_part in INGREDIENT_LIST:
-                        ingredients_in_model.append(Ingredient(ingredient_part))
-
-        pairings = list(itertools.combinations(ingredients_in_model, 2))
-        similarities = []
-
-        for ingredient_1, ingredient_2 in pairings:
-            similarities.append(float(similarity(str(ingredient_1), str(ingredient_2))))
-
-        if similarities:
-            return statistics.mean(similarities)
-
-        return 0.25 # If we can't find similarities.
+        return get_pair_score(self.get_ingredient_names())
 
     def fitness_level(self):
         """
@@ -263,25 +394,7 @@ class Recipe:
         Else it will use a two-pronged strategy of multiplying the food2vec model
         score with the result score to get a fitness_level score.
         """
-        i_engine = inflect.engine()
-        banned_categories = ["nuts", "seeds", "liquor", "liqueurs", "brandy",
-                             "wines", "aperitif", "beer", "bitters", "fflakfat"]
-        for ingredient, _ in itertools.chain.from_iterable(self.recipe_dict.values()):
-            translation = TRANS_DATA.get(str(ingredient))
-            if not translation:
-                # Some ingredients are plural, but plural forms may not appear
-                # in translation dictionary, hence we would convert to a singular
-                # and see whether it's in there or not.
-                translation = TRANS_DATA.get(i_engine.singular_noun(
-                    str(ingredient)))
-            if translation:
-                if translation == "kiwi fruit":
-                    return float("inf"), -float("inf"), -float("inf")
-
-                if SUB_DATA[translation]["category"] in banned_categories:
-                    return float("inf"), -float("inf"), -float("inf")
-
-        return self.result_score(), self.pair_score(), self.food2vec_score()
+        return get_fitness_levels([self.get_ingredient_names()])[0]
 
     @staticmethod
     def get_ingredient_string(ingredient=None):
@@ -294,17 +407,7 @@ class Recipe:
             ingredient - an Ingredient instance where we want to find the
                 corresponding string.
         """
-        i_engine = inflect.engine()
-        string = str(ingredient).lower()
-        if i_engine.singular_noun(string):
-            string = str(i_engine.singular_noun(string)).split(" ")
-        else:
-            string = string.split(" ")
-        for i in range(len(string), -1, -1):
-            for combo in itertools.combinations(string, i):
-                if SUB_DATA.get(" ".join(combo)):
-                    return " ".join(combo)
-        return None
+        return REGISTRY.resolve(ingredient, "subs")
 
     @staticmethod
     def substitution(ingredient=None):
@@ -342,11 +445,7 @@ class Recipe:
             treat = random.randint(0, 4)
             if treat > 3:
                 # Get an ingredient using the food2vec model.
-                query = []
-                for ingredient, _ in itertools.chain.from_iterable(self.recipe_dict.values()):
-                    query.append(str(ingredient))
-
-                ingredient, _ = UT.get_new_ingredient(query)
+                ingredient, _ = UT.get_new_ingredient(self.get_ingredient_names())
             else:
                 ingredient = teehee_specialtreats[treat]
             self.add_ingredient("misc", ingredient.lower(), Amount(5))
@@ -430,6 +529,17 @@ class Recipe:
         """
         return self.recipe_dict
 
+    def fingerprint(self):
+        """
+        Gets a hashable fingerprint of the recipe's content: the sorted
+        ingredients in each category. Recipes with the same fingerprint have
+        the same fitness level, whatever their amounts.
+        """
+        return tuple(sorted((str(category),
+                             tuple(sorted(str(ingredient) for ingredient, _ in ingredients)))
+                            for category, ingredients in self.recipe_dict.items()
+                            if ingredients))
+
     def normalization(self):
         """
         Normalises the recipe such that the total amount is 100 ounces.
@@ -498,19 +608,465 @@ class Recipe:
         return "Recipe({0})".format(output)
 
 
-def recipe_pairs(recipe_list):
+class FitnessCache:
+    """
+    FitnessCache class: remembers the fitness levels of recipes we've already
+    scored, keyed by recipe fingerprint, evicting the least recently used once
+    it's full.
+    """
+    def __init__(self, max_size=FITNESS_CACHE_SIZE):
+        self.max_size = max_size
+        self.fitness_levels = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.fitness_levels)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.fitness_levels
+
+    def get(self, fingerprint):
+        """
+        Gets the fitness level of a recipe, or None if it's not in the cache.
+
+        Arguments:
+            fingerprint: Fingerprint of the recipe.
+        """
+        fitness = self.fitness_levels.get(fingerprint)
+        if fitness is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.fitness_levels.move_to_end(fingerprint)
+        return fitness
+
+    def peek(self, fingerprint):
+        """
+        Gets the fitness level of a recipe, or None if it's not in the cache,
+        without counting it as a hit or a miss (for recipes whose lookup has
+        already been counted).
+
+        Arguments:
+            fingerprint: Fingerprint of the recipe.
+        """
+        return self.fitness_levels.get(fingerprint)
+
+    def put(self, fingerprint, fitness):
+        """
+        Adds the fitness level of a recipe to the cache.
+
+        Arguments:
+            fingerprint: Fingerprint of the recipe.
+            fitness: The recipe's fitness level.
+        """
+        if self.max_size <= 0:
+            return
+        self.fitness_levels[fingerprint] = fitness
+        self.fitness_levels.move_to_end(fingerprint)
+        while len(self.fitness_levels) > self.max_size:
+            self.fitness_levels.popitem(last=False)
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return "Fitness cache: {0} hits, {1} misses ({2:.1%} hit rate), " \
+               "{3} duplicates within a generation".format(self.hits, self.misses,
+                                                           hit_rate, self.duplicates)
+
+class StringTable:
+    """
+    StringTable class: interns strings, giving each distinct one a small
+    integer ID.
+    """
+    __slots__ = ("strings", "ids")
+
+    def __init__(self):
+        self.strings = []
+        self.ids = dict()
+
+    def __len__(self):
+        return len(self.strings)
+
+    def get_id(self, string):
+        """
+        Gets the ID of a string, adding it to the table if it's new.
+
+        Arguments:
+            string: The string to get the ID of.
+        """
+        string = str(string)
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.ids[string] = string_id
+        return string_id
+
+    def get_string(self, string_id):
+        """
+        Gets the string with a given ID.
+
+        Arguments:
+            string_id: The ID of the string.
+        """
+        return self.strings[string_id]
+
+# The interned ingredient and category names used by CompactRecipe.
+INGREDIENT_NAMES = StringTable()
+CATEGORY_NAMES = StringTable()
+
+def amount_value(amount):
+    """
+    Turns a float32 amount back into the float it was made from (so 0.17 is
+    0.17, not 0.17000000178813934).
+
+    Arguments:
+        amount: The float32 amount.
+    """
+    return float(str(amount))
+
+class CompactRecipe:
+    """
+    CompactRecipe class: a recipe stored as three parallel arrays (ingredient
+    IDs, category IDs and float32 amounts) rather than a dictionary of lists
+    of objects, which makes it much smaller and cheap to pickle and hash. The
+    ingredients of each category are kept together, in the order they were
+    added, so it behaves just like a Recipe.
+    """
+    __slots__ = ("ingredient_ids", "category_ids", "amounts")
+
+    def __init__(self, ingredient_ids=None, category_ids=None, amounts=None):
+        self.ingredient_ids = np.array(ingredient_ids if ingredient_ids is not None else [],
+                                       dtype=np.int32)
+        self.category_ids = np.array(category_ids if category_ids is not None else [],
+                                     dtype=np.int32)
+        self.amounts = np.array(amounts if amounts is not None else [], dtype=np.float32)
+
+    @staticmethod
+    def from_recipe(recipe):
+        """
+        Makes a CompactRecipe with the same contents as a Recipe.
+
+        Arguments:
+            recipe: The Recipe to convert.
+        """
+        compact_recipe = CompactRecipe()
+        compact_recipe.set_recipe_dict(recipe.get_recipe_dict())
+        return compact_recipe
+
+    @staticmethod
+    def from_names(ingredient_names, category_names, amounts):
+        """
+        Makes a CompactRecipe from the names of its ingredients and categories.
+
+        Arguments:
+            ingredient_names: Name of each ingredient.
+            category_names: Name of the category of each ingredient.
+            amounts: Amount of each ingredient.
+        """
+        return CompactRecipe([INGREDIENT_NAMES.get_id(name) for name in ingredient_names],
+                             [CATEGORY_NAMES.get_id(name) for name in category_names],
+                             amounts)
+
+    def to_recipe(self):
+        """
+        Makes a Recipe with the same contents as this one.
+        """
+        return Recipe(self.get_recipe_dict())
+
+    def set_recipe_dict(self, recipe_dict):
+        """
+        Replaces the contents of this recipe with those of a recipe dictionary.
+
+        Arguments:
+            recipe_dict: The recipe in dictionary format.
+        """
+        ingredient_ids = []
+        category_ids = []
+        amounts = []
+        for category, ingredients in recipe_dict.items():
+            category_id = CATEGORY_NAMES.get_id(category)
+            for ingredient, amount in ingredients:
+                ingredient_ids.append(INGREDIENT_NAMES.get_id(ingredient))
+                category_ids.append(category_id)
+                amounts.append(amount.get_num())
+        self.__init__(ingredient_ids, category_ids, amounts)
+
+    def __len__(self):
+        return len(self.ingredient_ids)
+
+    def add_ingredient(self, category, ingredient, amount):
+        """
+        Adds ingredient to the recipe, checking for existing ingredients (in
+        which case the existing amount is kept).
+
+        Arguments:
+            category: Category of ingredient to add.
+            ingredient: Ingredient to add
+            amount: Amount to add.
+        """
+        category_id = CATEGORY_NAMES.get_id(category)
+        ingredient_id = INGREDIENT_NAMES.get_id(ingredient)
+        in_category = np.flatnonzero(self.category_ids == category_id)
+        if np.any(self.ingredient_ids[in_category] == ingredient_id):
+            return
+        # Keep the category's ingredients together.
+        position = in_category[-1] + 1 if len(in_category) else len(self)
+        self.ingredient_ids = np.insert(self.ingredient_ids, position, ingredient_id)
+        self.category_ids = np.insert(self.category_ids, position, category_id)
+        self.amounts = np.insert(self.amounts, position, amount.get_num())
+
+    def get_category(self):
+        """
+        Gets list of recipe categories.
+        """
+        return [CATEGORY_NAMES.get_string(category_id)
+                for category_id in dict.fromkeys(self.category_ids.tolist())]
+
+    def get_category_tuples(self):
+        """
+        Gets the tuples containing ingredients from each category.
+        """
+        return [[Ingredient(INGREDIENT_NAMES.get_string(ingredient_id)),
+                 Amount(amount_value(amount))]
+                for ingredient_id, amount in zip(self.ingredient_ids.tolist(), self.amounts)]
+
+    def get_ingredient_names(self):
+        """
+        Gets a list of the names of all of the ingredients in the recipe.
+        """
+        return [INGREDIENT_NAMES.get_string(ingredient_id)
+                for ingredient_id in self.ingredient_ids.tolist()]
+
+    def get_recipe_dict(self):
+        """
+        Gets the recipe in dictionary format (as a new dictionary).
+        """
+        recipe_dict = dict()
+        for category_id, ingredient in zip(self.category_ids.tolist(),
+                                           self.get_category_tuples()):
+            recipe_dict.setdefault(CATEGORY_NAMES.get_string(category_id), []).append(ingredient)
+        return recipe_dict
+
+    def fingerprint(self):
+        """
+        Gets a hashable fingerprint of the recipe's content, the same as
+        Recipe.fingerprint.
+        """
+        ingredients = dict()
+        for category_id, ingredient_id in zip(self.category_ids.tolist(),
+                                              self.ingredient_ids.tolist()):
+            ingredients.setdefault(category_id, []).append(
+                INGREDIENT_NAMES.get_string(ingredient_id))
+        return tuple(sorted((CATEGORY_NAMES.get_string(category_id), tuple(sorted(names)))
+                            for category_id, names in ingredients.items()))
+
+    def fitness_level(self):
+        """
+        Gets the fitness level of the recipe, just like Recipe.fitness_level.
+        """
+        return get_fitness_levels([self.get_ingredient_names()])[0]
+
+    # These only use get_ingredient_names.
+    food2vec_score = Recipe.food2vec_score
+    result_score = Recipe.result_score
+    pair_score = Recipe.pair_score
+
+    def substitute(self, row):
+        """
+        Maybe substitutes the ingredient at a row of the recipe, just like
+        Recipe.substitution, returning the ID of the (new) ingredient.
+
+        Arguments:
+            row: Position of the ingredient in the recipe.
+        """
+        ingredient = Recipe.substitution(INGREDIENT_NAMES.get_string(self.ingredient_ids[row]))
+        self.ingredient_ids[row] = INGREDIENT_NAMES.get_id(ingredient)
+        return int(self.ingredient_ids[row])
+
+    # Recipe.mystery_ingredient only uses get_ingredient_names and add_ingredient.
+    mystery_ingredient = Recipe.mystery_ingredient
+
+    def new_recipe_combo(self, other_recipe):
+        """
+        Creates a combination of two recipes, just like Recipe.new_recipe_combo
+        (including the substitutions it makes in the parents, and the random
+        numbers it uses), but working on the ID arrays directly.
+
+        Arguments:
+            other_recipe: CompactRecipe to combine this one with.
+        """
+        ingredient_ids = []
+        category_ids = []
+        amounts = []
+        added = set()
+        for category_id in dict.fromkeys(self.category_ids.tolist()
+                                         + other_recipe.category_ids.tolist()):
+            # Each parent's rows for the category, self's first.
+            rows = [(self, row) for row in np.flatnonzero(self.category_ids == category_id)]
+            rows += [(other_recipe, row)
+                     for row in np.flatnonzero(other_recipe.category_ids == category_id)]
+            for _ in range(math.ceil(len(rows) / 2)):
+                parent, row = rows[random.randint(0, len(rows) - 1)]
+                ingredient_id = parent.substitute(row)
+                # Like Recipe.add_ingredient, keep the first amount of repeats.
+                if (category_id, ingredient_id) not in added:
+                    added.add((category_id, ingredient_id))
+                    ingredient_ids.append(ingredient_id)
+                    category_ids.append(category_id)
+                    amounts.append(parent.amounts[row])
+        self.mystery_ingredient()
+        return CompactRecipe(ingredient_ids, category_ids, amounts)
+
+    def normalization(self):
+        """
+        Normalises the recipe such that the total amount is 100 ounces.
+        """
+        total_amount = float(np.sum(self.amounts, dtype=np.float64))
+        if len(self) and total_amount not in (0, 100):
+            self.amounts = (self.amounts * (100 / total_amount)).astype(np.float32)
+
+    def get_recipe(self, title):
+        """
+        Gets the recipe in Markdown format, so that it looks pretty!
+
+        Arguments:
+            title: The title of the recipe we want.
+        """
+        return self.to_recipe().get_recipe(title)
+
+    def __str__(self):
+        return str(self.to_recipe())
+
+    def __repr__(self):
+        return "CompactRecipe({0})".format(", ".join(
+            "{0}: {1} {2}".format(category, amount, ingredient)
+            for category, ingredient, amount in zip(
+                [CATEGORY_NAMES.get_string(i) for i in self.category_ids.tolist()],
+                self.get_ingredient_names(), map(amount_value, self.amounts))))
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactRecipe):
+            return NotImplemented
+        return (np.array_equal(self.ingredient_ids, other.ingredient_ids)
+                and np.array_equal(self.category_ids, other.category_ids)
+                and np.array_equal(self.amounts, other.amounts))
+
+    def __hash__(self):
+        return hash((self.ingredient_ids.tobytes(), self.category_ids.tobytes(),
+                     self.amounts.tobytes()))
+
+    def __reduce__(self):
+        # IDs only mean something in this process, so pickle the names of
+        # just the ingredients and categories that are used.
+        ingredient_ids, ingredient_index = np.unique(self.ingredient_ids, return_inverse=True)
+        category_ids, category_index = np.unique(self.category_ids, return_inverse=True)
+        return (unpickle_compact_recipe,
+                ([INGREDIENT_NAMES.get_string(i) for i in ingredient_ids.tolist()],
+                 ingredient_index.astype(np.int32),
+                 [CATEGORY_NAMES.get_string(i) for i in category_ids.tolist()],
+                 category_index.astype(np.int32),
+                 self.amounts))
+
+def unpickle_compact_recipe(ingredient_names, ingredient_index, category_names,
+                            category_index, amounts):
+    """
+    Rebuilds a pickled CompactRecipe, interning its names in this process.
+    """
+    ingredient_ids = np.array([INGREDIENT_NAMES.get_id(name) for name in ingredient_names],
+                              dtype=np.int32)
+    category_ids = np.array([CATEGORY_NAMES.get_id(name) for name in category_names],
+                            dtype=np.int32)
+    return CompactRecipe(ingredient_ids[ingredient_index], category_ids[category_index],
+                         amounts)
+
+def all_pairs(recipe_list, budget=None):
+    """
+    Generates every pair of recipes, in order, stopping after budget pairs if a
+    budget is given.
+
+    Arguments:
+        recipe_list: the list of recipes that we wish to make pairs from.
+        budget: the maximum number of pairs to make.
     """
-    This function creates pairs of recipes through using two simple for loops.
+    pairs = ((recipe_list[i], recipe_list[j])
+             for i in range(len(recipe_list) - 1)
+             for j in range(i+1, len(recipe_list)))
+    return itertools.islice(pairs, budget)
+
+def tournament_pairs(recipe_list, budget=None, tournament_size=TOURNAMENT_SIZE):
+    """
+    Generates pairs of recipes by tournament selection: each parent is the
+    fittest of a few recipes picked at random. The recipe list must be sorted
+    fittest first (see rank_parents).
 
     Arguments:
         recipe_list: the list of recipes that we wish to make pairs from.
+        budget: the number of pairs to make (by default, as many as all_pairs).
+        tournament_size: how many recipes compete to be each parent.
+    """
+    num_recipes = len(recipe_list)
+    if num_recipes < 2:
+        return
+    if budget is None:
+        budget = num_recipes * (num_recipes - 1) // 2
+    tournament_size = max(1, min(tournament_size, num_recipes))
+    for _ in range(budget):
+        parent_1 = min(random.sample(range(num_recipes), tournament_size))
+        parent_2 = parent_1
+        while parent_2 == parent_1:
+            parent_2 = min(random.sample(range(num_recipes), tournament_size))
+        yield recipe_list[parent_1], recipe_list[parent_2]
+
+def rank_pairs(recipe_list, budget=None):
     """
-    pairs = []
-    for i in range(len(recipe_list) - 1):
-        for j in range(i+1, len(recipe_list)):
-            pairs.append((recipe_list[i], recipe_list[j]))
-    return pairs
+    Generates pairs of recipes by rank-proportional sampling: the fittest of n
+    recipes is n times as likely to be picked as a parent as the least fit. The
+    recipe list must be sorted fittest first (see rank_parents).
 
+    Arguments:
+        recipe_list: the list of recipes that we wish to make pairs from.
+        budget: the number of pairs to make (by default, as many as all_pairs).
+    """
+    num_recipes = len(recipe_list)
+    if num_recipes < 2:
+        return
+    if budget is None:
+        budget = num_recipes * (num_recipes - 1) // 2
+    cum_weights = list(itertools.accumulate(range(num_recipes, 0, -1)))
+    for _ in range(budget):
+        parent_1, parent_2 = random.choices(range(num_recipes), cum_weights=cum_weights, k=2)
+        while parent_2 == parent_1:
+            parent_2 = random.choices(range(num_recipes), cum_weights=cum_weights)[0]
+        yield recipe_list[parent_1], recipe_list[parent_2]
+
+# The ways of picking parents that genetic_iteration knows about.
+MATING_SCHEMES = {"all-pairs": all_pairs,
+                  "tournament": tournament_pairs,
+                  "rank": rank_pairs}
+# The MATING_SCHEMES that need the recipe list sorted fittest first.
+RANKED_MATING_SCHEMES = ("tournament", "rank")
+
+def rank_parents(recipe_list, mating, fitness_cache=None, fitness_pool=None, metrics=None):
+    """
+    Sorts a population fittest first, if the mating scheme needs it that way.
+    genetic_iteration keeps its population sorted, so this is only needed for
+    the starting population, a resumed one or one with immigrants.
+
+    Arguments:
+        recipe_list: The parents.
+        mating: which of the MATING_SCHEMES the parents will be picked with.
+        fitness_cache: FitnessCache to reuse fitness levels from, if any.
+        fitness_pool: FitnessPool to score any unscored parents with, if any.
+        metrics: Recorder (from run_metrics) to record the generation's
+            metrics with, if any.
+    """
+    if mating not in RANKED_MATING_SCHEMES:
+        return recipe_list
+    return [r[0] for r in recipe_rankings(recipe_list, fitness_cache, fitness_pool,
+                                          metrics=metrics)]
 
 #def natural_selection(offspring_list):
 #    offspring_fitness = []
@@ -522,7 +1078,57 @@ def recipe_pairs(recipe_list):
 #    selected_offspring = sorted_fitness[int(len(offspring_fitness)/2):]
 #    return selected_offspring
 
-def genetic_iteration(recipe_list):
+def make_offspring(recipe_list, mating="all-pairs", offspring=None, metrics=None):
+    """
+    Makes the new recipes of a generation, by picking pairs of parents and
+    combining them (which may also make substitutions in the parents).
+
+    Arguments:
+        recipe_list: the recipe list that we start the iteration with.
+        mating: which of the MATING_SCHEMES to pick parents with.
+        offspring: how many new recipes to make (by default, one per pair of
+            recipes).
+        metrics: Recorder (from run_metrics) to record the generation's
+            metrics with, if any.
+    """
+    if metrics is None:
+        metrics = run_metrics.NULL_METRICS
+    with metrics.phase("crossover"):
+        pairs = MATING_SCHEMES[mating](recipe_list, offspring)
+        new_recipes = []
+        for recipe1, recipe2 in pairs:
+            new_recipe = recipe1.new_recipe_combo(recipe2)
+            new_recipes.append(new_recipe)
+    metrics.count("offspring", len(new_recipes))
+    return new_recipes
+
+def refill_population(new_recipes, parents, size, fitness_cache=None):
+    """
+    Tops up the new recipes of a generation with its fittest parents when
+    fewer were made (or allowed) than the size of the population, so that the
+    population never shrinks. They're ranked together afterwards, so the
+    population stays sorted. Returns the recipes to rank, and the fitness
+    levels (by fingerprint) of the parents that are still in the cache, which
+    are looked up without counting as hits again.
+
+    Arguments:
+        new_recipes: The generation's new recipes.
+        parents: The generation's parents, fittest first.
+        size: The size of the population.
+        fitness_cache: FitnessCache the parents' fitness levels are in, if any.
+    """
+    refill = parents[:max(size - len(new_recipes), 0)]
+    known_fitness = dict()
+    if fitness_cache is not None:
+        for recipe in refill:
+            fingerprint = recipe.fingerprint()
+            fitness = fitness_cache.peek(fingerprint)
+            if fitness is not None:
+                known_fitness[fingerprint] = fitness
+    return new_recipes + refill, known_fitness
+
+def genetic_iteration(recipe_list, fitness_cache=None, fitness_pool=None,
+                      mating="all-pairs", offspring=None, metrics=None, unsorted=False):
     """
     This function runs an genetic iteration of our recipe algorithm by creating
     pairs of recipes, and combining them and substituting ingredients using our
@@ -531,20 +1137,32 @@ def genetic_iteration(recipe_list):
 
     Arguments:
         recipe_list: the recipe list that we start the iteration with.
+        fitness_cache: FitnessCache to reuse fitness levels from, if any.
+        fitness_pool: FitnessPool to score the new recipes with, if any.
+        mating: which of the MATING_SCHEMES to pick parents with.
+        offspring: how many new recipes to make (by default, one per pair of
+            recipes).
+        metrics: Recorder (from run_metrics) to record the generation's
+            metrics with, if any.
+        unsorted: Whether recipe_list might not be sorted fittest first (as
+            genetic_iteration returns it), like the starting population.
     """
+    if metrics is None:
+        metrics = run_metrics.NULL_METRICS
     orig_len = len(recipe_list)
-    pairs = recipe_pairs(recipe_list)
-    new_recipes = []
-    for recipe1, recipe2 in pairs:
-        new_recipe = recipe1.new_recipe_combo(recipe2)
-        new_recipes.append(new_recipe)
+    if unsorted:
+        recipe_list = rank_parents(recipe_list, mating, fitness_cache, fitness_pool, metrics)
+    new_recipes = make_offspring(recipe_list, mating, offspring, metrics)
+    new_recipes, known_fitness = refill_population(new_recipes, recipe_list, orig_len,
+                                                   fitness_cache)
     # Return list consisting of top 50% of original recipes and top 50% of new recipes, and strip
     # their fitness levels away from them.
-    rank = recipe_rankings(new_recipes)
+    rank = recipe_rankings(new_recipes, fitness_cache, fitness_pool, top_k=orig_len,
+                           metrics=metrics, known_fitness=known_fitness)
 
-    return [r[0] for r in rank][0:orig_len]
+    return [r[0] for r in rank]
 
-def convert_format(recipe_list):
+def convert_format(recipe_list, compact=False):
     """
     Takes a list of lists that contains the ingredients of our recipe, and
     converts it to our new recipe format.
@@ -552,6 +1170,7 @@ def convert_format(recipe_list):
     Arguments:
         recipe_list: The list of lists that contains the recipe we wish to
         convert.
+        compact: Whether to make a CompactRecipe rather than a Recipe.
     """
     new_recipe = Recipe()
     for ingredient, amount in recipe_list:
@@ -564,68 +1183,475 @@ def convert_format(recipe_list):
             category = "misc"
             new_recipe.add_ingredient(category, Ingredient(ingredient),
                                       Amount(amount))
+    if compact:
+        return CompactRecipe.from_recipe(new_recipe)
     return new_recipe
 
-def get_fitness(recipe):
+def model_tables():
+    """
+    Gets the big numeric tables that the fitness functions use, by name, so
+    they can be put into shared memory.
     """
-    This function is a very simple one: it takes a recipe and returns a tuple of
-    the recipe itself and the fitness level. This is so we can parallelise it
-    using joblib.
+    tables = {"embed_matrix": EMBED_MATRIX,
+              "markov_indptr": recipe_markov.MARKOV_MATRIX.indptr,
+              "markov_indices": recipe_markov.MARKOV_MATRIX.indices,
+              "markov_data": recipe_markov.MARKOV_MATRIX.data,
+              "markov_keys": recipe_markov.MARKOV_MATRIX.keys}
+    # Memory-mapped vectors are already shared between processes.
+    if not isinstance(UT.vectors, np.memmap):
+        tables["food2vec_vectors"] = UT.vectors
+    return tables
+
+def init_fitness_worker(table_specs):
+    """
+    Sets up a fitness worker process: rather than using its own copies of the
+    model tables, it uses the ones in shared memory.
 
     Arguments:
-        recipe: Recipe to find fitness level of and to return.
+        table_specs: Specs of the SharedTables holding the model tables.
+    """
+    global EMBED_MATRIX # pylint: disable=global-statement
+    tables = shared_tables.attach(table_specs)
+    EMBED_MATRIX = tables["embed_matrix"]
+    if "food2vec_vectors" in tables:
+        UT.vectors = tables["food2vec_vectors"]
+    recipe_markov.MARKOV_MATRIX.indptr = tables["markov_indptr"]
+    recipe_markov.MARKOV_MATRIX.indices = tables["markov_indices"]
+    recipe_markov.MARKOV_MATRIX.data = tables["markov_data"]
+    recipe_markov.MARKOV_MATRIX.keys = tables["markov_keys"]
+
+def encode_population(ingredient_lists):
     """
-    return (recipe, recipe.fitness_level())
+    Packs a population of recipes (as lists of ingredient names) into a compact
+    form that's cheap to send to another process: a table of the distinct
+    names, an array of indices into it, and the offset of each recipe.
 
-def recipe_rankings(recipe_list):
+    Arguments:
+        ingredient_lists: List of the ingredient names of each recipe.
+    """
+    name_ids = dict()
+    ids = []
+    offsets = [0]
+    for ingredients in ingredient_lists:
+        for ingredient in ingredients:
+            ids.append(name_ids.setdefault(ingredient, len(name_ids)))
+        offsets.append(len(ids))
+    return (list(name_ids), np.array(ids, dtype=np.int32),
+            np.array(offsets, dtype=np.int64))
+
+def decode_population(names, ids, offsets):
+    """
+    Unpacks a population made by encode_population.
+
+    Arguments:
+        names: Table of ingredient names.
+        ids: Indices into names of every ingredient of every recipe.
+        offsets: Where each recipe starts (and ends) in ids.
+    """
+    ids = ids.tolist()
+    return [[names[i] for i in ids[start:end]]
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+def score_population(encoded_population, timings=None):
+    """
+    Gets the fitness levels of an encoded population, as an array with a row of
+    (result score, pair score, food2vec score) for each recipe. This is what the
+    fitness workers run.
+
+    Arguments:
+        encoded_population: Population packed by encode_population.
+        timings: Dictionary to add the time spent on each part of the fitness
+            function to, if any.
+    """
+    fitness_levels = get_fitness_levels(decode_population(*encoded_population), timings)
+    return np.array(fitness_levels, dtype=np.float64).reshape(-1, 3)
+
+def score_population_instrumented(job):
+    """
+    Does the same as score_population, but can also time each part of the
+    fitness function and profile the whole thing. Returns the fitness levels,
+    the timings (or None), how long the worker was busy for, and the worker's
+    process ID along with the stats of the profile (or None).
+
+    Arguments:
+        job: Tuple of the population packed by encode_population, whether to
+            time it and whether to profile it.
+    """
+    encoded_population, timed, profiled = job
+    start = time.perf_counter()
+    timings = dict() if timed else None
+    if profiled:
+        fitness_levels, stats = profiling.profile_call(score_population, encoded_population,
+                                                       timings)
+    else:
+        fitness_levels, stats = score_population(encoded_population, timings), None
+    return fitness_levels, timings, time.perf_counter() - start, (os.getpid(), stats)
+
+class FitnessPool:
+    """
+    FitnessPool class: a pool of worker processes that score recipes, which is
+    meant to be kept for a whole run. The workers are set up once, using the
+    model tables from shared memory, and recipes are sent to them in batches.
+    """
+    def __init__(self, processes=None, profiler=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.profiler = profiler
+        self.tables = shared_tables.SharedTables(model_tables())
+        self.pool = multiprocessing.Pool(self.processes,
+                                         initializer=init_fitness_worker,
+                                         initargs=(self.tables.specs,))
+
+    def score(self, ingredient_lists, metrics=None):
+        """
+        Gets the fitness levels of a bunch of recipes, as a list of tuples.
+
+        Arguments:
+            ingredient_lists: List of the ingredient names of each recipe.
+            metrics: Recorder to add the workers' timings to, if any.
+
+        If the pool has a profiler, the workers profile each batch they score,
+        and the profiles are added to it.
+        """
+        if not ingredient_lists:
+            return []
+        # A few batches per worker, so that they all finish around the same time.
+        batch_size = math.ceil(len(ingredient_lists) / (self.processes * 4))
+        batches = [encode_population(ingredient_lists[i:i + batch_size])
+                   for i in range(0, len(ingredient_lists), batch_size)]
+        timed = metrics is not None and metrics.enabled
+        if not timed and self.profiler is None:
+            fitness_levels = np.concatenate(self.pool.map(score_population, batches))
+        else:
+            start = time.perf_counter()
+            results = self.pool.map(score_population_instrumented,
+                                    [(batch, timed, self.profiler is not None)
+                                     for batch in batches])
+            wall_seconds = time.perf_counter() - start
+            for _, timings, _, (pid, stats) in results:
+                if timed:
+                    metrics.add_times("fitness_seconds", timings)
+                if stats is not None:
+                    self.profiler.add("fitness-worker-{0}".format(pid), stats)
+            if timed:
+                metrics.add_worker_time(sum(result[2] for result in results),
+                                        self.processes, wall_seconds)
+            fitness_levels = np.concatenate([result[0] for result in results])
+        return [tuple(fitness) for fitness in fitness_levels.tolist()]
+
+    def close(self):
+        """
+        Shuts down the workers and frees the shared memory.
+        """
+        self.pool.close()
+        self.pool.join()
+        self.tables.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def score_rankings(scores, descending=False):
+    """
+    Gets the ranking (0 being the best) of each score in an array. Tied scores
+    are ranked in the order they appear, just like a stable sort.
+
+    Arguments:
+        scores: Array of scores.
+        descending: Whether higher scores should be ranked first.
+    """
+    order = np.argsort(-scores if descending else scores, kind="stable")
+    rankings = np.empty(len(scores), dtype=np.int64)
+    rankings[order] = np.arange(len(scores))
+    return rankings
+
+def score_into_cache(recipe_list, fitness_cache, fitness_pool=None):
+    """
+    Looks up the fitness level of every recipe in a list, scoring the ones
+    that aren't in the fitness cache all in one go and adding them to it. This
+    lets the new recipes of several runs share one trip to the fitness
+    workers. Returns a dictionary of the fitness levels by fingerprint, to be
+    handed to recipe_rankings so that it doesn't look them up again.
+
+    Arguments:
+        recipe_list: The recipes to score.
+        fitness_cache: FitnessCache to add the fitness levels to.
+        fitness_pool: FitnessPool to score the recipes with; if there isn't
+            one, they're scored in this process.
+    """
+    fitness_levels = dict()
+    unscored = dict()
+    for recipe in recipe_list:
+        fingerprint = recipe.fingerprint()
+        if fingerprint in fitness_levels or fingerprint in unscored:
+            continue
+        fitness = fitness_cache.get(fingerprint)
+        if fitness is None:
+            unscored[fingerprint] = recipe.get_ingredient_names()
+        else:
+            fitness_levels[fingerprint] = fitness
+    if unscored:
+        if fitness_pool is not None:
+            new_scores = fitness_pool.score(list(unscored.values()))
+        else:
+            new_scores = get_fitness_levels(list(unscored.values()))
+        for fingerprint, fitness in zip(unscored, new_scores):
+            fitness_levels[fingerprint] = fitness
+            fitness_cache.put(fingerprint, fitness)
+    return fitness_levels
+
+def recipe_rankings(recipe_list, fitness_cache=None, fitness_pool=None, top_k=None,
+                    metrics=None, known_fitness=None):
     """
     This function takes in the recipe list and gets the result score and pair score given
     in the fitness_level function in the Recipe class. It creates a dictionary with the
     recipe name as the key and the two scores as its value (in the form of a tuple). We
     find the rankings of the individual scores and combine them together to form a final
-    ranking to determine the fittest amongst the recipes.
-    """
-    #create a dictionary to store recipes and its two scores
-    recipe_scores = dict()
-    #a list containing tuples in the form of (recipe, result_score)
-    result_scores = []
-    #a list containing tuples in the form of (recipe, pair_score)
-    pair_scores = []
-    #a list containing tuples in the form of (recipe, food2vec_score)
-    food2vec_scores = []
-    #a list containing the final rankings of the recipes via fitness level
-    final_rankings = []
+    ranking to determine the fittest amongst the recipes. Recipes with the same
+    ingredients are only scored once, and never again if they're in the fitness cache.
+
+    Arguments:
+        recipe_list: The recipes to rank.
+        fitness_cache: FitnessCache to reuse fitness levels from, if any.
+        fitness_pool: FitnessPool to score the recipes with; if there isn't
+            one, they're scored in this process.
+        top_k: If given, only the top_k fittest recipes are returned (and only
+            they are sorted).
+        metrics: Recorder (from run_metrics) to record the generation's
+            metrics with, if any.
+        known_fitness: Fitness levels that have already been looked up, by
+            fingerprint (as returned by score_into_cache). These are used as
+            they are, without counting as cache hits again.
+    """
+    if metrics is None:
+        metrics = run_metrics.NULL_METRICS
+    if known_fitness is None:
+        known_fitness = dict()
+    #collapse recipes with the same ingredients, and look them up in the cache
+    with metrics.phase("deduplication"):
+        fingerprints = [recipe.fingerprint() for recipe in recipe_list]
+        fitness_levels = dict()
+        unscored_recipes = dict()
+        for recipe, fingerprint in zip(recipe_list, fingerprints):
+            if fingerprint in fitness_levels or fingerprint in unscored_recipes:
+                if fitness_cache is not None:
+                    fitness_cache.duplicates += 1
+                continue
+            fitness = known_fitness.get(fingerprint)
+            if fitness is None and fitness_cache is not None:
+                fitness = fitness_cache.get(fingerprint)
+            if fitness is None:
+                unscored_recipes[fingerprint] = recipe
+            else:
+                fitness_levels[fingerprint] = fitness
     #popularizing recipe_scores
-    recipe_scores = Parallel(n_jobs=-1,
-                             backend="multiprocessing")(delayed
-                                                        (get_fitness)(recipe)
-                                                        for recipe in
-                                                        recipe_list)
-
-    recipe_scores = dict(recipe_scores)
-    #popularizing result_scores and pair_scores
-    for recipe, fitnesspair in recipe_scores.items():
-        result_scores.append((recipe, fitnesspair[0]))
-        pair_scores.append((recipe, fitnesspair[1]))
-        food2vec_scores.append((recipe, fitnesspair[2]))
-    #sort the two scores via descending order, because the higher the score,
-    #the smaller your index is.
-    result_scores.sort(key=lambda x: x[1], reverse=False)
-    pair_scores.sort(key=lambda x: x[1], reverse=True)
-    food2vec_scores.sort(key=lambda x: x[1], reverse=True)
-    #iterating through the recipes and finding their rankings in each
-    #ranking list, and adding the indices together. Append the recipe
-    #and its final_ranking to the final_rankings list.
-    for recipe in recipe_scores.keys():
-        result_ranking = [pair[0] for pair in result_scores].index(recipe)
-        pair_ranking = [pair[0] for pair in pair_scores].index(recipe)
-        food2vec_ranking = [pair[0] for pair in food2vec_scores].index(recipe)
-        final_ranking = result_ranking + pair_ranking + food2vec_ranking
-        final_rankings.append((recipe, final_ranking))
-    #sort final_rankings
-    final_rankings.sort(key=lambda x: x[1])
-    #return final_rankings
-    return final_rankings
+    if unscored_recipes:
+        with metrics.phase("scoring"):
+            ingredient_lists = [recipe.get_ingredient_names()
+                                for recipe in unscored_recipes.values()]
+            if fitness_pool is not None:
+                new_scores = fitness_pool.score(ingredient_lists, metrics)
+            elif metrics.enabled:
+                timings = dict()
+                new_scores = get_fitness_levels(ingredient_lists, timings)
+                metrics.add_times("fitness_seconds", timings)
+            else:
+                new_scores = get_fitness_levels(ingredient_lists)
+            for fingerprint, fitness in zip(unscored_recipes, new_scores):
+                fitness_levels[fingerprint] = fitness
+                if fitness_cache is not None:
+                    fitness_cache.put(fingerprint, fitness)
+        metrics.count("scored", len(unscored_recipes))
+    with metrics.phase("ranking"):
+        #an array with a row of (result_score, pair_score, food2vec_score) per recipe
+        recipe_scores = np.array([fitness_levels[fingerprint] for fingerprint in fingerprints],
+                                 dtype=np.float64).reshape(-1, 3)
+        #rank each of the scores: the lower the result score, and the higher the
+        #pair and food2vec scores, the smaller your ranking is. The final ranking
+        #is the sum of the three.
+        final_rankings = (score_rankings(recipe_scores[:, 0])
+                          + score_rankings(recipe_scores[:, 1], descending=True)
+                          + score_rankings(recipe_scores[:, 2], descending=True))
+        #sort final_rankings, with ties in their original order. Only the top_k
+        #need sorting, so pick those out first.
+        keys = final_rankings * len(recipe_list) + np.arange(len(recipe_list))
+        if top_k is not None and top_k < len(recipe_list):
+            order = np.argpartition(keys, top_k - 1)[:top_k] if top_k > 0 else keys[:0]
+            order = order[np.argsort(keys[order])]
+        else:
+            order = np.argsort(keys)
+    if metrics.enabled:
+        # Banned recipes have a pair score of -inf.
+        metrics.count("rejected", int(np.count_nonzero(recipe_scores[:, 1] == -np.inf)))
+    return [(recipe_list[i], int(final_rankings[i])) for i in order]
+
+def island_worker(connection, recipe_list, seed, mating, offspring, cache_size):
+    """
+    Runs one island of an island-model run, in its own process: it evolves its
+    own population, only talking to the main process to swap migrants. Each
+    message it gets is either (generations, immigrants, number of emigrants),
+    to which it replies with its fittest recipes once it has run the
+    generations, or None, to which it replies with its whole population.
+
+    Arguments:
+        connection: Its end of a Pipe to the main process.
+        recipe_list: The island's starting population.
+        seed: Seed for the island's random number generator.
+        mating: which of the MATING_SCHEMES to pick parents with.
+        offspring: how many new recipes to make each generation.
+        cache_size: Size of the island's FitnessCache.
+    """
+    random.seed(seed)
+    fitness_cache = FitnessCache(cache_size)
+    # The starting population isn't sorted fittest first.
+    unsorted = True
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                connection.send(("population", recipe_list))
+                return
+            generations, immigrants, num_emigrants = message
+            if immigrants:
+                # The population is sorted fittest first, so the immigrants
+                # replace the least fit recipes.
+                recipe_list = recipe_list[:max(len(recipe_list) - len(immigrants), 0)] \
+                    + immigrants
+                unsorted = True
+            for _ in range(generations):
+                recipe_list = genetic_iteration(recipe_list, fitness_cache, None, mating,
+                                                offspring, unsorted=unsorted)
+                unsorted = False
+            connection.send(("emigrants", recipe_list[:num_emigrants]))
+    except Exception: # pylint: disable=broad-except
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+def run_islands(recipe_list, iterations, num_islands, migrate_every=MIGRATION_INTERVAL,
+                num_migrants=MIGRANTS, mating="all-pairs", offspring=None,
+                cache_size=FITNESS_CACHE_SIZE):
+    """
+    Runs the genetic algorithm as an island model: the recipes are split into
+    shards, and each shard is evolved by its own process (scoring its recipes
+    itself). Every migrate_every generations, the fittest few recipes of each
+    island move to the next island round the ring. Returns all of the islands'
+    final recipes, fittest first.
+
+    Arguments:
+        recipe_list: The recipes to start with.
+        iterations: How many generations to run.
+        num_islands: How many islands (processes) to use; each needs at least
+            two recipes.
+        migrate_every: How many generations to run between migrations.
+        num_migrants: How many recipes move from each island at a time.
+        mating: which of the MATING_SCHEMES to pick parents with.
+        offspring: how many new recipes each island makes each generation.
+        cache_size: Size of each island's FitnessCache.
+    """
+    num_islands = max(1, min(num_islands, len(recipe_list) // 2))
+    migrate_every = max(1, migrate_every)
+    connections = []
+    processes = []
+    for island in range(num_islands):
+        parent_end, child_end = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=island_worker,
+            args=(child_end, recipe_list[island::num_islands], random.getrandbits(32),
+                  mating, offspring, cache_size),
+            daemon=True)
+        process.start()
+        child_end.close()
+        connections.append(parent_end)
+        processes.append(process)
+
+    def receive(connection, expected):
+        kind, payload = connection.recv()
+        if kind != expected:
+            raise RuntimeError("Island failed:\n{0}".format(payload))
+        return payload
+
+    try:
+        immigrants = [[] for _ in range(num_islands)]
+        with tqdm(total=iterations) as progress:
+            generation = 0
+            while generation < iterations:
+                generations = min(migrate_every, iterations - generation)
+                for connection, island_immigrants in zip(connections, immigrants):
+                    connection.send((generations, island_immigrants, num_migrants))
+                emigrants = [receive(connection, "emigrants") for connection in connections]
+                # Each island's emigrants go to the next island round the ring.
+                immigrants = emigrants[-1:] + emigrants[:-1]
+                generation += generations
+                progress.update(generations)
+
+        final_recipes = []
+        for connection in connections:
+            connection.send(None)
+            final_recipes += receive(connection, "population")
+    finally:
+        for connection in connections:
+            connection.close()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+    return [r[0] for r in recipe_rankings(final_recipes)]
+
+def get_recipe_title(recipe, iterations):
+    """
+    Makes up a title for a recipe from its two biggest ingredients.
+
+    Arguments:
+        recipe: The recipe to name.
+        iterations: How many generations it took to make.
+    """
+    dish_names = ["cookies", "biscuits", "shortbread"]
+    recipe_sorted = sorted(recipe.get_category_tuples(),
+                           key=lambda x: x[1].get_num(),
+                           reverse=True)
+    return "{0} star {1} and {2} {3}".format(iterations,
+                                             recipe_sorted[0][0],
+                                             recipe_sorted[1][0],
+                                             random.choice(dish_names))
+
+def run_generations(recipes_list, first_generation, args, config):
+    """
+    Runs the genetic algorithm on a single population, scoring recipes with a
+    pool of fitness workers, and recording metrics, profiles and checkpoints if
+    the command line asks for them. Returns the final recipes, fittest first.
+
+    Arguments:
+        recipes_list: The recipes to start with.
+        first_generation: How many generations have already been run.
+        args: The parsed command line arguments.
+        config: The run's configuration, to save in checkpoints.
+    """
+    fitness_cache = FitnessCache(args.cache_size)
+    profiler = profiling.Profiler() if args.profile else None
+    with FitnessPool(args.workers, profiler) as fitness_pool, \
+            run_metrics.open_metrics(args.metrics) as metrics, \
+            checkpoints.CheckpointWriter(ITERATIONS_FOLDER) as checkpoint_writer, \
+            (profiler.profile("main") if profiler else contextlib.nullcontext()):
+        for generation in tqdm(range(first_generation, args.iterations),
+                               initial=first_generation, total=args.iterations):
+            metrics.start_generation(generation)
+            # The starting (or resumed) population isn't sorted fittest first.
+            recipes_list = genetic_iteration(recipes_list, fitness_cache, fitness_pool,
+                                             args.mating, args.offspring, metrics,
+                                             unsorted=generation == first_generation)
+            metrics.end_generation(fitness_cache)
+            if args.checkpoint_every > 0 and (
+                    (generation + 1) % args.checkpoint_every == 0
+                    or generation + 1 == args.iterations):
+                checkpoint_writer.submit(checkpoints.Checkpoint.from_population(
+                    generation + 1, recipes_list, random.getstate(), config))
+    print(fitness_cache)
+    if profiler:
+        print("Wrote profile to {0}.".format(", ".join(profiler.write_report(args.profile))))
+
+    return recipes_list
 
 def main():
     """
@@ -636,38 +1662,96 @@ def main():
     parser = argparse.ArgumentParser(description="Genetic algorithm-based cookie recipe maker!")
     parser.add_argument("iterations", type=int, help="Number of iterations to run.")
     parser.add_argument("filename", type=str, help="Save final recipe")
+    parser.add_argument("--cache-size", type=int, default=FITNESS_CACHE_SIZE,
+                        help="Number of recipe fitness levels to remember between "
+                        "generations (0 to disable).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of fitness worker processes (defaults to the "
+                        "number of CPUs).")
+    parser.add_argument("--mating", choices=sorted(MATING_SCHEMES), default="all-pairs",
+                        help="How to pick the parents of each new recipe.")
+    parser.add_argument("--offspring", type=int, default=None,
+                        help="Number of new recipes per generation (defaults to one "
+                        "per pair of recipes); if it's less than the population size, "
+                        "the fittest parents make up the difference.")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Write the metrics of each generation to this JSONL file.")
+    parser.add_argument("--profile", nargs="?", const="profile", default=None,
+                        metavar="PREFIX",
+                        help="Profile the run (including the fitness workers) and write "
+                        "the report to PREFIX.txt, PREFIX.prof and PREFIX.collapsed.")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_INTERVAL,
+                        metavar="N",
+                        help="Save a checkpoint to {0}/ every N generations (0 to "
+                        "disable).".format(ITERATIONS_FOLDER))
+    parser.add_argument("--resume", action="store_true",
+                        help="Carry on from the latest checkpoint in {0}/, with the "
+                        "same mating scheme and number of offspring.".format(
+                            ITERATIONS_FOLDER))
+    parser.add_argument("--islands", type=int, default=0,
+                        help="Evolve this many separate populations, each in its own "
+                        "process, swapping their fittest recipes every so often. "
+                        "Checkpoints, metrics and profiling aren't done for island runs.")
+    parser.add_argument("--migrate-every", type=int, default=MIGRATION_INTERVAL,
+                        metavar="K", help="Number of generations between migrations.")
+    parser.add_argument("--migrants", type=int, default=MIGRANTS,
+                        help="Number of recipes that move from each island at a time.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Keep the recipes as CompactRecipes (arrays of ingredient "
+                        "IDs and amounts), which take much less memory.")
 
     args = parser.parse_args()
-
-    # Load all of the recipes from the directory to create both our inspiring set and lists of each
-    # recipe.
-    recipes_list = []
-    inspiring_set = []
-    with open("inspiring_set.json", "r") as iset_file:
-        inspiring_set_lists = json.load(iset_file)
-        for set_list in inspiring_set_lists:
-            inspiring_set += set_list
-            recipes_list.append(convert_format(set_list))
-    # Remove existing iterations directory if it exists.
-    if os.path.exists("iterations"):
-        shutil.rmtree("iterations")
-    os.mkdir("iterations")
-
-    for _ in tqdm(range(0, args.iterations)):
-        recipes_list = genetic_iteration(recipes_list)
-
-    dish_names = ["cookies", "biscuits", "shortbread"]
-    recipe_sorted = sorted(recipes_list[0].get_category_tuples(),
-                           key=lambda x: x[1].get_num(),
-                           reverse=True)
-    recipe_title = "{0} star {1} and {2} {3}".format(args.iterations,
-                                                     recipe_sorted[0][0],
-                                                     recipe_sorted[1][0],
-                                                     random.choice(dish_names))
+    if args.islands and args.resume:
+        parser.error("island runs can't be resumed")
+    if args.offspring is not None and args.offspring < 1:
+        parser.error("--offspring must be at least 1")
+
+    first_generation = 0
+    if args.resume:
+        checkpoint_file = checkpoints.latest_checkpoint(ITERATIONS_FOLDER)
+        if checkpoint_file is None:
+            parser.error("there's no checkpoint in {0}/ to resume from".format(
+                ITERATIONS_FOLDER))
+        checkpoint = checkpoints.Checkpoint.load(checkpoint_file)
+        recipes_list = [Recipe({category: [[Ingredient(name), Amount(amount)]
+                                           for name, amount in ingredients]
+                                for category, ingredients in recipe_dict.items()})
+                        for recipe_dict in checkpoint.get_recipe_dicts()]
+        if args.compact:
+            recipes_list = [CompactRecipe.from_recipe(recipe) for recipe in recipes_list]
+        random.setstate(checkpoint.get_rng_state())
+        first_generation = checkpoint.generation
+        args.mating = checkpoint.config["mating"]
+        args.offspring = checkpoint.config["offspring"]
+        print("Resuming from {0} (generation {1}).".format(checkpoint_file, first_generation))
+    else:
+        # Load all of the recipes from the directory to create both our inspiring set and lists
+        # of each recipe.
+        recipes_list = []
+        inspiring_set = []
+        with open("inspiring_set.json", "r") as iset_file:
+            inspiring_set_lists = json.load(iset_file)
+            for set_list in inspiring_set_lists:
+                inspiring_set += set_list
+                recipes_list.append(convert_format(set_list, args.compact))
+        # Remove existing iterations directory if it exists.
+        if os.path.exists(ITERATIONS_FOLDER):
+            shutil.rmtree(ITERATIONS_FOLDER)
+        os.mkdir(ITERATIONS_FOLDER)
+    config = {"mating": args.mating, "offspring": args.offspring,
+              "iterations": args.iterations}
+
+    if args.islands:
+        recipes_list = run_islands(recipes_list, args.iterations, args.islands,
+                                   args.migrate_every, args.migrants, args.mating,
+                                   args.offspring, args.cache_size)
+    else:
+        recipes_list = run_generations(recipes_list, first_generation, args, config)
 
     #recipes_list[0].normalization()
     with open(args.filename, 'w') as output_file:
-        output_file.write(recipes_list[0].get_recipe(recipe_title))
+        output_file.write(recipes_list[0].get_recipe(
+            get_recipe_title(recipes_list[0], args.iterations)))
 
 if __name__ == "__main__":
     main()
@@ -4,15 +4,71 @@ food2vec.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3, CSCI 3725
 
 A bunch of utilities that allow us to use the food2vec model, found here:
 https://jaan.io/food2vec-augmented-cooking-machine-intelligence/
+
+The vectors come as JSON (foodVecs.js), which is slow to load and takes a lot
+of memory as Python lists. Running "python food2vec.py convert" writes them as
+a .npy matrix plus a vocabulary file instead, which Word2VecUtils memory-maps,
+so every process shares the same copy through the page cache.
 """
 
+import os
 import json
-import itertools
 import statistics
 import random
+import argparse
 
 import numpy as np
-import inflect
+
+from ingredient_registry import REGISTRY
+
+WORDVEC_JSON_FILE = "foodVecs.js"
+WORDVEC_MATRIX_FILE = "foodVecs.npy"
+
+def vocabulary_file(matrix_file):
+    """
+    Gets the name of the vocabulary file that goes with a vector matrix file.
+
+    Arguments:
+        matrix_file: The .npy file of vectors.
+    """
+    return os.path.splitext(matrix_file)[0] + ".vocab"
+
+def convert_word_vectors(wordvec_file=WORDVEC_JSON_FILE, matrix_file=WORDVEC_MATRIX_FILE):
+    """
+    Converts the food2vec vectors from JSON into a float32 .npy matrix (a row
+    per word) and a vocabulary file (a word per line, in the same order).
+
+    Arguments:
+        wordvec_file: The JSON file of vectors.
+        matrix_file: Where to save the matrix.
+    """
+    with open(wordvec_file, "r") as wordvec_file_handle:
+        word_vecs = json.load(wordvec_file_handle)
+    dimensions = len(next(iter(word_vecs.values()))) if word_vecs else 0
+    vectors = np.empty((len(word_vecs), dimensions), dtype=np.float32)
+    for i, word_vec in enumerate(word_vecs.values()):
+        vectors[i] = word_vec
+
+    np.save(matrix_file, vectors)
+    with open(vocabulary_file(matrix_file), "w", encoding="utf-8") as vocab_file:
+        for word in word_vecs:
+            vocab_file.write(word + "\n")
+    return len(word_vecs)
+
+def default_wordvec_file():
+    """
+    Gets the vectors file to use by default: the one named by the
+    FOOD2VEC_VECTORS environment variable if it's set, otherwise the converted
+    matrix if there is one that's at least as new as the JSON, and the JSON if
+    not.
+    """
+    if os.environ.get("FOOD2VEC_VECTORS"):
+        return os.environ["FOOD2VEC_VECTORS"]
+    if os.path.exists(WORDVEC_MATRIX_FILE) and (
+            not os.path.exists(WORDVEC_JSON_FILE)
+            or os.path.getmtime(WORDVEC_MATRIX_FILE) >= os.path.getmtime(WORDVEC_JSON_FILE)):
+        return WORDVEC_MATRIX_FILE
+    return WORDVEC_JSON_FILE
 
 class Word2VecUtils:
     """
@@ -30,25 +86,54 @@ class Word2VecUtils:
             ingredient - an Ingredient instance where we want to find the
                 corresponding string.
         """
-        i_engine = inflect.engine()
-        string = str(ingredient).capitalize() # Ingredients in sentence case.
-        if i_engine.singular_noun(string):
-            string = str(i_engine.singular_noun(string)).split(" ")
-        else:
-            string = string.split(" ")
-        for i in range(len(string), -1, -1):
-            for combo in itertools.combinations(string, i):
-                if self.word_vecs.get(" ".join(combo).capitalize()):
-                    return " ".join(combo)
-        return None
+        return REGISTRY.resolve(ingredient, "food2vec")
 
     def __init__(self, wordvec_file=None):
-        if wordvec_file:
-            with open(wordvec_file, "r") as wordvec_file_handle:
-                self.word_vecs = json.load(wordvec_file_handle)
+        if not wordvec_file:
+            wordvec_file = default_wordvec_file()
+
+        # Keep the vectors as one float32 matrix (a row per word) so that
+        # similarity queries are a single matrix-vector product.
+        if wordvec_file.endswith(".npy"):
+            # Memory-mapped, so the matrix is only read in as it's used.
+            self.vectors = np.load(wordvec_file, mmap_mode="r")
+            with open(vocabulary_file(wordvec_file), "r", encoding="utf-8") as vocab_file:
+                self.words = vocab_file.read().split("\n")[:-1]
         else:
-            with open("foodVecs.js", "r") as wordvec_file_handle:
-                self.word_vecs = json.load(wordvec_file_handle)
+            with open(wordvec_file, "r") as wordvec_file_handle:
+                word_vecs = json.load(wordvec_file_handle)
+            self.words = list(word_vecs.keys())
+            dimensions = len(next(iter(word_vecs.values()))) if word_vecs else 0
+            self.vectors = np.empty((len(self.words), dimensions), dtype=np.float32)
+            for i, word_vec in enumerate(word_vecs.values()):
+                self.vectors[i] = word_vec
+        self.word_index = {word: i for i, word in enumerate(self.words)}
+
+        # The IDs in the shared registry are the rows of self.vectors. Names are
+        # mostly looked up from the other vocabularies, so there's no need to
+        # singularize the whole food2vec vocabulary up front.
+        REGISTRY.add_vocabulary("food2vec", self.words, ignore_case=True,
+                                precompute=False)
+
+    def get_vector(self, word_list):
+        """
+        Gets the mean vector of a list of foods.
+
+        Arguments:
+            word_list: List of foods to average.
+        """
+        rows = [self.word_index[word] for word in word_list]
+        return self.vectors[rows].mean(axis=0)
+
+    def get_similarities(self, vec):
+        """
+        Dots a vector with every food vector, returning an array of the
+        similarities in the same order as self.words.
+
+        Arguments:
+            vec: Food vector to compare to all other foods.
+        """
+        return self.vectors @ np.asarray(vec, dtype=np.float32)
 
     def get_matches(self, vec):
         """
@@ -59,11 +144,26 @@ class Word2VecUtils:
         Arguments:
             vec: Food vector to compare to all other foods.
         """
-        sims = []
-        for word, word_vec in self.word_vecs.items():
-            sim = np.dot(vec, np.array(word_vec))
-            sims.append((word, sim))
-        return sorted(sims, key=lambda x: x[1])
+        sims = self.get_similarities(vec)
+        return [(self.words[i], sims[i]) for i in np.argsort(sims, kind="stable")]
+
+    def get_top_matches(self, vec, k):
+        """
+        Gets the k foods most similar to a vector, as a list of (food,
+        similarity) tuples with the most similar first. Only the top k are
+        ever sorted, not the whole vocabulary.
+
+        Arguments:
+            vec: Food vector to compare to all other foods.
+            k: Number of matches to return.
+        """
+        sims = self.get_similarities(vec)
+        k = min(k, len(sims))
+        if k <= 0:
+            return []
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(self.words[i], sims[i]) for i in top]
 
     def recommendation(self, word_list):
         """
@@ -73,48 +173,45 @@ class Word2VecUtils:
         Arguments:
             word_list: List of foods to find recommendations for.
         """
-        input_vecs = []
-        for word in word_list:
-            input_vecs.append(self.word_vecs[word])
-        data = np.array(input_vecs)
-        sum_vectors = np.sum(data, 0)
-        target = sum_vectors * (1.0 / len(input_vecs))
-        matches = self.get_matches(target)
-        return dict(matches)
+        sims = self.get_similarities(self.get_vector(word_list))
+        return dict(zip(self.words, sims))
+
+    def get_similarity_matrix(self, rows):
+        """
+        Gets the similarities of the foods at the given rows to each other, as
+        a square matrix. Only the vectors of those foods are read, so this is
+        a small k-by-k product rather than one against the whole vocabulary.
+
+        Arguments:
+            rows: Rows (indices into self.words) of the foods we want.
+        """
+        vectors = self.vectors[rows]
+        return vectors @ vectors.T
 
     def food2vec_score(self, word_list):
         """
         Given a list of foods, it will get a score based on the similarity of
-        all foods to each other, using the recommendation function and
-        combinations of 1 and 2 foods.
+        all foods to each other: for each food, the product of its similarities
+        to every other food in the list, averaged over all of the foods.
 
         Arguments:
             word_list: List of foods to find score for.
         """
-        new_word_list = []
-        scores = []
-        for word in word_list:
-            if self.get_ingredient_string(word):
-                new_word_list.append(self.get_ingredient_string(word).capitalize())
-
-        combos = []
-        for i in range(1, 2):
-            combos += list(itertools.combinations(new_word_list, i))
-
-        for combo in combos:
-            score = 1.0
-            temp_word_list = new_word_list.copy()
-            for elem in combo:
-                temp_word_list.remove(elem)
-
-            rec = self.recommendation(list(combo))
+        rows = [row for row in (REGISTRY.get_id(word, "food2vec") for word in word_list)
+                if row is not None]
 
-            for elem in temp_word_list:
-                score *= rec[elem]
+        sims = self.get_similarity_matrix(rows).astype(np.float64)
 
-            scores.append(score)
+        # Take the product of each row (leaving out the food itself) in log
+        # space, keeping track of the sign separately.
+        others = ~np.eye(len(rows), dtype=bool)
+        with np.errstate(divide="ignore"):
+            log_sims = np.log(np.abs(sims))
+        log_scores = np.sum(log_sims, axis=1, where=others)
+        negatives = np.sum(sims < 0, axis=1, where=others)
+        scores = np.where(negatives % 2, -1.0, 1.0) * np.exp(log_scores)
 
-        return statistics.mean(scores)
+        return statistics.mean(scores.tolist())
 
     def get_new_ingredient(self, word_list):
         """
@@ -126,10 +223,34 @@ class Word2VecUtils:
         """
         new_word_list = []
         for word in word_list:
-            if self.get_ingredient_string(word):
-                new_word_list.append(self.get_ingredient_string(word).capitalize())
+            ingredient_string = self.get_ingredient_string(word)
+            if ingredient_string:
+                new_word_list.append(ingredient_string)
 
-        rec = self.recommendation(new_word_list)
         rand_ing_choice = random.randint(0, 4)
-        return sorted(rec.items(), key=lambda item: item[1],
-                      reverse=True)[rand_ing_choice]
+        top_matches = self.get_top_matches(self.get_vector(new_word_list),
+                                           rand_ing_choice + 1)
+        return top_matches[rand_ing_choice]
+
+def main():
+    """
+    Main function: converts the food2vec vectors into a memory-mappable matrix.
+    """
+    parser = argparse.ArgumentParser(description="food2vec utilities.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Convert the JSON vectors into "
+                                           "a .npy matrix and a vocabulary file.")
+    convert_parser.add_argument("--input", default=WORDVEC_JSON_FILE,
+                                help="JSON file of vectors.")
+    convert_parser.add_argument("--output", default=WORDVEC_MATRIX_FILE,
+                                help="Where to save the .npy matrix.")
+
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        num_words = convert_word_vectors(args.input, args.output)
+        print("Wrote {0} vectors to {1} and {2}.".format(num_words, args.output,
+                                                         vocabulary_file(args.output)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+generation_server.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+A small HTTP server that keeps the knowledge base, food2vec vectors and
+fitness workers loaded, so generating a recipe doesn't have to wait for them.
+It listens on localhost (or a Unix socket), and takes requests like:
+
+    POST /generate  {"iterations": 20, "seed": 1, "format": "json"}
+
+which waits for the recipe and returns it as Markdown (the default) or JSON.
+Requests take the same fields as the runs of batch_runs.py ("iterations",
+"seed", "recipes", "exclude", "mating" and "offspring"), apart from "output".
+Jobs can also be submitted without waiting:
+
+    POST /jobs          submits a job, returning its ID
+    GET /jobs/<id>      gets the status (and result, when it's done) of a job
+    DELETE /jobs/<id>   cancels a job
+    GET /status         gets how many jobs are running and queued
+
+Only so many jobs run at once (they take turns a generation at a time, sharing
+the fitness workers), and only so many can wait in the queue; any more are
+turned away with a 503. A job is cancelled if it's deleted, or if the
+connection of the client waiting on /generate is lost. (A client that just
+closes its side of the connection once it's sent the request still gets the
+recipe.)
+
+Usage: python generation_server.py [--port 8725 | --socket /tmp/cookies.sock]
+"""
+
+import os
+import json
+import asyncio
+import argparse
+import itertools
+import collections
+import concurrent.futures
+
+import cookie_generation
+import batch_runs
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8725
+# How many jobs run at once, and how many can wait, by default.
+MAX_CONCURRENT_JOBS = 4
+MAX_QUEUED_JOBS = 64
+# How many finished jobs to remember, so their results can still be fetched.
+FINISHED_JOBS_KEPT = 1000
+# Largest request body we'll read, in bytes.
+MAX_BODY_SIZE = 1 << 20
+OUTPUT_FORMATS = ("markdown", "json")
+
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 413: "Payload Too Large",
+                500: "Internal Server Error", 503: "Service Unavailable"}
+
+class RequestError(Exception):
+    """
+    RequestError class: an error to send back to the client, with its HTTP
+    status.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class Job:
+    """
+    Job class: a generation request, along with its status (queued, running,
+    done, failed or cancelled) and result.
+    """
+    def __init__(self, job_id, run, output_format):
+        self.id = job_id
+        self.run = run
+        self.format = output_format
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        self.finished = asyncio.Event()
+
+    def describe(self):
+        """
+        Gets a dictionary describing the job, for sending back as JSON.
+        """
+        description = {"id": self.id, "status": self.status,
+                       "generation": self.run.generation, "iterations": self.run.iterations}
+        if self.status == "done":
+            description["result"] = self.result
+        if self.error is not None:
+            description["error"] = self.error
+        return description
+
+def render_result(run, output_format):
+    """
+    Gets the result of a finished run, as Markdown or as a dictionary.
+
+    Arguments:
+        run: The finished BatchRun.
+        output_format: "markdown" or "json".
+    """
+    recipe, title = run.get_result()
+    ingredients = [{"category": str(category), "ingredient": str(ingredient),
+                    "amount_oz": amount.get_num()}
+                   for category, category_ingredients in recipe.get_recipe_dict().items()
+                   for ingredient, amount in category_ingredients]
+    result_score, pair_score, food2vec_score = recipe.fitness_level()
+    # get_recipe takes the categories out of the recipe, so it goes last.
+    markdown = recipe.get_recipe(title)
+    if output_format == "markdown":
+        return markdown
+    return {"title": title, "iterations": run.iterations, "seed": run.seed,
+            "ingredients": ingredients,
+            "fitness": {"result_score": result_score, "pair_score": pair_score,
+                        "food2vec_score": food2vec_score},
+            "markdown": markdown}
+
+class GenerationServer:
+    """
+    GenerationServer class: queues generation jobs and runs them. All of the
+    genetic algorithm work happens on one background thread (as the runs take
+    turns with the random module's state), with the scoring done by the
+    fitness workers.
+    """
+    def __init__(self, inspiring_set, fitness_pool, max_concurrent=MAX_CONCURRENT_JOBS,
+                 max_queued=MAX_QUEUED_JOBS, cache_size=cookie_generation.FITNESS_CACHE_SIZE,
+                 compact=False):
+        self.inspiring_set = inspiring_set
+        self.compact = compact
+        self.fitness_pool = fitness_pool
+        self.fitness_cache = cookie_generation.FitnessCache(cache_size)
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.jobs = collections.OrderedDict()
+        self.waiting = collections.deque()
+        self.active = []
+        self.job_ids = itertools.count(1)
+        self.wakeup = asyncio.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, request):
+        """
+        Adds a job to the queue, returning it. The job's run is set up on the
+        background thread, as converting its recipes takes a while.
+
+        Arguments:
+            request: The request, as a dictionary.
+        """
+        if not isinstance(request, dict) or "iterations" not in request:
+            raise RequestError(400, "Requests need a number of iterations.")
+        output_format = request.get("format", "markdown")
+        if output_format not in OUTPUT_FORMATS:
+            raise RequestError(400, "format should be one of {0}.".format(
+                ", ".join(OUTPUT_FORMATS)))
+        if len(self.waiting) >= self.max_queued:
+            raise RequestError(503, "Too many jobs are queued; try again later.")
+
+        job_id = str(next(self.job_ids))
+        loop = asyncio.get_running_loop()
+        try:
+            run = await loop.run_in_executor(self.executor, batch_runs.BatchRun, int(job_id),
+                                             dict(request, output=None), self.inspiring_set,
+                                             "all-pairs", None, self.compact)
+        except (ValueError, TypeError, KeyError) as error:
+            raise RequestError(400, str(error)) from error
+        # Other jobs may have been queued while the run was being set up.
+        if len(self.waiting) >= self.max_queued:
+            raise RequestError(503, "Too many jobs are queued; try again later.")
+        job = Job(job_id, run, output_format)
+        self.jobs[job_id] = job
+        self.waiting.append(job)
+        self.wakeup.set()
+        return job
+
+    def cancel(self, job):
+        """
+        Cancels a job. A queued job is cancelled straight away; a running one
+        stops at the end of its current generation.
+
+        Arguments:
+            job: The Job to cancel.
+        """
+        if job.finished.is_set():
+            return
+        job.cancel_requested = True
+        if job in self.waiting:
+            self.waiting.remove(job)
+            self.finish(job, "cancelled")
+
+    def finish(self, job, status):
+        """
+        Marks a job as finished, forgetting the oldest finished jobs if we're
+        remembering too many.
+
+        Arguments:
+            job: The Job that's finished.
+            status: Its final status.
+        """
+        job.status = status
+        job.finished.set()
+        finished = [job_id for job_id, old_job in self.jobs.items()
+                    if old_job.finished.is_set()]
+        for job_id in finished[:max(len(finished) - FINISHED_JOBS_KEPT, 0)]:
+            del self.jobs[job_id]
+
+    async def scheduler(self):
+        """
+        Runs the jobs, forever: each round, every running job does a
+        generation, then any that are finished (or cancelled) are taken off and
+        queued jobs take their places.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            while self.waiting and len(self.active) < self.max_concurrent:
+                job = self.waiting.popleft()
+                job.status = "running"
+                self.active.append(job)
+            if not self.active:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            runs = [job.run for job in self.active
+                    if not job.cancel_requested and not job.run.is_finished()]
+            failed = dict()
+            if runs:
+                # Only the jobs whose runs raised an exception fail.
+                failed = await loop.run_in_executor(self.executor, batch_runs.step_runs, runs,
+                                                    self.fitness_cache, self.fitness_pool)
+
+            for job in list(self.active):
+                if job.run in failed:
+                    self.active.remove(job)
+                    job.error = repr(failed[job.run])
+                    self.finish(job, "failed")
+                elif job.cancel_requested:
+                    self.active.remove(job)
+                    self.finish(job, "cancelled")
+                elif job.run.is_finished():
+                    self.active.remove(job)
+                    try:
+                        job.result = await loop.run_in_executor(
+                            self.executor, render_result, job.run, job.format)
+                        self.finish(job, "done")
+                    except Exception as error: # pylint: disable=broad-except
+                        job.error = repr(error)
+                        self.finish(job, "failed")
+
+    def get_job(self, path):
+        """
+        Gets the job a /jobs/<id> path refers to.
+
+        Arguments:
+            path: The path of the request.
+        """
+        job = self.jobs.get(path[len("/jobs/"):])
+        if job is None:
+            raise RequestError(404, "There's no such job.")
+        return job
+
+    async def generate(self, request, writer):
+        """
+        Runs a job and waits for its result, cancelling it if the connection
+        is lost first. Returns the status, body and content type of the
+        response.
+
+        Arguments:
+            request: The request, as a dictionary.
+            writer: The stream the response will go to.
+        """
+        job = await self.submit(request)
+        finished = asyncio.ensure_future(job.finished.wait())
+        # The end of the request stream isn't a disconnect, as the client may
+        # have only closed its side. Once it's sent everything, a client that
+        # goes away is only noticed when the response can't be written.
+        disconnected = asyncio.ensure_future(connection_lost(writer))
+        await asyncio.wait([finished, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        if not finished.done():
+            finished.cancel()
+            self.cancel(job)
+            return None
+        disconnected.cancel()
+
+        if job.status != "done":
+            return 500, job.describe(), None
+        if job.format == "markdown":
+            return 200, job.result, "text/markdown; charset=utf-8"
+        return 200, job.result, None
+
+    async def route(self, method, path, body, writer):
+        """
+        Handles a request, returning the status, body and content type (None
+        for JSON) of the response, or None if there's no one to respond to.
+
+        Arguments:
+            method: The HTTP method.
+            path: The path of the request.
+            body: The body of the request.
+            writer: The stream the response will go to.
+        """
+        path = path.split("?", 1)[0]
+        if path == "/status":
+            if method != "GET":
+                raise RequestError(405, "Use GET.")
+            return 200, {"running": len(self.active), "queued": len(self.waiting),
+                         "max_concurrent": self.max_concurrent,
+                         "max_queued": self.max_queued}, None
+        if path in ("/generate", "/jobs"):
+            if method != "POST":
+                raise RequestError(405, "Use POST.")
+            try:
+                request = json.loads(body.decode("utf-8") or "{}")
+            except ValueError as error:
+                raise RequestError(400, "The body should be JSON.") from error
+            if path == "/generate":
+                return await self.generate(request, writer)
+            job = await self.submit(request)
+            return 202, job.describe(), None
+        if path.startswith("/jobs/"):
+            job = self.get_job(path)
+            if method == "GET":
+                return 200, job.describe(), None
+            if method == "DELETE":
+                self.cancel(job)
+                return 200, job.describe(), None
+            raise RequestError(405, "Use GET or DELETE.")
+        raise RequestError(404, "There's nothing at {0}.".format(path))
+
+    async def handle_connection(self, reader, writer):
+        """
+        Handles one HTTP connection (which is closed after one request).
+
+        Arguments:
+            reader: The stream to read the request from.
+            writer: The stream to write the response to.
+        """
+        try:
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    return
+                response = await self.route(*request, writer)
+            except RequestError as error:
+                response = error.status, {"error": error.message}, None
+            if response is not None:
+                await write_response(writer, *response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+async def connection_lost(writer):
+    """
+    Waits until a connection is lost (or closed).
+
+    Arguments:
+        writer: The stream of the connection.
+    """
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+async def read_request(reader):
+    """
+    Reads an HTTP request, returning its method, path and body, or None if the
+    client closed the connection without sending anything.
+
+    Arguments:
+        reader: The stream to read from.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError as error:
+        raise RequestError(400, "That isn't an HTTP request.") from error
+
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError as error:
+        raise RequestError(400, "Bad Content-Length.") from error
+    if length > MAX_BODY_SIZE:
+        raise RequestError(413, "The body is too big.")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method.upper(), path, body
+
+async def write_response(writer, status, body, content_type=None):
+    """
+    Writes an HTTP response.
+
+    Arguments:
+        writer: The stream to write to.
+        status: The HTTP status code.
+        body: The body, as a string, or anything else to send as JSON.
+        content_type: The content type of a string body (None for JSON).
+    """
+    if content_type is None:
+        body = json.dumps(body)
+        content_type = "application/json"
+    data = body.encode("utf-8")
+    head = "HTTP/1.1 {0} {1}\r\nContent-Type: {2}\r\nContent-Length: {3}\r\n" \
+           "Connection: close\r\n\r\n".format(status, HTTP_REASONS.get(status, ""),
+                                              content_type, len(data))
+    writer.write(head.encode("latin-1") + data)
+    await writer.drain()
+
+async def serve(args):
+    """
+    Loads the inspiring set, starts the fitness workers and serves requests
+    until the server is stopped.
+
+    Arguments:
+        args: The parsed command line arguments.
+    """
+    with open(batch_runs.INSPIRING_SET_FILE, "r") as iset_file:
+        inspiring_set = json.load(iset_file)
+
+    with cookie_generation.FitnessPool(args.workers) as fitness_pool:
+        server = GenerationServer(inspiring_set, fitness_pool, args.max_concurrent,
+                                  args.max_queued, args.cache_size, args.compact)
+        scheduler = asyncio.ensure_future(server.scheduler())
+        if args.socket:
+            if os.path.exists(args.socket):
+                os.remove(args.socket)
+            listener = await asyncio.start_unix_server(server.handle_connection,
+                                                       path=args.socket)
+            print("Listening on {0}".format(args.socket), flush=True)
+        else:
+            listener = await asyncio.start_server(server.handle_connection, args.host,
+                                                  args.port)
+            print("Listening on http://{0}:{1}".format(args.host, args.port), flush=True)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            scheduler.cancel()
+            server.executor.shutdown()
+
+def main():
+    """
+    Main function - runs the server.
+    """
+    parser = argparse.ArgumentParser(description="Serves cookie recipes over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--socket", default=None,
+                        help="Listen on this Unix socket instead of a port.")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_JOBS,
+                        help="Number of jobs to run at once.")
+    parser.add_argument("--max-queued", type=int, default=MAX_QUEUED_JOBS,
+                        help="Number of jobs that can wait to run.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of fitness worker processes (defaults to the "
+                        "number of CPUs).")
+    parser.add_argument("--cache-size", type=int, default=cookie_generation.FITNESS_CACHE_SIZE,
+                        help="Number of recipe fitness levels to remember.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Keep the recipes as CompactRecipes, which take much less "
+                        "memory.")
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+ingredient_parser.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Parses the ingredient lines of scraped recipes (like "2 cups all-purpose
+flour" or "8oz cream cheese") into (ingredient, amount in oz) tuples. Every
+pattern is compiled once, when the module is imported, and units are
+converted using a table, so big dumps of scraped recipes can be parsed
+quickly.
+"""
+
+import re
+import functools
+from fractions import Fraction
+
+# Dictionary mapping vulgar fraction to floats for parsing ingredient amounts.
+FRACTIONS = {
+    0x2189: 0.0,  # ; ; 0 # No       VULGAR FRACTION ZERO THIRDS
+    0x2152: 0.1,  # ; ; 1/10 # No       VULGAR FRACTION ONE TENTH
+    0x2151: 0.11111111,  # ; ; 1/9 # No       VULGAR FRACTION ONE NINTH
+    0x215B: 0.125,  # ; ; 1/8 # No       VULGAR FRACTION ONE EIGHTH
+    0x2150: 0.14285714,  # ; ; 1/7 # No       VULGAR FRACTION ONE SEVENTH
+    0x2159: 0.16666667,  # ; ; 1/6 # No       VULGAR FRACTION ONE SIXTH
+    0x2155: 0.2,  # ; ; 1/5 # No       VULGAR FRACTION ONE FIFTH
+    0x00BC: 0.25,  # ; ; 1/4 # No       VULGAR FRACTION ONE QUARTER
+    0x2153: 0.33333333,  # ; ; 1/3 # No       VULGAR FRACTION ONE THIRD
+    0x215C: 0.375,  # ; ; 3/8 # No       VULGAR FRACTION THREE EIGHTHS
+    0x2156: 0.4,  # ; ; 2/5 # No       VULGAR FRACTION TWO FIFTHS
+    0x00BD: 0.5,  # ; ; 1/2 # No       VULGAR FRACTION ONE HALF
+    0x2157: 0.6,  # ; ; 3/5 # No       VULGAR FRACTION THREE FIFTHS
+    0x215D: 0.625,  # ; ; 5/8 # No       VULGAR FRACTION FIVE EIGHTHS
+    0x2154: 0.66666667,  # ; ; 2/3 # No       VULGAR FRACTION TWO THIRDS
+    0x00BE: 0.75,  # ; ; 3/4 # No       VULGAR FRACTION THREE QUARTERS
+    0x2158: 0.8,  # ; ; 4/5 # No       VULGAR FRACTION FOUR FIFTHS
+    0x215A: 0.83333333,  # ; ; 5/6 # No       VULGAR FRACTION FIVE SIXTHS
+    0x215E: 0.875,  # ; ; 7/8 # No       VULGAR FRACTION SEVEN EIGHTHS
+}
+
+# How many oz there are in each unit; amounts in any other unit are counts.
+UNIT_OUNCES = {
+    "cup": 8, "cups": 8,
+    "teaspoon": 0.17, "teaspoons": 0.17, "tsp": 0.17,
+    "Tablespoon": 0.5, "Tablespoons": 0.5, "tbsp": 0.5,
+}
+# Amount given to optional ingredients, which have no amount.
+OPTIONAL_AMOUNT = -1.0
+
+# Patterns for the amounts passed to convert().
+UNIT_PATTERN = re.compile(r'\w+s?\Z')
+COUNT_PATTERN = re.compile(r'[\d]*')
+MIXED_NUMBER_PATTERN = re.compile(r'(\d?/?\d)\sand\s((\d/\d))')
+DECIMAL_PATTERN = re.compile(r'([.\d]+)\s')
+NUMBER_PATTERN = re.compile(r'(\d?/?\d)\s')
+
+# Patterns for lines in oz, like "8oz cream cheese" or "½ oz vanilla".
+OZ_INGREDIENT_PATTERN = re.compile(r'oz\s([\w\s\-\’/]+)')
+OZ_AMOUNT_PATTERN = re.compile(r'([\d]+)oz')
+VULGAR_FRACTION_PATTERN = re.compile(r'(\d*)([%s])' % "".join(map(chr, FRACTIONS)))
+
+# Patterns for lines with a note in brackets, like "1/2 cup (1 stick) butter".
+BRACKETED_INGREDIENT_PATTERN = re.compile(r'\)\s([\w\s\-\’/]+)')
+# Note: This cannot extract extra units like "Tablespoons"
+BRACKETED_AMOUNT_PATTERN = re.compile(r'\d?/?\d\s(?!and\s)\w+|\d\sand\s\d/\d\s\w+'
+                                      r'|\d?/?\d\s\w+\s\+\s\d\s\w+')
+
+# Patterns for every other line, with or without a unit.
+UNIT_WORD_PATTERN = re.compile(r'cup|tsp|teaspoon|tbsp|Tablespoon')
+UNIT_INGREDIENT_PATTERN = re.compile(r'(tsp|tbsp|teaspoon|cups?|Tablespoons?)\s([\w\s\-\’\/]+)')
+COUNT_INGREDIENT_PATTERN = re.compile(r'\d+\s(?!tsp|tbsp|teaspoon|cups?|Tablespoons?)'
+                                      r'([\w\s\-\’\/]+)')
+# Ignoring small units like the tablespoon part in "2 cups + 1 tablespoon"
+UNIT_AMOUNT_PATTERN = re.compile(r'\d?/?\d\s(?!and\s)(tsp|tbsp|teaspoon|cups?|Tablespoons?)?'
+                                 r'|\d\sand\s\d/\d\s(tsp|tbsp|teaspoon|cups?|Tablespoons?)'
+                                 r'|\d?/?\d\s\w+\s\+\s\d\s(tsp|tbsp|teaspoon'
+                                 r'|cups?|Tablespoons?)')
+HALF_UNIT_PATTERN = re.compile(r'½\s(\w+)')
+
+@functools.lru_cache(maxsize=1024)
+def fraction_value(number):
+    """
+    Gets the value of a number like "3" or "1/2" as a float.
+
+    Arguments:
+        number: The number, as a string.
+    """
+    return float(Fraction(number))
+
+def convert(amount):
+    """
+    Converts units in the parsed recipes into oz.
+
+    Arguments:
+        amount: The amount, like "2 cups" or "1 and 1/2 tsp".
+    """
+    # Get the unit of ingredient amount.
+    unit = UNIT_PATTERN.search(amount)
+    if unit is None:
+        # Extracts the count of ingredients without a unit
+        return float(COUNT_PATTERN.match(amount).group())
+
+    # Parse the numerical amount.
+    if "and" in amount:
+        nums = MIXED_NUMBER_PATTERN.search(amount)
+        result = float(nums.group(1)) + fraction_value(nums.group(2))
+    elif "." in amount:
+        result = float(DECIMAL_PATTERN.search(amount).group(1))
+    else:
+        result = fraction_value(NUMBER_PATTERN.search(amount).group(1))
+
+    # Returns result in oz
+    return result * UNIT_OUNCES.get(unit.group(), 1)
+
+def clean_line(line):
+    """
+    Cleans up the text of an ingredient line from a recipe page.
+
+    Arguments:
+        line: The text of the line.
+    """
+    return line.replace('Ingredients', '').replace('\xa0', ' ')
+
+def parse_ingredient_lines(lines):
+    """
+    Parses the ingredient lines of a recipe, returning a list of (ingredient,
+    amount in oz) tuples. Optional ingredients get an amount of -1. As in the
+    original parser, if part of a line can't be parsed, that part is kept from
+    the line before.
+
+    Arguments:
+        lines: The text of each ingredient line of the recipe.
+    """
+    recipe = []
+    ingredient = '' # Ingredient string
+    ing_amount = '' # Ingredient amount
+
+    for item in lines:
+        item = clean_line(item)
+        # When item in the unit of "oz"
+        if 'oz' in item:
+            ingredient = OZ_INGREDIENT_PATTERN.search(item).group(1)
+            ing_amount = OZ_AMOUNT_PATTERN.search(item)
+            if ing_amount is None:
+                for whole, fraction in VULGAR_FRACTION_PATTERN.findall(item):
+                    ing_amount = (float(whole) if whole else 0) + FRACTIONS[ord(fraction)]
+            else:
+                ing_amount = float(ing_amount.group(1))
+
+        #When there is "()" in item
+        elif ')' in item:
+            try:
+                ingredient = BRACKETED_INGREDIENT_PATTERN.search(item).group(1)
+                ing_amount = BRACKETED_AMOUNT_PATTERN.match(item).group()
+                ing_amount = convert(ing_amount)
+            except AttributeError:
+                pass
+
+        # This part parses ingredients with no units, or ingredients with misc
+        # units; plus optional ingredients
+        else:
+            try:
+                if UNIT_WORD_PATTERN.search(item):
+                    ingredient = UNIT_INGREDIENT_PATTERN.search(item).group(2)
+                else:
+                    ingredient = COUNT_INGREDIENT_PATTERN.search(item).group(1)
+                ing_amount = convert(UNIT_AMOUNT_PATTERN.match(item).group())
+            # If there is vulgar fraction in ingredient amount
+            except AttributeError:
+                try:
+                    # Matches 1/2 in vulgar fraction
+                    ing_amount = convert("1/2 " + HALF_UNIT_PATTERN.search(item).group(1))
+                # For optional ingredients
+                except AttributeError:
+                    ingredient = item
+                    ing_amount = OPTIONAL_AMOUNT
+        recipe.append((ingredient, ing_amount))
+    return recipe
@@ -0,0 +1,202 @@
+"""
+ingredient_registry.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+A single place to turn raw ingredient names (e.g. "large eggs") into the
+matching entries of each of our vocabularies: the substitution data, the
+Markov chain, the food2vec model and the word embeddings.
+"""
+
+import functools
+
+# How many (vocabulary, name) lookups to remember.
+RESOLVE_CACHE_SIZE = 8192
+# How many singular forms of names outside the vocabularies to remember.
+SINGULAR_CACHE_SIZE = 8192
+
+class Vocabulary:
+    """
+    Vocabulary class: the words of one of our models, with a stable ID for
+    each word (its position) and an index that lets us find which words can be
+    made from a subset of the words of a name.
+    """
+    def __init__(self, words, ignore_case=False):
+        self.words = list(words)
+        self.ids = dict()
+        # Maps the first token of each word to (tokens, ID) pairs.
+        self.first_tokens = dict()
+        for word_id, word in enumerate(self.words):
+            if ignore_case:
+                # Matched the way food2vec is: the name is put into sentence
+                # case, so only words already in sentence case can match.
+                if word != word.capitalize():
+                    continue
+                key = word.lower()
+            else:
+                key = word
+            if key in self.ids:
+                continue
+            self.ids[key] = word_id
+            tokens = tuple(key.split(" "))
+            self.first_tokens.setdefault(tokens[0], []).append((tokens, word_id))
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def find(self, tokens):
+        """
+        Finds the word made from the most tokens of a name, keeping them in
+        order. Ties are broken in favour of the earliest tokens, which is the
+        order itertools.combinations would try them in. Returns the ID, or None.
+
+        Arguments:
+            tokens: The words of the (singular, lower case) name.
+        """
+        best_id = None
+        best_positions = None
+        for first_token in set(tokens):
+            for word_tokens, word_id in self.first_tokens.get(first_token, []):
+                if best_positions and len(word_tokens) < len(best_positions):
+                    continue
+                positions = match_positions(word_tokens, tokens)
+                if positions is None:
+                    continue
+                if (best_positions is None or len(positions) > len(best_positions)
+                        or (len(positions) == len(best_positions)
+                            and positions < best_positions)):
+                    best_id = word_id
+                    best_positions = positions
+        if best_id is None:
+            # The empty combination of tokens is tried last of all.
+            best_id = self.ids.get("")
+        return best_id
+
+def match_positions(word_tokens, tokens):
+    """
+    Returns the earliest positions in tokens that spell out word_tokens in
+    order, or None if they can't be found.
+
+    Arguments:
+        word_tokens: The tokens we're looking for.
+        tokens: The tokens to look through.
+    """
+    positions = []
+    start = 0
+    for word_token in word_tokens:
+        try:
+            start = tokens.index(word_token, start)
+        except ValueError:
+            return None
+        positions.append(start)
+        start += 1
+    return tuple(positions)
+
+class IngredientRegistry:
+    """
+    IngredientRegistry class: keeps every vocabulary we know about, and resolves
+    raw ingredient names into them. Lookups are memoized, and the singular forms
+    of all vocabulary words are worked out up front so inflect is only needed
+    for names we've never seen.
+    """
+    def __init__(self, cache_size=RESOLVE_CACHE_SIZE):
+        self.vocabularies = dict()
+        self.singular_forms = dict()
+        self.i_engine = None
+        self.find_id = functools.lru_cache(maxsize=cache_size)(self._find_id)
+        self.inflect_singular = functools.lru_cache(maxsize=SINGULAR_CACHE_SIZE)(
+            self._inflect_singular)
+
+    def add_vocabulary(self, name, words, ignore_case=False, precompute=True):
+        """
+        Adds (or replaces) a vocabulary.
+
+        Arguments:
+            name: Name to refer to the vocabulary by, e.g. "markov".
+            words: The words in the vocabulary; a word's ID is its position.
+            ignore_case: Whether to match names in sentence case, as food2vec
+                does.
+            precompute: Whether to work out the singular forms of the words now
+                (worth it if we'll often be asked to look the words up).
+        """
+        vocabulary = Vocabulary(words, ignore_case)
+        self.vocabularies[name] = vocabulary
+        if precompute:
+            self.add_singular_forms(vocabulary.ids.keys())
+        self.find_id.cache_clear()
+        return vocabulary
+
+    def add_singular_forms(self, names):
+        """
+        Works out the singular forms of a bunch of names ahead of time.
+
+        Arguments:
+            names: The (lower case) names to singularize.
+        """
+        for name in names:
+            name = name.lower()
+            if name not in self.singular_forms:
+                self.singular_forms[name] = self._inflect_singular(name)
+
+    def _inflect_singular(self, name):
+        if self.i_engine is None:
+            # inflect takes seconds to import, so only do it if we need it.
+            import inflect # pylint: disable=import-outside-toplevel
+            self.i_engine = inflect.engine()
+        return self.i_engine.singular_noun(name) or name
+
+    def singular(self, name):
+        """
+        Gets the singular form of a name (or the name itself if it isn't plural).
+
+        Arguments:
+            name: The name to singularize.
+        """
+        name = str(name).lower()
+        singular = self.singular_forms.get(name)
+        if singular is None:
+            singular = self.inflect_singular(name)
+        return singular
+
+    def _find_id(self, vocabulary_name, name):
+        vocabulary = self.vocabularies[vocabulary_name]
+        return vocabulary.find(self.singular(name).split(" "))
+
+    def get_id(self, ingredient, vocabulary_name):
+        """
+        Gets the ID of an ingredient in a vocabulary, or None if no part of its
+        name is in there.
+
+        Arguments:
+            ingredient: The ingredient (or ingredient name) to look up.
+            vocabulary_name: Which vocabulary to look in.
+        """
+        return self.find_id(vocabulary_name, str(ingredient))
+
+    def get_ids(self, ingredient):
+        """
+        Gets a dictionary of the ID of an ingredient in every vocabulary.
+
+        Arguments:
+            ingredient: The ingredient (or ingredient name) to look up.
+        """
+        return {vocabulary_name: self.get_id(ingredient, vocabulary_name)
+                for vocabulary_name in self.vocabularies}
+
+    def resolve(self, ingredient, vocabulary_name):
+        """
+        Gets the word in a vocabulary that best matches an ingredient, or None.
+
+        Arguments:
+            ingredient: The ingredient (or ingredient name) to look up.
+            vocabulary_name: Which vocabulary to look in.
+        """
+        word_id = self.get_id(ingredient, vocabulary_name)
+        if word_id is None:
+            return None
+        return self.vocabularies[vocabulary_name].words[word_id]
+
+# The registry shared by all of our modules.
+REGISTRY = IngredientRegistry()
@@ -0,0 +1,362 @@
+"""
+knowledge_base.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Compiles our knowledge base (the translation and substitution dictionaries,
+the Markov chain, and the word embeddings and categories) into one binary
+snapshot that loads in milliseconds, rather than parsing the JSON and unpickling
+the .npy files every time we start up. The snapshot remembers the hashes of the
+files it was built from, and is rebuilt automatically when any of them change.
+
+Usage: python knowledge_base.py build-kb
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+
+from ingredient_registry import REGISTRY
+
+# Bump this whenever the layout of the snapshot changes.
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILE = "knowledge_base.npz"
+
+TRANSLATION_FILE = "translation_dict2.json"
+SUBSTITUTION_FILE = "sub_dict2.json"
+MARKOV_FILE = "recipe_markov.json"
+WORD_EMBED_FILE = "ingred_word_emb.npy"
+CATEGORIES_FILE = "ingred_categories.npy"
+SOURCE_FILES = [TRANSLATION_FILE, SUBSTITUTION_FILE, MARKOV_FILE, WORD_EMBED_FILE,
+                CATEGORIES_FILE]
+
+# The knowledge base this process has loaded, if any.
+LOADED_KB = None
+
+class StringPool:
+    """
+    StringPool class: interns every string in the knowledge base, so each is
+    stored once and everything else refers to it by integer ID.
+    """
+    def __init__(self):
+        self.strings = []
+        self.ids = dict()
+
+    def get_id(self, string):
+        """
+        Gets the ID of a string, adding it to the pool if it's new.
+
+        Arguments:
+            string: The string to intern.
+        """
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.ids[string] = string_id
+        return string_id
+
+    def get_ids(self, strings):
+        """
+        Gets an int32 array of the IDs of a bunch of strings.
+
+        Arguments:
+            strings: The strings to intern.
+        """
+        return np.array([self.get_id(string) for string in strings], dtype=np.int32)
+
+    def to_arrays(self):
+        """
+        Packs the pool into a UTF-8 byte array and an array of offsets into it.
+        """
+        encoded = [string.encode("utf-8") for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def unpack_strings(blob, offsets):
+    """
+    Unpacks the strings packed by StringPool.to_arrays.
+
+    Arguments:
+        blob: The UTF-8 byte array.
+        offsets: Where each string starts (and ends) in the blob.
+    """
+    data = blob.tobytes()
+    offsets = offsets.tolist()
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+def compile_markov_chain(markov_data):
+    """
+    Compiles the Markov chain dictionary into CSR arrays. Every ingredient is a
+    state, including ones that only ever follow another (those just have empty
+    rows), and the columns within each row are sorted. Returns the states, and
+    the indptr, indices and data arrays.
+
+    Arguments:
+        markov_data: The Markov chain, as a dictionary of dictionaries.
+    """
+    states = list(markov_data.keys())
+    state_index = {state: i for i, state in enumerate(states)}
+    for followers in markov_data.values():
+        for follower in followers:
+            if follower not in state_index:
+                state_index[follower] = len(states)
+                states.append(follower)
+
+    indptr = [0]
+    indices = []
+    data = []
+    for state in states:
+        followers = sorted((state_index[follower], probability)
+                           for follower, probability in markov_data.get(state, dict()).items())
+        indices.extend(follower for follower, _ in followers)
+        data.extend(probability for _, probability in followers)
+        indptr.append(len(indices))
+    return (states, np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64),
+            np.array(data, dtype=np.float64))
+
+def hash_file(filename):
+    """
+    Gets the SHA-256 hash of a file.
+
+    Arguments:
+        filename: The file to hash.
+    """
+    with open(filename, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def source_hashes():
+    """
+    Gets the hashes of all of the files the knowledge base is built from.
+    """
+    return {filename: hash_file(filename) for filename in SOURCE_FILES}
+
+class KnowledgeBase:
+    """
+    KnowledgeBase class: everything our modules load at startup.
+
+    Attributes:
+        trans_data: Ingredient name to canonical name (translation_dict2.json).
+        sub_data: Canonical name to its subs and category (sub_dict2.json).
+        markov_data: The Markov chain (recipe_markov.json).
+        markov_states, markov_indptr, markov_indices, markov_probabilities:
+            The Markov chain compiled into CSR arrays.
+        embed_names: The names in the word embeddings, sorted.
+        embed_matrix: The word embeddings, a row per name in embed_names.
+        ingred_categories: Ingredient name to category.
+        singular_forms: Singular forms of the names in our vocabularies.
+    """
+    def __init__(self):
+        self.trans_data = dict()
+        self.sub_data = dict()
+        self.markov_data = dict()
+        self.markov_states = []
+        self.markov_indptr = np.zeros(1, dtype=np.int64)
+        self.markov_indices = np.zeros(0, dtype=np.int64)
+        self.markov_probabilities = np.zeros(0, dtype=np.float64)
+        self.embed_names = []
+        self.embed_matrix = np.zeros((0, 0), dtype=np.float32)
+        self.ingred_categories = dict()
+        self.singular_forms = dict()
+        self.hashes = dict()
+
+    @property
+    def word_embed_vals(self):
+        """
+        The word embeddings as a dictionary of name to vector.
+        """
+        return dict(zip(self.embed_names, self.embed_matrix))
+
+    @staticmethod
+    def from_sources():
+        """
+        Builds the knowledge base from the original JSON and .npy files.
+        """
+        kb = KnowledgeBase()
+        with open(TRANSLATION_FILE, "r") as json_file:
+            kb.trans_data = json.load(json_file)
+        with open(SUBSTITUTION_FILE, "r") as json_file:
+            kb.sub_data = json.load(json_file)
+        with open(MARKOV_FILE, "r") as json_file:
+            kb.markov_data = json.load(json_file)
+        (kb.markov_states, kb.markov_indptr, kb.markov_indices,
+         kb.markov_probabilities) = compile_markov_chain(kb.markov_data)
+
+        word_embed_vals = np.load(WORD_EMBED_FILE, allow_pickle=True).item()
+        kb.embed_names = sorted(word_embed_vals.keys())
+        kb.embed_matrix = np.ascontiguousarray(
+            np.stack([word_embed_vals[name] for name in kb.embed_names]))
+        kb.ingred_categories = np.load(CATEGORIES_FILE, allow_pickle=True).item()
+
+        # Work out the singular forms of every name we might look up now, as
+        # inflect is slow.
+        for name in itertools.chain(kb.sub_data, kb.markov_data, kb.embed_names):
+            kb.singular_forms[name.lower()] = REGISTRY.singular(name)
+
+        kb.hashes = source_hashes()
+        return kb
+
+    def save(self, filename=SNAPSHOT_FILE):
+        """
+        Saves the knowledge base as a binary snapshot. The file is written
+        atomically, so other processes never see half a snapshot.
+
+        Arguments:
+            filename: Where to save the snapshot.
+        """
+        pool = StringPool()
+        sub_names = list(self.sub_data.keys())
+        sub_subs = [self.sub_data[name]["subs"] for name in sub_names]
+        arrays = {
+            "trans_keys": pool.get_ids(self.trans_data.keys()),
+            "trans_values": pool.get_ids(self.trans_data.values()),
+            "sub_names": pool.get_ids(sub_names),
+            "sub_categories": pool.get_ids(self.sub_data[name]["category"]
+                                           for name in sub_names),
+            "sub_offsets": np.cumsum([0] + [len(subs) for subs in sub_subs], dtype=np.int64),
+            "sub_subs": pool.get_ids(sub for subs in sub_subs for sub in subs),
+            "markov_states": pool.get_ids(self.markov_states),
+            "markov_rows": pool.get_ids(self.markov_data.keys()),
+            "markov_indptr": self.markov_indptr,
+            "markov_indices": self.markov_indices,
+            "markov_probabilities": self.markov_probabilities,
+            "embed_names": pool.get_ids(self.embed_names),
+            "embed_matrix": self.embed_matrix,
+            "category_names": pool.get_ids(self.ingred_categories.keys()),
+            "category_values": pool.get_ids(self.ingred_categories.values()),
+            "singular_names": pool.get_ids(self.singular_forms.keys()),
+            "singular_values": pool.get_ids(self.singular_forms.values()),
+        }
+        arrays["strings"], arrays["string_offsets"] = pool.to_arrays()
+        header = {"version": SNAPSHOT_VERSION, "hashes": self.hashes}
+        arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        file_handle, temp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_handle, "wb") as snapshot_file:
+                np.savez(snapshot_file, **arrays)
+            # mkstemp only lets us read the file.
+            os.chmod(temp_filename, 0o644)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    @staticmethod
+    def load(filename=SNAPSHOT_FILE, hashes=None):
+        """
+        Loads a binary snapshot. Returns None if there isn't one, or if it's
+        from a different version or was built from different source files.
+
+        Arguments:
+            filename: The snapshot to load.
+            hashes: Hashes of the source files it should have been built from.
+        """
+        try:
+            snapshot = np.load(filename, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+        with snapshot:
+            header = json.loads(snapshot["header"].tobytes().decode("utf-8"))
+            if header.get("version") != SNAPSHOT_VERSION:
+                return None
+            if hashes is not None and header.get("hashes") != hashes:
+                return None
+
+            strings = unpack_strings(snapshot["strings"], snapshot["string_offsets"])
+            def get_strings(name):
+                return [strings[i] for i in snapshot[name].tolist()]
+
+            kb = KnowledgeBase()
+            kb.hashes = header["hashes"]
+            kb.trans_data = dict(zip(get_strings("trans_keys"), get_strings("trans_values")))
+
+            sub_offsets = snapshot["sub_offsets"].tolist()
+            sub_subs = get_strings("sub_subs")
+            for name, category, start, end in zip(get_strings("sub_names"),
+                                                   get_strings("sub_categories"),
+                                                   sub_offsets, sub_offsets[1:]):
+                kb.sub_data[name] = {"subs": sub_subs[start:end], "category": category}
+
+            kb.markov_states = get_strings("markov_states")
+            kb.markov_indptr = snapshot["markov_indptr"]
+            kb.markov_indices = snapshot["markov_indices"]
+            kb.markov_probabilities = snapshot["markov_probabilities"]
+            indptr = kb.markov_indptr.tolist()
+            indices = kb.markov_indices.tolist()
+            probabilities = kb.markov_probabilities.tolist()
+            for row, state in enumerate(get_strings("markov_rows")):
+                kb.markov_data[state] = {
+                    kb.markov_states[column]: probability for column, probability
+                    in zip(indices[indptr[row]:indptr[row + 1]],
+                           probabilities[indptr[row]:indptr[row + 1]])}
+
+            kb.embed_names = get_strings("embed_names")
+            kb.embed_matrix = snapshot["embed_matrix"]
+            kb.ingred_categories = dict(zip(get_strings("category_names"),
+                                            get_strings("category_values")))
+            kb.singular_forms = dict(zip(get_strings("singular_names"),
+                                         get_strings("singular_values")))
+        return kb
+
+def build_knowledge_base(filename=SNAPSHOT_FILE):
+    """
+    Builds the knowledge base from its source files and saves the snapshot.
+
+    Arguments:
+        filename: Where to save the snapshot.
+    """
+    kb = KnowledgeBase.from_sources()
+    kb.save(filename)
+    return kb
+
+def get_knowledge_base(filename=SNAPSHOT_FILE):
+    """
+    Gets the knowledge base, loading it from the snapshot if it's up to date and
+    rebuilding it (and the snapshot) if not. It's only loaded once per process.
+    The singular forms it holds are shared with the ingredient registry.
+
+    Arguments:
+        filename: The snapshot to use.
+    """
+    global LOADED_KB # pylint: disable=global-statement
+    if LOADED_KB is None:
+        kb = KnowledgeBase.load(filename, source_hashes())
+        if kb is None:
+            kb = KnowledgeBase.from_sources()
+            try:
+                kb.save(filename)
+            except OSError:
+                pass # We can still run without a snapshot, just more slowly.
+        REGISTRY.singular_forms.update(kb.singular_forms)
+        LOADED_KB = kb
+    return LOADED_KB
+
+def main():
+    """
+    Main function: builds the knowledge base snapshot.
+    """
+    parser = argparse.ArgumentParser(description="Manage the knowledge base snapshot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build-kb", help="Compile the knowledge base "
+                                         "into a binary snapshot.")
+    build_parser.add_argument("--output", default=SNAPSHOT_FILE,
+                              help="Where to save the snapshot.")
+
+    args = parser.parse_args()
+
+    if args.command == "build-kb":
+        kb = build_knowledge_base(args.output)
+        print("Built {0}: {1} translations, {2} substitutions, {3} Markov states, "
+              "{4} embeddings.".format(args.output, len(kb.trans_data), len(kb.sub_data),
+                                       len(kb.markov_states), len(kb.embed_names)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""
+markov_builder.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Builds the Markov chain (recipe_markov.json) from recipes downloaded using
+meanrecipe (https://github.com/schollz/meanrecipe). The recipes are streamed
+from the file one at a time, rather than loading the whole corpus, and the
+raw counts of each transition are kept (in markov_counts.npz) so that new
+recipes can be folded into the chain later without reading the old ones again.
+The counts are only turned into probabilities at the very end.
+
+Big corpora are counted in parallel: the corpus is split into shards (each
+file is a shard, big JSONL files are split further by byte range, and big
+JSON arrays are streamed in this process and handed out in chunks of
+recipes), each shard is counted by a process in a pool, and the counts are
+merged in order, so the chain comes out exactly the same as when it's built in
+one process.
+
+Usage: python markov_builder.py recipes.json [more_recipes.json ...] [--update]
+"""
+
+import os
+import re
+import json
+import argparse
+import itertools
+import tempfile
+import collections
+import multiprocessing
+
+import numpy as np
+
+import knowledge_base
+from knowledge_base import StringPool, unpack_strings
+
+# Bump this whenever the layout of the counts file changes.
+COUNTS_VERSION = 1
+COUNTS_FILE = "markov_counts.npz"
+# Recipes with fewer ingredients than this are left out of the chain.
+MIN_INGREDIENTS = 3
+# How much of a recipe file to read at a time, in characters.
+READ_SIZE = 1 << 16
+# Transitions are stored with the ID of the ingredient they're from in the
+# high bits of the key, and the ID of the one they're to in the low bits.
+ID_BITS = 32
+
+# JSONL files bigger than this are split into shards of about this size, in
+# bytes, to be counted in parallel.
+SHARD_SIZE = 16 << 20
+# JSON arrays bigger than SHARD_SIZE are handed out in chunks of this many
+# recipes instead.
+CHUNK_RECIPES = 1000
+# How many shards each process can have waiting at a time.
+SHARDS_PER_PROCESS = 2
+
+# Translation dictionary of a worker process counting shards.
+WORKER_TRANSLATIONS = None
+
+# Whitespace and commas between the values of a JSON array (or JSONL file).
+SEPARATORS = re.compile(r"[\s,]*")
+
+def iter_json_values(json_file, read_size=READ_SIZE):
+    """
+    Yields the values in a JSON file one at a time, reading a bit of the file
+    at a time. The file can either be one JSON array (like meanrecipe's
+    recipes.json), in which case its items are yielded, or have a JSON value on
+    each line.
+
+    Arguments:
+        json_file: The open file to read.
+        read_size: How many characters to read at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    end_of_file = False
+    in_array = None
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position == len(buffer):
+            if end_of_file:
+                return
+            buffer, position = json_file.read(read_size), 0
+            end_of_file = not buffer
+            continue
+
+        if in_array is None:
+            in_array = buffer[position] == "["
+            if in_array:
+                position += 1
+            continue
+        if in_array and buffer[position] == "]":
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if end_of_file:
+                raise
+            end = None
+        if end is None or (end == len(buffer) and not end_of_file):
+            # The value might carry on past what we've read so far.
+            more = json_file.read(read_size)
+            end_of_file = not more
+            buffer, position = buffer[position:] + more, 0
+            continue
+        yield value
+        position = end
+
+def iter_recipes(filename):
+    """
+    Yields the recipes in a meanrecipe recipes file one at a time.
+
+    Arguments:
+        filename: The recipes file.
+    """
+    with open(filename, "r") as recipe_file:
+        yield from iter_json_values(recipe_file)
+
+def is_json_array(filename):
+    """
+    Checks whether a recipe file is one JSON array (rather than JSONL).
+
+    Arguments:
+        filename: The recipe file.
+    """
+    with open(filename, "rb") as recipe_file:
+        start = recipe_file.read(1024).lstrip()
+    return start.startswith(b"[")
+
+def iter_shards(recipe_files, shard_size=SHARD_SIZE, chunk_recipes=CHUNK_RECIPES):
+    """
+    Splits the recipe files into shards, yielding them in order. A file no
+    bigger than shard_size is one shard, and a bigger JSONL file is split into
+    byte ranges of about shard_size; these shards are (filename, start, end)
+    tuples (with end None for a whole file), read by the worker. A JSON array
+    can't be split by byte range, so a big one is streamed here instead, and
+    its shards are lists of chunk_recipes recipes.
+
+    Arguments:
+        recipe_files: The recipe files.
+        shard_size: How big each shard of a JSONL file should be, in bytes.
+        chunk_recipes: How many recipes each shard of a JSON array should have.
+    """
+    for filename in recipe_files:
+        size = os.path.getsize(filename)
+        if size <= shard_size:
+            yield (filename, 0, None)
+        elif is_json_array(filename):
+            recipes = iter_recipes(filename)
+            chunk = list(itertools.islice(recipes, chunk_recipes))
+            while chunk:
+                yield chunk
+                chunk = list(itertools.islice(recipes, chunk_recipes))
+        else:
+            yield from ((filename, start, min(start + shard_size, size))
+                        for start in range(0, size, shard_size))
+
+def iter_shard_recipes(filename, start, end):
+    """
+    Yields the recipes in a shard of a recipe file. Each line of a JSONL file
+    belongs to the shard its first byte is in.
+
+    Arguments:
+        filename: The recipe file.
+        start: Where the shard starts, in bytes.
+        end: Where the shard ends, in bytes (or None for the whole file).
+    """
+    if end is None:
+        yield from iter_recipes(filename)
+        return
+    with open(filename, "rb") as recipe_file:
+        if start > 0:
+            # Skip the rest of the line the byte before the shard is in, which
+            # belongs to the shard before this one.
+            recipe_file.seek(start - 1)
+            recipe_file.readline()
+        while recipe_file.tell() < end:
+            line = recipe_file.readline()
+            if not line:
+                break
+            if line.strip():
+                yield json.loads(line)
+
+class TransitionCounts:
+    """
+    TransitionCounts class: how many times each ingredient follows each other
+    ingredient (in alphabetical order) in a corpus of recipes. Ingredients are
+    interned in a StringPool, and each transition's count is stored under a
+    single integer key.
+    """
+    def __init__(self):
+        self.pool = StringPool()
+        self.counts = collections.Counter()
+        self.recipes = 0
+
+    def add_recipe(self, ingredient_names, translations):
+        """
+        Adds the transitions of a recipe, if it has enough ingredients. Returns
+        whether it was added.
+
+        Arguments:
+            ingredient_names: The names of the recipe's ingredients.
+            translations: Dictionary translating ingredient names, as in
+                translation_dict2.json.
+        """
+        if len(ingredient_names) < MIN_INGREDIENTS:
+            return False
+        ingredient_ids = [self.pool.get_id(translations.get(name, name))
+                          for name in sorted(ingredient_names)]
+        for from_id, to_id in zip(ingredient_ids, ingredient_ids[1:]):
+            self.counts[(from_id << ID_BITS) | to_id] += 1
+        self.recipes += 1
+        return True
+
+    def add_recipes(self, recipes, translations):
+        """
+        Adds the transitions of a bunch of recipes (as meanrecipe dictionaries),
+        returning how many of them were added.
+
+        Arguments:
+            recipes: The recipes, which can be any iterable.
+            translations: Dictionary translating ingredient names.
+        """
+        added = 0
+        for recipe in recipes:
+            names = [ingredient["ingredient"] for ingredient in recipe.get("ingredients", [])]
+            added += self.add_recipe(names, translations)
+        return added
+
+    def merge(self, other):
+        """
+        Adds the counts of another TransitionCounts to these.
+
+        Arguments:
+            other: The TransitionCounts to add.
+        """
+        new_ids = [self.pool.get_id(string) for string in other.pool.strings]
+        mask = (1 << ID_BITS) - 1
+        for key, count in other.counts.items():
+            self.counts[(new_ids[key >> ID_BITS] << ID_BITS) | new_ids[key & mask]] += count
+        self.recipes += other.recipes
+
+    def to_markov_data(self):
+        """
+        Gets the Markov chain, as a dictionary mapping each ingredient to a
+        dictionary of the probability of each ingredient following it. Each
+        row is normalized once, from the raw counts.
+        """
+        strings = self.pool.strings
+        mask = (1 << ID_BITS) - 1
+        rows = dict()
+        for key, count in self.counts.items():
+            rows.setdefault(key >> ID_BITS, []).append((key & mask, count))
+
+        markov_data = dict()
+        for from_id, followers in rows.items():
+            total = sum(count for _, count in followers)
+            markov_data[strings[from_id]] = {strings[to_id]: count / total
+                                             for to_id, count in followers}
+        return markov_data
+
+    def save(self, filename=COUNTS_FILE):
+        """
+        Saves the counts. The file is written atomically, so an interrupted
+        build never leaves half of it behind.
+
+        Arguments:
+            filename: Where to save the counts.
+        """
+        keys = np.fromiter(self.counts.keys(), dtype=np.int64, count=len(self.counts))
+        arrays = {"from_ids": (keys >> ID_BITS).astype(np.int32),
+                  "to_ids": (keys & ((1 << ID_BITS) - 1)).astype(np.int32),
+                  "counts": np.fromiter(self.counts.values(), dtype=np.int64,
+                                        count=len(self.counts))}
+        arrays["strings"], arrays["string_offsets"] = self.pool.to_arrays()
+        header = {"version": COUNTS_VERSION, "recipes": self.recipes}
+        arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        file_handle, temp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_handle, "wb") as counts_file:
+                np.savez_compressed(counts_file, **arrays)
+            # mkstemp only lets us read the file.
+            os.chmod(temp_filename, 0o644)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    @staticmethod
+    def load(filename=COUNTS_FILE):
+        """
+        Loads counts saved by save.
+
+        Arguments:
+            filename: The counts file to load.
+        """
+        with np.load(filename, allow_pickle=False) as counts_file:
+            header = json.loads(counts_file["header"].tobytes().decode("utf-8"))
+            if header.get("version") != COUNTS_VERSION:
+                raise ValueError("{0} is from a different version of the counts "
+                                 "format".format(filename))
+            counts = TransitionCounts()
+            for string in unpack_strings(counts_file["strings"], counts_file["string_offsets"]):
+                counts.pool.get_id(string)
+            keys = (counts_file["from_ids"].astype(np.int64) << ID_BITS) | \
+                counts_file["to_ids"].astype(np.int64)
+            counts.counts.update(dict(zip(keys.tolist(), counts_file["counts"].tolist())))
+            counts.recipes = header["recipes"]
+        return counts
+
+def set_worker_translations(translations):
+    """
+    Sets the translation dictionary of a worker process (the initializer of the
+    pool in count_in_parallel).
+
+    Arguments:
+        translations: Dictionary translating ingredient names.
+    """
+    global WORKER_TRANSLATIONS # pylint: disable=global-statement
+    WORKER_TRANSLATIONS = translations
+
+def count_shard(shard):
+    """
+    Counts the transitions in one shard, in a worker process.
+
+    Arguments:
+        shard: The (filename, start, end) of the shard, or its list of recipes.
+    """
+    counts = TransitionCounts()
+    recipes = shard if isinstance(shard, list) else iter_shard_recipes(*shard)
+    counts.add_recipes(recipes, WORKER_TRANSLATIONS)
+    return counts
+
+def count_in_parallel(recipe_files, translations, processes=None, shard_size=SHARD_SIZE):
+    """
+    Counts the transitions in some recipe files using a pool of processes. The
+    counts of the shards are merged in order as they come back, so they're
+    exactly the same as if the files had been counted one after another. Only
+    a few shards are handed out ahead of time, so chunks of a big JSON array
+    aren't all read in at once.
+
+    Arguments:
+        recipe_files: The recipe files to read.
+        translations: Dictionary translating ingredient names.
+        processes: Number of processes (defaults to the number of CPUs).
+        shard_size: How big each shard of a JSONL file should be, in bytes.
+    """
+    counts = TransitionCounts()
+    max_pending = SHARDS_PER_PROCESS * (processes or os.cpu_count() or 1)
+    with multiprocessing.Pool(processes, initializer=set_worker_translations,
+                              initargs=(translations,)) as pool:
+        pending = collections.deque()
+        for shard in iter_shards(recipe_files, shard_size):
+            pending.append(pool.apply_async(count_shard, (shard,)))
+            if len(pending) >= max_pending:
+                counts.merge(pending.popleft().get())
+        while pending:
+            counts.merge(pending.popleft().get())
+    return counts
+
+def write_markov_chain(counts, filename=knowledge_base.MARKOV_FILE):
+    """
+    Writes the Markov chain made from some counts to a JSON file.
+
+    Arguments:
+        counts: The TransitionCounts to use.
+        filename: Where to write the chain.
+    """
+    with open(filename, "w") as markov_file:
+        json.dump(counts.to_markov_data(), markov_file)
+
+def build_markov_chain(recipe_files, translations, counts_file=None, update=False,
+                       processes=1, shard_size=SHARD_SIZE):
+    """
+    Counts the transitions in some recipe files, saving the counts if a counts
+    file is given. If update is set, the counts in that file (if it exists) are
+    added to, rather than starting again. Returns the counts.
+
+    Arguments:
+        recipe_files: The meanrecipe recipe files to read.
+        translations: Dictionary translating ingredient names.
+        counts_file: Where to keep the counts, if anywhere.
+        update: Whether to add to the counts already in counts_file.
+        processes: Number of processes to count with (None for the number of
+            CPUs, and 1 to count in this process).
+        shard_size: How big each shard of a JSONL file should be, in bytes.
+    """
+    if update and counts_file and os.path.exists(counts_file):
+        counts = TransitionCounts.load(counts_file)
+    else:
+        counts = TransitionCounts()
+    if processes == 1:
+        for filename in recipe_files:
+            counts.add_recipes(iter_recipes(filename), translations)
+    else:
+        counts.merge(count_in_parallel(recipe_files, translations, processes, shard_size))
+    if counts_file:
+        counts.save(counts_file)
+    return counts
+
+def main():
+    """
+    Main function - builds (or updates) the Markov chain.
+    """
+    parser = argparse.ArgumentParser(description="Builds the Markov chain from meanrecipe "
+                                     "recipe files.")
+    parser.add_argument("recipes", nargs="+", help="Recipe files (JSON arrays or JSONL).")
+    parser.add_argument("--counts", default=COUNTS_FILE,
+                        help="Where to keep the raw transition counts.")
+    parser.add_argument("--update", action="store_true",
+                        help="Add the recipes to the existing counts, rather than "
+                        "starting again.")
+    parser.add_argument("--output", default=knowledge_base.MARKOV_FILE,
+                        help="Where to write the Markov chain.")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Number of processes to count with (0 for the number of CPUs).")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE >> 20,
+                        help="Size of each shard of a JSONL file (and the size above "
+                        "which JSON arrays are split into chunks of recipes), in MiB.")
+
+    args = parser.parse_args()
+
+    translations = knowledge_base.get_knowledge_base().trans_data
+    counts = build_markov_chain(args.recipes, translations, args.counts, args.update,
+                                args.processes or None, args.shard_size << 20)
+    write_markov_chain(counts, args.output)
+    print("Used {0} recipes: {1} ingredients, {2} transitions.".format(
+        counts.recipes, len(counts.pool.strings), len(counts.counts)))
+
+if __name__ == "__main__":
+    main()
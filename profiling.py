@@ -0,0 +1,201 @@
+"""
+profiling.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Profiles a run of the genetic algorithm across processes: the main process and
+each fitness worker are profiled with cProfile, and their profiles are merged
+into one report. The report has a table of cumulative times, a pstats file (for
+tools like snakeviz), and collapsed stacks that flamegraph.pl or speedscope can
+draw.
+"""
+
+import os
+import pstats
+import cProfile
+import contextlib
+import collections
+
+# Number of functions in the cumulative time table.
+TABLE_LIMIT = 40
+# Stacks deeper than this are cut off.
+MAX_STACK_DEPTH = 64
+# Stacks taking less time than this (in seconds) are left out.
+MIN_STACK_SECONDS = 1e-6
+
+class RawStats:
+    """
+    RawStats class: wraps the stats dictionary of a cProfile.Profile (which,
+    unlike the profile itself, can be sent between processes) so that pstats
+    can load it.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        """
+        Does nothing, as the stats have already been made; pstats calls this
+        before reading them.
+        """
+
+def profile_call(function, *args):
+    """
+    Calls a function under cProfile, returning what it returned along with the
+    stats dictionary of the profile.
+
+    Arguments:
+        function: The function to call.
+        args: Arguments to call it with.
+    """
+    profile = cProfile.Profile()
+    result = profile.runcall(function, *args)
+    profile.create_stats()
+    return result, profile.stats
+
+def function_label(function):
+    """
+    Gets a readable label for a function in a stats dictionary, which is
+    (filename, line, name).
+
+    Arguments:
+        function: The function's key in the stats dictionary.
+    """
+    filename, line, name = function
+    if filename == "~":
+        # Built in functions have no file.
+        return name.replace(";", ",")
+    return "{0} ({1}:{2})".format(name, os.path.basename(filename), line).replace(";", ",")
+
+def collapsed_stacks(stats, root=None):
+    """
+    Works out collapsed stacks (a count of microseconds for each stack, with
+    the frames separated by semicolons) from a stats dictionary. cProfile only
+    records which function called which, so the time of a function with
+    several callers is split between them in proportion to the time spent on
+    each call.
+
+    Arguments:
+        stats: The stats dictionary of a profile.
+        root: A frame to put at the bottom of every stack, if any (such as the
+            name of the process).
+    """
+    children = collections.defaultdict(list)
+    roots = []
+    for function, (_, _, _, _, callers) in stats.items():
+        real_callers = [caller for caller in callers if caller != function]
+        if not real_callers:
+            roots.append(function)
+        for caller in real_callers:
+            children[caller].append((function, callers[caller][3]))
+
+    stacks = collections.Counter()
+    # Depth first, with each entry being (function, stack so far, share of
+    # the function's time that belongs to this stack).
+    to_visit = [(function, [root] if root else [], 1.0) for function in roots]
+    while to_visit:
+        function, stack, share = to_visit.pop()
+        stack = stack + [function_label(function)]
+        _, _, self_time, cumulative_time, _ = stats[function]
+        if self_time * share >= MIN_STACK_SECONDS:
+            stacks[";".join(stack)] += self_time * share
+        if len(stack) >= MAX_STACK_DEPTH or not cumulative_time:
+            continue
+        for child, call_time in children[function]:
+            child_time = stats[child][3]
+            child_share = call_time * share / child_time if child_time else 0.0
+            if child_time * child_share >= MIN_STACK_SECONDS and \
+                    function_label(child) not in stack:
+                to_visit.append((child, stack, child_share))
+    return {stack: int(round(seconds * 1e6)) for stack, seconds in stacks.items()
+            if seconds * 1e6 >= 1}
+
+class Profiler:
+    """
+    Profiler class: collects the profiles of every process in a run, merging
+    together any from the same process, and writes out the merged report.
+    """
+    def __init__(self):
+        self.profiles = dict()
+
+    def add(self, label, stats):
+        """
+        Adds a profile.
+
+        Arguments:
+            label: Which process it's from, e.g. "main".
+            stats: The stats dictionary of the profile.
+        """
+        if label in self.profiles:
+            self.profiles[label].add(RawStats(stats))
+        else:
+            self.profiles[label] = pstats.Stats(RawStats(stats))
+
+    @contextlib.contextmanager
+    def profile(self, label):
+        """
+        Profiles the code inside a with block, in this process.
+
+        Arguments:
+            label: Which process this is, e.g. "main".
+        """
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.create_stats()
+            self.add(label, profile.stats)
+
+    def merged_stats(self):
+        """
+        Gets all of the profiles merged into one pstats.Stats (or None if there
+        aren't any).
+        """
+        merged = None
+        for process_stats in self.profiles.values():
+            if merged is None:
+                merged = pstats.Stats(RawStats(dict(process_stats.stats)))
+            else:
+                merged.add(RawStats(process_stats.stats))
+        return merged
+
+    def collapsed_stacks(self):
+        """
+        Gets the collapsed stacks of all of the profiles, each starting with
+        the label of its process.
+        """
+        stacks = collections.Counter()
+        for label, process_stats in self.profiles.items():
+            stacks.update(collapsed_stacks(process_stats.stats, label))
+        return stacks
+
+    def write_report(self, prefix, limit=TABLE_LIMIT):
+        """
+        Writes the merged report: prefix.txt has tables of the functions with
+        the most cumulative and internal time, prefix.prof is the merged pstats
+        file and prefix.collapsed has the collapsed stacks. Returns the names of
+        the files.
+
+        Arguments:
+            prefix: What to start the name of each file with.
+            limit: How many functions to list in each table.
+        """
+        merged = self.merged_stats()
+        if merged is None:
+            return []
+        table_file = prefix + ".txt"
+        with open(table_file, "w") as output_file:
+            output_file.write("Merged profiles of: {0}\n".format(
+                ", ".join(sorted(self.profiles))))
+            merged.stream = output_file
+            merged.sort_stats("cumulative").print_stats(limit)
+            merged.sort_stats("tottime").print_stats(limit)
+
+        stats_file = prefix + ".prof"
+        merged.dump_stats(stats_file)
+
+        stacks_file = prefix + ".collapsed"
+        with open(stacks_file, "w") as output_file:
+            for stack, microseconds in sorted(self.collapsed_stacks().items()):
+                output_file.write("{0} {1}\n".format(stack, microseconds))
+        return [table_file, stats_file, stacks_file]
@@ -7,20 +7,95 @@ recipes.
 """
 
 import os
-import json
-import itertools
+import functools
 
-import inflect
+import numpy as np
 
-# Opens both the translation and substitution data.
-with open('translation_dict2.json', 'r') as json_file:
-    TRANS_DATA = json.load(json_file)
-with open('sub_dict2.json', 'r') as json_file:
-    SUB_DATA = json.load(json_file)
+import knowledge_base
+import markov_builder
+from ingredient_registry import REGISTRY
 
+# Gets the translation, substitution and Markov chain data from the knowledge
+# base snapshot.
+KB = knowledge_base.get_knowledge_base()
+TRANS_DATA = KB.trans_data
+SUB_DATA = KB.sub_data
+MARKOV_DATA = KB.markov_data
 
-with open("recipe_markov.json", "r") as markov_file:
-    MARKOV_DATA = json.load(markov_file)
+REGISTRY.add_vocabulary("markov", MARKOV_DATA)
+
+# Probability used for any pair of ingredients the Markov chain hasn't seen.
+DEFAULT_PROBABILITY = 0.01
+
+class TransitionMatrix:
+    """
+    TransitionMatrix class: the Markov chain compiled into a sparse matrix in
+    CSR form, with the ingredients numbered by state ID. Any transition that
+    isn't stored has the default probability.
+    """
+    def __init__(self, states, indptr, indices, data, default=DEFAULT_PROBABILITY):
+        self.states = list(states)
+        self.state_index = {state: i for i, state in enumerate(self.states)}
+        self.default = default
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+
+        # As the columns in each row are sorted, the (row, column) keys of all
+        # of the stored entries are sorted too, so they can be binary searched.
+        rows = np.repeat(np.arange(len(self.states), dtype=np.int64), np.diff(self.indptr))
+        self.keys = rows * len(self.states) + self.indices
+
+    @staticmethod
+    def from_markov_data(markov_data, default=DEFAULT_PROBABILITY):
+        """
+        Compiles a Markov chain dictionary into a TransitionMatrix.
+
+        Arguments:
+            markov_data: The Markov chain, as a dictionary of dictionaries.
+            default: Probability of any transition that isn't stored.
+        """
+        return TransitionMatrix(*knowledge_base.compile_markov_chain(markov_data), default)
+
+    def __len__(self):
+        return len(self.states)
+
+    def get_state(self, ingredient):
+        """
+        Gets the state ID of an ingredient string, or -1 if it isn't in the
+        chain.
+
+        Arguments:
+            ingredient: The ingredient string to look up.
+        """
+        return self.state_index.get(ingredient, -1)
+
+    def lookup(self, from_states, to_states):
+        """
+        Gets the transition probabilities for arrays of (from, to) state IDs
+        all at once. Pairs involving a state of -1 get the default probability.
+
+        Arguments:
+            from_states: Array of state IDs to transition from.
+            to_states: Array of state IDs to transition to.
+        """
+        from_states = np.asarray(from_states, dtype=np.int64)
+        to_states = np.asarray(to_states, dtype=np.int64)
+        probabilities = np.full(from_states.shape, self.default, dtype=np.float64)
+        if not len(self.keys):
+            return probabilities
+
+        known = (from_states >= 0) & (to_states >= 0)
+        wanted = from_states[known] * len(self.states) + to_states[known]
+        positions = np.minimum(np.searchsorted(self.keys, wanted), len(self.keys) - 1)
+        found = self.keys[positions] == wanted
+        known_probabilities = np.full(wanted.shape, self.default, dtype=np.float64)
+        known_probabilities[found] = self.data[positions[found]]
+        probabilities[known] = known_probabilities
+        return probabilities
+
+MARKOV_MATRIX = TransitionMatrix(KB.markov_states, KB.markov_indptr, KB.markov_indices,
+                                 KB.markov_probabilities)
 
 def substitutions(ingredient=None):
     """
@@ -46,19 +121,25 @@ def get_ingredient_string(ingredient):
         ingredient - an Ingredient instance where we want to find the
             corresponding string.
     """
+    return REGISTRY.resolve(ingredient, "markov") or ingredient
 
+@functools.lru_cache(maxsize=8192)
+def get_candidate_states(ingredient):
+    """
+    Gets the state IDs of an ingredient and all of its substitutes, as an
+    array, with -1 for any that aren't in the Markov chain.
 
-    i_engine = inflect.engine()
-    string = str(ingredient).lower()
-    if i_engine.singular_noun(string):
-        string = str(i_engine.singular_noun(string)).split(" ")
-    else:
-        string = string.split(" ")
-    for i in range(len(string), -1, -1):
-        for combo in itertools.combinations(string, i):
-            if MARKOV_DATA.get(" ".join(combo)):
-                return " ".join(combo)
-    return ingredient
+    Arguments:
+        ingredient: Ingredient string to get the states of.
+    """
+    states = []
+    for candidate in substitutions(ingredient) + [ingredient]:
+        ingredient_string = get_ingredient_string(candidate)
+        if not ingredient_string:
+            states.append(-1)
+        else:
+            states.append(MARKOV_MATRIX.get_state(ingredient_string))
+    return np.array(states, dtype=np.int64)
 
 def get_probability(search_terms):
     """
@@ -69,87 +150,67 @@ def get_probability(search_terms):
     Arguments:
         search_terms: Recipe search terms to use.
     """
-    result = 1.0
+    return get_probability_batch([search_terms])[0]
 
-    search_terms = sorted(search_terms)
-
-    search_pairs = zip(search_terms, search_terms[1:])
-
-    result = 1.0
-
-    for ing1, ing2 in search_pairs:
-        probabilities = []
-        ing1_subs = substitutions(ing1) + [ing1]
-        ing2_subs = substitutions(ing2) + [ing2]
-        for i_1, i_2 in itertools.product(ing1_subs, ing2_subs):
-            ing1_string = get_ingredient_string(i_1)
-            ing2_string = get_ingredient_string(i_2)
-            if not ing1_string or not ing2_string:
-                probabilities.append(0.01)
-            else:
-                probabilities.append(MARKOV_DATA.get(ing1_string, dict()).get(ing2_string, 0.01))
-                probabilities.append(MARKOV_DATA.get(ing2_string, dict()).get(ing1_string, 0.01))
+def get_probability_batch(search_term_lists):
+    """
+    Gets the probability of a whole bunch of recipes at once. For each pair of
+    neighbouring ingredients (in alphabetical order) we take the most likely
+    transition between any of their substitutes, in either direction, and the
+    probability of a recipe is the product of these. All of the transitions of
+    all of the recipes are looked up together.
 
-        result *= max(probabilities)
-    return result
+    Arguments:
+        search_term_lists: List of the search terms of each recipe.
+    """
+    from_states = []
+    to_states = []
+    # Where each pair's candidate transitions start, and how many pairs each
+    # recipe has.
+    pair_starts = []
+    pair_counts = []
+    num_transitions = 0
+
+    for search_terms in search_term_lists:
+        search_terms = sorted(str(term) for term in search_terms)
+        pair_counts.append(max(len(search_terms) - 1, 0))
+        for ing1, ing2 in zip(search_terms, search_terms[1:]):
+            ing1_states = get_candidate_states(ing1)
+            ing2_states = get_candidate_states(ing2)
+            from_states.append(np.repeat(ing1_states, len(ing2_states)))
+            to_states.append(np.tile(ing2_states, len(ing1_states)))
+            pair_starts.append(num_transitions)
+            num_transitions += len(ing1_states) * len(ing2_states)
+
+    results = np.ones(len(pair_counts), dtype=np.float64)
+    if not pair_starts:
+        return results.tolist()
+
+    from_states = np.concatenate(from_states)
+    to_states = np.concatenate(to_states)
+    probabilities = np.maximum(MARKOV_MATRIX.lookup(from_states, to_states),
+                               MARKOV_MATRIX.lookup(to_states, from_states))
+    pair_probabilities = np.maximum.reduceat(probabilities, pair_starts)
+
+    pair_counts = np.array(pair_counts)
+    has_pairs = pair_counts > 0
+    recipe_starts = np.concatenate(([0], np.cumsum(pair_counts)[:-1]))[has_pairs]
+    results[has_pairs] = np.multiply.reduceat(pair_probabilities, recipe_starts)
+    return results.tolist()
 
 def create_markov_chain(folder):
     """
     Creates a Markov chain based on a bunch of recipe JSON files downloaded
-    using meanrecipe (https://github.com/schollz/meanrecipe).
+    using meanrecipe (https://github.com/schollz/meanrecipe). The recipes are
+    streamed from the file, and the transition counts are kept in
+    markov_counts.npz so more recipes can be added later (see
+    markov_builder.py).
 
     Arguments:
         folder: The folder where the recipes are stored.
     """
-    with open(os.path.join(folder, "recipes.json"), "r") as recipe_data:
-        recipes = json.load(recipe_data)
-
-    print("Using {0} recipes for learning".format(len(recipes)))
-    all_ingredients_map = dict()
-
-    for recipe in recipes:
-        for ing in recipe.get("ingredients", []):
-            all_ingredients_map[ing["ingredient"]] = 0
-
-    all_ingredients = []
-    i = 0
-    for ing in all_ingredients_map:
-        all_ingredients.append(map)
-        all_ingredients_map[ing] = i
-        i += 1
-
-    print("Got {0} ingredients".format(len(all_ingredients)))
-
-    recipe_num = dict()
-
-    for _, recipe in enumerate(recipes):
-        if len(recipe.get("ingredients", [])) < 3:
-            continue
-
-        recipe_ingredients = []
-        for ing in recipe.get("ingredients", []):
-
-            recipe_ingredients.append(ing["ingredient"])
-
-
-        recipe_ingredients = sorted(recipe_ingredients)
-        for ing1, ing2 in zip(recipe_ingredients, recipe_ingredients[1:]):
-            if ing1 in TRANS_DATA:
-                ing1 = TRANS_DATA[ing1]
-            if ing2 in TRANS_DATA:
-                ing2 = TRANS_DATA[ing2]
-            if ing1 not in recipe_num:
-                recipe_num[ing1] = {ing2: 1}
-            else:
-                if ing2 not in recipe_num[ing1]:
-                    recipe_num[ing1][ing2] = 1
-                else:
-                    recipe_num[ing1][ing2] += 1
-
-
-    for _, dict_val in recipe_num.items():
-        for follower, _ in dict_val.items():
-            dict_val[follower] /= sum(dict_val.values())
-
-    with open("recipe_markov.json", "w") as file:
-        json.dump(recipe_num, file)
+    counts = markov_builder.build_markov_chain([os.path.join(folder, "recipes.json")],
+                                               TRANS_DATA, markov_builder.COUNTS_FILE)
+    print("Used {0} recipes for learning".format(counts.recipes))
+    print("Got {0} ingredients".format(len(counts.pool.strings)))
+    markov_builder.write_markov_chain(counts)
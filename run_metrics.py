@@ -0,0 +1,192 @@
+"""
+run_metrics.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Records what happens in each generation of the genetic algorithm (how long
+each phase takes, how many recipes are made, rejected and found in the cache,
+how busy the fitness workers are and how much memory is used) and writes it out
+as one line of JSON per generation. When metrics are turned off, the
+NULL_METRICS recorder is used instead, which does nothing at all.
+"""
+
+import json
+import time
+import contextlib
+import tracemalloc
+
+class MetricsRecorder:
+    """
+    MetricsRecorder class: collects the metrics of the current generation and
+    writes them to a JSONL file when the generation ends.
+    """
+    enabled = True
+
+    def __init__(self, filename, trace_memory=True):
+        self.output_file = open(filename, "w")
+        self.trace_memory = trace_memory
+        self.record = None
+        self.start_time = None
+        self.worker_busy = 0.0
+        self.worker_capacity = 0.0
+        # Cache counters at the end of the last generation, so we can report
+        # how much they changed by.
+        self.cache_counters = (0, 0, 0)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start_generation(self, generation):
+        """
+        Starts recording a new generation.
+
+        Arguments:
+            generation: Number of the generation.
+        """
+        self.record = {"generation": generation,
+                       "phase_seconds": dict(),
+                       "fitness_seconds": dict()}
+        self.worker_busy = 0.0
+        self.worker_capacity = 0.0
+        if self.trace_memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.clear_traces()
+        self.start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times a phase of the generation (the time is added to any the phase
+        has already taken).
+
+        Arguments:
+            name: Name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_times("phase_seconds", {name: time.perf_counter() - start})
+
+    def add_times(self, group, timings):
+        """
+        Adds a dictionary of times (in seconds) to a group of times.
+
+        Arguments:
+            group: Name of the group, e.g. "fitness_seconds".
+            timings: Dictionary of times to add.
+        """
+        times = self.record.setdefault(group, dict())
+        for name, seconds in timings.items():
+            times[name] = times.get(name, 0.0) + seconds
+
+    def count(self, name, number=1):
+        """
+        Adds to one of the counts of the generation.
+
+        Arguments:
+            name: Name of the count, e.g. "offspring".
+            number: How much to add.
+        """
+        self.record[name] = self.record.get(name, 0) + number
+
+    def add_worker_time(self, busy_seconds, processes, wall_seconds):
+        """
+        Records a batch of work sent to the fitness workers.
+
+        Arguments:
+            busy_seconds: Total time the workers spent scoring.
+            processes: Number of workers.
+            wall_seconds: How long we waited for them.
+        """
+        self.worker_busy += busy_seconds
+        self.worker_capacity += processes * wall_seconds
+        self.record["workers"] = processes
+
+    def end_generation(self, fitness_cache=None):
+        """
+        Finishes recording the generation and writes it out.
+
+        Arguments:
+            fitness_cache: The FitnessCache used for the generation, if any.
+        """
+        record = self.record
+        record["wall_seconds"] = time.perf_counter() - self.start_time
+        if self.worker_capacity:
+            record["worker_busy_seconds"] = self.worker_busy
+            record["worker_utilization"] = self.worker_busy / self.worker_capacity
+        if fitness_cache is not None:
+            counters = (fitness_cache.hits, fitness_cache.misses, fitness_cache.duplicates)
+            record["cache_hits"], record["cache_misses"], record["duplicates"] = [
+                new - old for new, old in zip(counters, self.cache_counters)]
+            self.cache_counters = counters
+        if self.trace_memory:
+            record["peak_memory_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+        self.output_file.write(json.dumps(record) + "\n")
+        self.output_file.flush()
+        self.record = None
+
+    def close(self):
+        """
+        Closes the output file (and stops tracing memory).
+        """
+        self.output_file.close()
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class NullRecorder:
+    """
+    NullRecorder class: has the same methods as MetricsRecorder, but they do
+    nothing, so code can record metrics without checking if it needs to.
+    """
+    enabled = False
+
+    def start_generation(self, generation):
+        """Does nothing."""
+
+    def phase(self, name): # pylint: disable=unused-argument
+        """Returns a context manager that does nothing."""
+        return NULL_PHASE
+
+    def add_times(self, group, timings):
+        """Does nothing."""
+
+    def count(self, name, number=1):
+        """Does nothing."""
+
+    def add_worker_time(self, busy_seconds, processes, wall_seconds):
+        """Does nothing."""
+
+    def end_generation(self, fitness_cache=None):
+        """Does nothing."""
+
+    def close(self):
+        """Does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+NULL_PHASE = contextlib.nullcontext()
+NULL_METRICS = NullRecorder()
+
+def open_metrics(filename=None, trace_memory=True):
+    """
+    Gets a recorder that writes metrics to a file, or NULL_METRICS if there's
+    no file to write to.
+
+    Arguments:
+        filename: The JSONL file to write to, if any.
+        trace_memory: Whether to record peak memory (which slows things down).
+    """
+    if not filename:
+        return NULL_METRICS
+    return MetricsRecorder(filename, trace_memory)
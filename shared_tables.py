@@ -0,0 +1,67 @@
+"""
+shared_tables.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Puts numpy arrays (like our embedding and Markov tables) into shared memory,
+so that worker processes can use them without each having their own copy.
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Shared memory blocks this process has attached to. The arrays we hand out
+# are views on these, so they have to stay open for as long as we're running.
+ATTACHED_BLOCKS = []
+
+class SharedTables:
+    """
+    SharedTables class: copies a dictionary of named arrays into shared memory.
+    The specs can be sent to other processes (they're small and picklable) so
+    that they can attach to the arrays. The process that creates the tables is
+    the one that has to close them.
+    """
+    def __init__(self, arrays):
+        self.blocks = dict()
+        self.specs = dict()
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared_array[...] = array
+            self.blocks[name] = block
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """
+        Frees all of the shared memory.
+        """
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def attach(specs):
+    """
+    Attaches to tables made by SharedTables in another process, returning a
+    dictionary of read-only arrays. This is meant for worker processes started
+    by multiprocessing, which share the creator's resource tracker, so the
+    memory is only cleaned up once the creator closes it.
+
+    Arguments:
+        specs: The specs attribute of the SharedTables.
+    """
+    arrays = dict()
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        ATTACHED_BLOCKS.append(block)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays
@@ -0,0 +1,111 @@
+"""
+test_compact_recipe.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Tests that the genetic algorithm makes the same recipes from CompactRecipes as
+it does from Recipes, comparing them by fingerprint. The food2vec vectors are
+made up (as in benchmark.py), so the tests don't need the real ones.
+
+Usage: python -m unittest test_compact_recipe
+"""
+
+import os
+import json
+import pickle
+import random
+import tempfile
+import unittest
+import importlib
+
+import benchmark
+
+# Filled in by setUpModule, as cookie_generation loads the vectors on import.
+cookie_generation = None
+VECTORS_FOLDER = tempfile.TemporaryDirectory()
+INSPIRING_SET_FILE = "inspiring_set.json"
+# How many generations to run the genetic algorithm for.
+GENERATIONS = 3
+# How many new recipes the tournament and rank mating schemes make.
+OFFSPRING = 12
+
+def setUpModule():
+    """
+    Points cookie_generation at synthetic vectors, then imports it.
+    """
+    global cookie_generation # pylint: disable=global-statement
+    os.environ.setdefault("FOOD2VEC_VECTORS",
+                          benchmark.write_synthetic_vectors(VECTORS_FOLDER.name))
+    cookie_generation = importlib.import_module("cookie_generation")
+
+def tearDownModule():
+    VECTORS_FOLDER.cleanup()
+
+class CompactRecipeTest(unittest.TestCase):
+    """
+    CompactRecipeTest class: compares CompactRecipes to Recipes.
+    """
+    @classmethod
+    def setUpClass(cls):
+        with open(INSPIRING_SET_FILE, "r") as iset_file:
+            cls.inspiring_set = json.load(iset_file)
+
+    def population(self, compact):
+        """
+        Gets the inspiring set as a list of recipes.
+
+        Arguments:
+            compact: Whether to make CompactRecipes rather than Recipes.
+        """
+        return [cookie_generation.convert_format(recipe, compact)
+                for recipe in self.inspiring_set]
+
+    @staticmethod
+    def fingerprints(recipes):
+        """
+        Gets the fingerprints of a list of recipes.
+
+        Arguments:
+            recipes: The recipes.
+        """
+        return [recipe.fingerprint() for recipe in recipes]
+
+    def test_conversion(self):
+        recipes, compact_recipes = self.population(False), self.population(True)
+        self.assertIsInstance(compact_recipes[0], cookie_generation.CompactRecipe)
+        self.assertEqual(self.fingerprints(compact_recipes), self.fingerprints(recipes))
+        self.assertEqual(self.fingerprints(recipe.to_recipe() for recipe in compact_recipes),
+                         self.fingerprints(recipes))
+
+    def test_new_recipe_combo(self):
+        results = []
+        for compact in (False, True):
+            recipes = self.population(compact)
+            random.seed(1)
+            children = [recipes[i].new_recipe_combo(recipes[i + 1])
+                        for i in range(len(recipes) - 1)]
+            results.append((self.fingerprints(children), random.getstate()))
+        self.assertEqual(results[0], results[1])
+
+    def test_genetic_iteration(self):
+        for mating in sorted(cookie_generation.MATING_SCHEMES):
+            offspring = None if mating == "all-pairs" else OFFSPRING
+            populations = []
+            for compact in (False, True):
+                recipes = self.population(compact)
+                random.seed(2)
+                for generation in range(GENERATIONS):
+                    recipes = cookie_generation.genetic_iteration(
+                        recipes, mating=mating, offspring=offspring,
+                        unsorted=generation == 0)
+                populations.append(self.fingerprints(recipes))
+            with self.subTest(mating=mating):
+                self.assertEqual(populations[0], populations[1])
+
+    def test_pickle(self):
+        recipe = self.population(True)[0]
+        copy = pickle.loads(pickle.dumps(recipe))
+        self.assertEqual(copy.fingerprint(), recipe.fingerprint())
+        self.assertEqual(copy.fitness_level(), recipe.fitness_level())
+
+if __name__ == "__main__":
+    unittest.main()
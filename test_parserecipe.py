@@ -0,0 +1,164 @@
+"""
+test_parserecipe.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Tests fetching and parsing recipe pages against a small stand-in recipe site,
+served with http.server on localhost, so they run offline.
+
+Usage: python -m unittest test_parserecipe
+"""
+
+import time
+import threading
+import unittest
+import http.server
+import urllib.error
+from unittest import mock
+
+import parserecipe
+from ingredient_parser import parse_ingredient_lines
+
+# The ingredient lines of each recipe on the stand-in site.
+RECIPE_LINES = {
+    "/slow.html": ["2 cups all-purpose flour", "1 cup sugar"],
+    "/butter.html": ["1/2 cup butter, softened", "3/4 cup packed brown sugar"],
+    "/chips.html": ["2 cups semi-sweet chocolate chips", "1 tsp salt"],
+}
+
+def recipe_page(lines, div_class="tasty-recipes-ingredients"):
+    """
+    Makes the HTML of a recipe page.
+
+    Arguments:
+        lines: The ingredient lines of the recipe.
+        div_class: The class of the div the ingredients are in.
+    """
+    return '<div class="{0}"><ul>{1}</ul></div>'.format(
+        div_class, "".join("<li>{0}</li>".format(line) for line in lines))
+
+# The stand-in site: the status, headers and HTML of each page, by path.
+SITE = {
+    "/slow.html": (200, {}, recipe_page(RECIPE_LINES["/slow.html"])),
+    "/butter.html": (200, {}, recipe_page(RECIPE_LINES["/butter.html"],
+                                          "recipe-ingredients-wrapper")),
+    "/chips.html": (200, {}, recipe_page(RECIPE_LINES["/chips.html"])),
+    "/moved.html": (301, {"Location": "/butter.html"}, ""),
+    "/moved-again.html": (302, {"Location": "moved.html"}, ""),
+    "/loop.html": (302, {"Location": "/loop.html"}, ""),
+    "/no-recipe.html": (200, {}, "<p>Just a story about cookies.</p>"),
+}
+# How long the server takes to send /slow.html, in seconds, so that it
+# arrives after the pages after it.
+SLOW_PAGE_DELAY = 0.3
+
+class SiteHandler(http.server.BaseHTTPRequestHandler):
+    """
+    SiteHandler class: serves the pages of the stand-in site, keeping
+    connections open between requests, and recording the port each request
+    came from (so the connections can be counted).
+    """
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+        Serves a page of the site (or a 404 if there's no such page).
+        """
+        self.client_ports.append(self.client_address[1])
+        status, headers, html = SITE.get(self.path, (404, {}, "Not found"))
+        if self.path == "/slow.html":
+            time.sleep(SLOW_PAGE_DELAY)
+        body = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+class StandInSiteTest(unittest.TestCase):
+    """
+    StandInSiteTest class: runs the stand-in site for the tests.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+        cls.base_url = "http://127.0.0.1:{0}".format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        del SiteHandler.client_ports[:]
+
+    def url(self, path):
+        """
+        Gets the URL of a page of the site.
+
+        Arguments:
+            path: The path of the page.
+        """
+        return self.base_url + path
+
+class FetchTest(StandInSiteTest):
+    """
+    FetchTest class: tests ConnectionPool.fetch().
+    """
+    def setUp(self):
+        super().setUp()
+        self.connections = parserecipe.ConnectionPool(timeout=5)
+
+    def tearDown(self):
+        self.connections.close()
+
+    def test_reuses_the_connection(self):
+        for path in ("/chips.html", "/butter.html", "/chips.html"):
+            self.assertEqual(self.connections.fetch(self.url(path)),
+                             SITE[path][2].encode("utf-8"))
+        self.assertEqual(len(SiteHandler.client_ports), 3)
+        self.assertEqual(len(set(SiteHandler.client_ports)), 1)
+
+    def test_follows_redirects(self):
+        self.assertEqual(self.connections.fetch(self.url("/moved-again.html")),
+                         SITE["/butter.html"][2].encode("utf-8"))
+
+    def test_gives_up_on_redirect_loops(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.connections.fetch(self.url("/loop.html"))
+        self.assertEqual(context.exception.code, 302)
+        self.assertEqual(len(SiteHandler.client_ports), parserecipe.MAX_REDIRECTS + 1)
+
+    def test_raises_on_missing_pages(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.connections.fetch(self.url("/missing.html"))
+        self.assertEqual(context.exception.code, 404)
+        # The connection can still be used afterwards.
+        self.connections.fetch(self.url("/chips.html"))
+        self.assertEqual(len(set(SiteHandler.client_ports)), 1)
+
+class BuildInspiringSetTest(StandInSiteTest):
+    """
+    BuildInspiringSetTest class: tests build_inspiring_set().
+    """
+    def test_keeps_the_order_and_leaves_out_bad_pages(self):
+        paths = ["/slow.html", "/missing.html", "/moved.html", "/no-recipe.html",
+                 "/chips.html"]
+        with mock.patch("builtins.print") as print_error:
+            recipes = parserecipe.build_inspiring_set([self.url(path) for path in paths],
+                                                      max_fetches=len(paths),
+                                                      parse_processes=1, timeout=5)
+        expected = [parse_ingredient_lines(RECIPE_LINES[path])
+                    for path in ("/slow.html", "/butter.html", "/chips.html")]
+        self.assertEqual(recipes, expected)
+        # One error for the missing page, and one for the page with no recipe.
+        self.assertEqual(print_error.call_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+test_thesaurus.py - Jack Beckitt-Marshall, Kevin Li and Yvonne Fang, PQ3,
+CSCI 3725
+
+Tests the thesaurus crawler and dictionary rebuilding against a small
+stand-in site, served with http.server on localhost, so they run offline.
+
+Usage: python -m unittest test_thesaurus
+"""
+
+import os
+import asyncio
+import tempfile
+import threading
+import unittest
+import http.server
+from unittest import mock
+
+import thesaurus
+
+# The stand-in site: the status and HTML of each page, by path.
+SITE = {
+    "/index.html": (200, '<a href="a.html">A</a> <a href="/b.html">B</a> '
+                         '<a href="missing.html">Missing</a> <a href="#top">Top</a> '
+                         '<a href="http://example.com/away.html">Away</a>'),
+    "/a.html": (200, '<a href="index.html">Home</a> <a href="c.html">C</a>'),
+    "/b.html": (200, '<a href="d.html">D</a>'),
+    "/c.html": (200, 'No links here.'),
+    "/d.html": (200, 'No links here either.'),
+    # Links on error pages shouldn't be followed.
+    "/missing.html": (404, '<a href="secret.html">Secret</a>'),
+    # Thesaurus pages, which aren't linked to.
+    "/flours.html": (200, '<p><b>flour = plain flour</b> Substitutes: cake flour OR '
+                          'bread flour (sifted)</p>'),
+    "/sweeteners.html": (200, '<table><tr><td><b>sugar</b> Substitutes: honey OR '
+                              'maple syrup</td></tr></table>'),
+}
+# The pages crawling from the index page should find.
+CRAWLED_PAGES = ["/index.html", "/a.html", "/b.html", "/c.html", "/d.html",
+                 "/missing.html"]
+# A thesaurus page that parse_page can't parse (its ingredient has no name).
+UNPARSEABLE_PAGE = (200, '<p><b></b> Substitutes: honey</p>')
+
+class SiteHandler(http.server.BaseHTTPRequestHandler):
+    """
+    SiteHandler class: serves the pages of the stand-in site.
+    """
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+        Serves a page of the site (or a 404 if there's no such page).
+        """
+        status, html = SITE.get(self.path, (404, "Not found"))
+        body = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+class StandInSiteTest(unittest.TestCase):
+    """
+    StandInSiteTest class: runs the stand-in site for the tests.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+        cls.base_url = "http://127.0.0.1:{0}".format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def url(self, path):
+        """
+        Gets the URL of a page of the site.
+
+        Arguments:
+            path: The path of the page.
+        """
+        return self.base_url + path
+
+class CrawlTest(StandInSiteTest):
+    """
+    CrawlTest class: tests crawl().
+    """
+    def crawl(self):
+        """
+        Crawls the site from its index page.
+        """
+        with mock.patch("builtins.print"):
+            return asyncio.run(thesaurus.crawl(self.url("/index.html"), max_per_host=2,
+                                               max_fetches=4))
+
+    def test_finds_every_local_link(self):
+        self.assertEqual(self.crawl(), {self.url(path) for path in CRAWLED_PAGES})
+
+    def test_skips_pages_that_fail(self):
+        extract_local_links = thesaurus.extract_local_links
+
+        def broken_on_a(url, html):
+            if url.endswith("/a.html"):
+                raise ValueError("Can't read the page")
+            return extract_local_links(url, html)
+
+        with mock.patch("thesaurus.extract_local_links", broken_on_a):
+            local_urls = self.crawl()
+        # The crawl carries on past a.html, but the links only it has are missed.
+        self.assertEqual(local_urls, {self.url(path) for path in CRAWLED_PAGES}
+                         - {self.url("/index.html"), self.url("/c.html")})
+
+class RebuildTest(StandInSiteTest):
+    """
+    RebuildTest class: tests rebuild_dictionaries().
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, "pages.json")
+        self.urls = [self.url("/flours.html"), self.url("/sweeteners.html")]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def rebuild(self, urls=None):
+        """
+        Rebuilds the dictionaries from the thesaurus pages.
+
+        Arguments:
+            urls: The URLs of the pages (by default, self.urls).
+        """
+        with mock.patch("builtins.print"):
+            return thesaurus.rebuild_dictionaries(urls or self.urls, self.cache_file,
+                                                  processes=1, max_fetches=2)
+
+    def test_only_parses_changed_pages(self):
+        translation_dict, sub_dict, parsed = self.rebuild()
+        self.assertEqual(parsed, 2)
+        self.assertEqual(translation_dict, {"flour": "flour", "plain flour": "flour",
+                                            "sugar": "sugar"})
+        self.assertEqual(sub_dict, {
+            "flour": {"subs": ["cake flour", "bread flour"], "category": "flours"},
+            "sugar": {"subs": ["honey", "maple syrup"], "category": "sweeteners"}})
+        self.assertEqual(self.rebuild(), (translation_dict, sub_dict, 0))
+
+    def test_keeps_cached_pages_that_fail_to_parse(self):
+        translation_dict, sub_dict, _ = self.rebuild()
+        new_page = self.url("/new.html")
+        with mock.patch.dict(SITE, {"/sweeteners.html": UNPARSEABLE_PAGE,
+                                    "/new.html": UNPARSEABLE_PAGE}):
+            # The new page has no cached version, so it's left out.
+            self.assertEqual(self.rebuild(self.urls + [new_page]),
+                             (translation_dict, sub_dict, 0))
+        cache = thesaurus.load_page_cache(self.cache_file)
+        self.assertEqual(sorted(cache["urls"]), sorted(self.urls))
+        self.assertEqual(self.rebuild(), (translation_dict, sub_dict, 0))
+
+if __name__ == "__main__":
+    unittest.main()
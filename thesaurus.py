@@ -2,7 +2,9 @@
 thesaurus.py - Jack Beckitt-Marshall, Kevin Li, Yvonne Fang, PQ3, CSCI 3725
 18 October 2019
 
-Scraper for foodsubs.com
+Scraper for foodsubs.com. Crawls the site for its pages, then builds the
+translation and substitution dictionaries from them, only parsing the pages
+that have changed since the last build.
 """
 
 import re
@@ -10,71 +12,124 @@ import os
 import urllib.parse
 import collections
 import json
+import asyncio
+import hashlib
 import argparse
+import tempfile
+import functools
+import concurrent.futures
 
 from bs4 import BeautifulSoup
 import requests # To be able to fetch webpages off the internet.
 
+# How many pages to fetch from each host at once, and altogether, while
+# crawling, and how long to wait for a page (in seconds).
+MAX_FETCHES_PER_HOST = 4
+MAX_FETCHES = 16
+FETCH_TIMEOUT = 30
 
-def scrape_urls(start_url):
+# What's been parsed from each page, by the hash of its content, so that
+# rebuilding the dictionaries only parses pages that have changed. Bump the
+# version whenever the parsing changes.
+PAGE_CACHE_FILE = "thesaurus_pages.json"
+PAGE_CACHE_VERSION = 1
+
+def extract_local_links(url, html):
     """
-    This function scrapes URLs, given a start URL, which is useful for when
-    we're trying to get all possible ingredient substitutions!
+    Gets the set of local links (ones to the same site, or relative ones) on a
+    page.
 
     Arguments:
-        start_url: The URL from which we start the scraping process.
+        url: The URL of the page.
+        html: The page's HTML.
     """
-    # Create a queue of new URLs to start crawling.
-    new_urls = collections.deque([start_url])
-    # Set of URLs we've already processed.
-    used_urls = set()
-
-    # Keep track of URLs that are local
-    local_urls = set()
-
-    while new_urls:
-        url = new_urls.popleft()
-        used_urls.add(url)
-        print("Processing {0}".format(url))
-
-        try:
-            response = requests.get(url)
-        except (requests.exceptions.MissingSchema, requests.exceptions.ConnectionError,
-                requests.exceptions.InvalidURL, requests.exceptions.InvalidSchema):
-            continue
-
-        # Extract base URL so we can differentiate the parts.
-        # extract base url to resolve relative links
-        parts = urllib.parse.urlsplit(url)
-        base = "{0.netloc}".format(parts)
-        strip_base = base.replace("www.", "")
-        base_url = "{0.scheme}://{0.netloc}".format(parts)
-        path = url[:url.rfind('/')+1] if '/' in parts.path else url
+    # Extract base URL so we can differentiate the parts.
+    # extract base url to resolve relative links
+    parts = urllib.parse.urlsplit(url)
+    base = "{0.netloc}".format(parts)
+    strip_base = base.replace("www.", "")
+    base_url = "{0.scheme}://{0.netloc}".format(parts)
+    path = url[:url.rfind('/')+1] if '/' in parts.path else url
 
+    soup = BeautifulSoup(html, "html5lib")
 
-        soup = BeautifulSoup(response.text, "html5lib")
-
-        for link in soup.find_all('a'):
-            anchor = link.attrs['href'] if 'href' in link.attrs else ''
-            if anchor.startswith('/'):
-                local_link = urllib.parse.urljoin(base_url, anchor)
-                local_urls.add(local_link)
-            elif anchor.startswith("#"):
-                pass
-            elif strip_base in anchor:
-                local_urls.add(anchor)
-            elif not anchor.startswith('http'):
-                local_link = urllib.parse.urljoin(path, anchor)
-                local_urls.add(local_link)
-
+    local_urls = set()
+    for link in soup.find_all('a'):
+        anchor = link.attrs['href'] if 'href' in link.attrs else ''
+        if anchor.startswith('/'):
+            local_link = urllib.parse.urljoin(base_url, anchor)
+            local_urls.add(local_link)
+        elif anchor.startswith("#"):
+            pass
+        elif strip_base in anchor:
+            local_urls.add(anchor)
+        elif not anchor.startswith('http'):
+            local_link = urllib.parse.urljoin(path, anchor)
+            local_urls.add(local_link)
+    return local_urls
+
+async def crawl(start_url, max_per_host=MAX_FETCHES_PER_HOST, max_fetches=MAX_FETCHES):
+    """
+    Crawls a site from a start URL, returning the set of local URLs found.
+    Each URL is only ever queued once (we keep a set of every URL we've seen),
+    and only the links a page adds are queued when it's processed. Pages are
+    fetched on a pool of threads, with only so many from each host at once.
+    Pages that can't be fetched (or come back with an error status) are
+    skipped.
 
-        for i in local_urls:
-            if not i in new_urls and not i in used_urls:
-                new_urls.append(i)
-                print(i + " Appended")
-                print(used_urls)
+    Arguments:
+        start_url: The URL from which we start the scraping process.
+        max_per_host: How many pages to fetch from each host at once.
+        max_fetches: How many pages to fetch at once altogether.
+    """
+    loop = asyncio.get_running_loop()
+    # Every URL we've queued (and maybe processed already).
+    seen_urls = {start_url}
+    # Keep track of URLs that are local
+    local_urls = set()
+    host_limits = collections.defaultdict(lambda: asyncio.Semaphore(max_per_host))
+    tasks = set()
+
+    with requests.Session() as session, \
+            concurrent.futures.ThreadPoolExecutor(max_fetches) as executor:
+        async def process(url):
+            # A page that can't be fetched or read is skipped, rather than
+            # stopping the whole crawl.
+            try:
+                async with host_limits[urllib.parse.urlsplit(url).netloc]:
+                    print("Processing {0}".format(url))
+                    response = await loop.run_in_executor(
+                        executor, functools.partial(session.get, url, timeout=FETCH_TIMEOUT))
+                response.raise_for_status()
+                links = await loop.run_in_executor(
+                    executor, lambda: extract_local_links(url, response.text))
+            except Exception as error: # pylint: disable=broad-except
+                print("Couldn't crawl {0}: {1!r}".format(url, error))
+                return
+            local_urls.update(links)
+            for link in links - seen_urls:
+                seen_urls.add(link)
+                print(link + " Appended")
+                tasks.add(asyncio.ensure_future(process(link)))
+
+        tasks.add(asyncio.ensure_future(process(start_url)))
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            tasks.difference_update(done)
+            for task in done:
+                task.result()
+    return local_urls
+
+def scrape_urls(start_url, max_per_host=MAX_FETCHES_PER_HOST):
+    """
+    This function scrapes URLs, given a start URL, which is useful for when
+    we're trying to get all possible ingredient substitutions!
 
-    return list(local_urls)
+    Arguments:
+        start_url: The URL from which we start the scraping process.
+        max_per_host: How many pages to fetch from each host at once.
+    """
+    return sorted(asyncio.run(crawl(start_url, max_per_host)))
 
 
 def get_list_and_subs(content):
@@ -86,9 +141,14 @@ def get_list_and_subs(content):
         content: The HTML content we want to retrieve the two components from.
     """
     final_list = []
-    for _, item in enumerate(content):
-        if "Substitutes:" in item.get_text() and item.find_all('b'):
-            ingredient_names = item.find_all('b')[0].find(text=True) \
+    for item in content:
+        # Getting the text of an item walks all of it, so we only do it once.
+        text = item.get_text()
+        if "Substitutes:" not in text:
+            continue
+        bold = item.find('b')
+        if bold is not None:
+            ingredient_names = bold.find(text=True) \
                 .replace('\n', ' ').replace('\r', '')
             ingredient_names = ingredient_names.split("=")
             for i, name in enumerate(ingredient_names):
@@ -96,7 +156,7 @@ def get_list_and_subs(content):
                 # Remove extraneous spaces from the ingredient names.
                 ingredient_names[i] = re.sub(' +', ' ', ingredient_names[i])
 
-            substitutes = item.get_text().split("Substitutes:")[1]\
+            substitutes = text.split("Substitutes:")[1]\
                 .replace('\n', ' ').replace('\r', '')
             substitutes = substitutes.split("Links")[0]
             substitutes = substitutes.split("Cooking notes")[0]
@@ -113,60 +173,206 @@ def get_list_and_subs(content):
 
     return final_list
 
-def main():
+def parse_page(content):
     """
-    Main function: starts the URL scraping process.
+    Parses a page of the thesaurus, returning a list of [ingredient names,
+    substitutes] pairs (as lists, so they can be saved as JSON).
+
+    Arguments:
+        content: The page, as bytes.
     """
-    parser = argparse.ArgumentParser(
-        description="Scrape ingredient categories and substitions from Cook's Thesarus")
-    parser.add_argument("--urls", default=None, help="Locations of URL JSON file")
+    soup = BeautifulSoup(content, "lxml")
 
-    args = parser.parse_args()
+    all_tds = soup.find_all('td')
 
-    if args.urls is None:
-        urls = scrape_urls('http://foodsubs.com')
-        with open("urllist.json", 'w') as file:
-            json.dump(urls, file)
-    else:
-        with open(args.urls, "r") as file:
-            urls = json.load(file)
+    all_ps = [elem for elem in list(soup.find_all('p'))\
+                if elem.parent.name != "td"]
 
-    translation_dicts = []
-    sub_dicts = []
+    return [[ingredient_names, subs] for ingredient_names, subs
+            in get_list_and_subs(all_tds) + get_list_and_subs(all_ps)]
 
-    for url in urls:
-        print("Processing {0}.".format(os.path.basename(url).split(".")[0]))
-        try:
-            response = requests.get(url)
-        except requests.exceptions.InvalidSchema:
-            pass
+def get_category(url):
+    """
+    Gets the category of the ingredients on a page, which is the name of the
+    page.
 
-        soup = BeautifulSoup(response.content, "lxml")
+    Arguments:
+        url: The URL of the page.
+    """
+    return os.path.basename(url).split(".")[0]
 
-        all_tds = soup.find_all('td')
+def load_page_cache(filename=PAGE_CACHE_FILE):
+    """
+    Loads the cache of parsed pages, which has the content hash of each URL
+    ("urls") and what was parsed from the page with each hash ("pages"). If
+    there isn't a cache yet, an empty one is returned.
 
-        all_ps = [elem for elem in list(soup.find_all('p'))\
-                    if elem.parent.name != "td"]
+    Arguments:
+        filename: The cache file.
+    """
+    try:
+        with open(filename, "r") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {"version": PAGE_CACHE_VERSION, "urls": dict(), "pages": dict()}
+    if cache.get("version") != PAGE_CACHE_VERSION:
+        return {"version": PAGE_CACHE_VERSION, "urls": dict(), "pages": dict()}
+    return cache
+
+def save_page_cache(cache, filename=PAGE_CACHE_FILE):
+    """
+    Saves the cache of parsed pages. The file is written atomically, so an
+    interrupted rebuild never leaves half of it behind.
 
-        list_part = get_list_and_subs(all_tds) + get_list_and_subs(all_ps)
+    Arguments:
+        cache: The cache, as returned by load_page_cache.
+        filename: The cache file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    file_handle, temp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_handle, "w") as cache_file:
+            json.dump(cache, cache_file)
+        # mkstemp only lets us read the file.
+        os.chmod(temp_filename, 0o644)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+def fetch_page(session, url):
+    """
+    Fetches a page, returning its content as bytes, or None if it can't be
+    fetched (or the server sends back an error).
 
-        translation_dict = dict()
-        sub_dict = dict()
+    Arguments:
+        session: The requests.Session to fetch it with.
+        url: The URL of the page.
+    """
+    try:
+        response = session.get(url, timeout=FETCH_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    except requests.exceptions.RequestException:
+        return None
+
+def merge_pages(urls, url_hashes, pages):
+    """
+    Merges the ingredients of every page into the translation and
+    substitution dictionaries. Pages are merged in the order of the URLs, so
+    if an ingredient is on several pages, the last one wins.
 
-        for ingredient_names, subs in list_part:
+    Arguments:
+        urls: The URLs of the pages, in order.
+        url_hashes: The content hash of each URL's page.
+        pages: What was parsed from the page with each hash.
+    """
+    translation_dict = dict()
+    sub_dict = dict()
+    for url in urls:
+        if url not in url_hashes:
+            continue
+        category = get_category(url)
+        for ingredient_names, subs in pages[url_hashes[url]]:
             initial_name = ingredient_names[0]
             for name in ingredient_names:
                 translation_dict[name] = initial_name
 
             sub_dict[initial_name] = {"subs": subs,
-                                      "category": os.path.basename(url)\
-                                      .split(".")[0]}
+                                      "category": category}
+    return translation_dict, sub_dict
 
-        translation_dicts.append(translation_dict)
-        sub_dicts.append(sub_dict)
+def rebuild_dictionaries(urls, cache_file=PAGE_CACHE_FILE, processes=None,
+                         max_fetches=MAX_FETCHES):
+    """
+    Builds the translation and substitution dictionaries from the pages at
+    some URLs. The pages are fetched on a pool of threads, and each one is
+    hashed as it arrives; only pages whose hash isn't in the cache are parsed
+    (in a pool of processes), and the rest are taken from the cache. If a page
+    can't be fetched or parsed, the last version of it in the cache is used.
+    Returns the two dictionaries, and how many pages were parsed.
+
+    Arguments:
+        urls: The URLs of the pages.
+        cache_file: The cache of parsed pages.
+        processes: How many processes to parse with (defaults to the number of
+            CPUs).
+        max_fetches: How many pages to fetch at once.
+    """
+    cache = load_page_cache(cache_file)
+    url_hashes = dict()
+    parsing = dict()
+    parsed = 0
+    with requests.Session() as session, \
+            concurrent.futures.ThreadPoolExecutor(max_fetches) as fetchers, \
+            concurrent.futures.ProcessPoolExecutor(processes) as parsers:
+        fetches = {fetchers.submit(fetch_page, session, url): url for url in urls}
+        for fetch in concurrent.futures.as_completed(fetches):
+            url = fetches[fetch]
+            content = fetch.result()
+            if content is None:
+                print("Couldn't fetch {0}.".format(url))
+                if url in cache["urls"]:
+                    url_hashes[url] = cache["urls"][url]
+                continue
+            page_hash = hashlib.sha256(content).hexdigest()
+            url_hashes[url] = page_hash
+            if page_hash not in cache["pages"] and page_hash not in parsing:
+                parsing[page_hash] = parsers.submit(parse_page, content)
+
+        for page_hash, parse in parsing.items():
+            try:
+                cache["pages"][page_hash] = parse.result()
+                parsed += 1
+            except Exception as error: # pylint: disable=broad-except
+                # Fall back on the last version of each page with this content.
+                for url in [url for url, url_hash in url_hashes.items()
+                            if url_hash == page_hash]:
+                    print("Couldn't parse {0}: {1!r}".format(url, error))
+                    if cache["urls"].get(url) in cache["pages"]:
+                        url_hashes[url] = cache["urls"][url]
+                    else:
+                        del url_hashes[url]
+
+    # Forget the pages that aren't at any of the URLs any more.
+    cache["urls"] = url_hashes
+    cache["pages"] = {page_hash: cache["pages"][page_hash]
+                      for page_hash in set(url_hashes.values())}
+    save_page_cache(cache, cache_file)
+    return merge_pages(urls, url_hashes, cache["pages"]) + (parsed,)
+
+def main():
+    """
+    Main function: starts the URL scraping process.
+    """
+    parser = argparse.ArgumentParser(
+        description="Scrape ingredient categories and substitions from Cook's Thesarus")
+    parser.add_argument("--urls", default=None, help="Locations of URL JSON file")
+    parser.add_argument("--max-per-host", type=int, default=MAX_FETCHES_PER_HOST,
+                        help="Number of pages to fetch from each host at once while "
+                        "crawling.")
+    parser.add_argument("--max-fetches", type=int, default=MAX_FETCHES,
+                        help="Number of pages to fetch at once.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of processes to parse pages with (defaults to the "
+                        "number of CPUs).")
+    parser.add_argument("--cache", default=PAGE_CACHE_FILE,
+                        help="Cache of parsed pages, so only changed pages are parsed.")
+
+    args = parser.parse_args()
+
+    if args.urls is None:
+        urls = scrape_urls('http://foodsubs.com', args.max_per_host)
+        with open("urllist.json", 'w') as file:
+            json.dump(urls, file)
+    else:
+        with open(args.urls, "r") as file:
+            urls = json.load(file)
 
-    translation_dict = {k: v for d in translation_dicts for k, v in d.items()}
-    sub_dict = {k: v for d in sub_dicts for k, v in d.items()}
+    translation_dict, sub_dict, parsed = rebuild_dictionaries(urls, args.cache,
+                                                              args.processes,
+                                                              args.max_fetches)
+    print("Parsed {0} new or changed pages of {1}.".format(parsed, len(urls)))
 
     with open("translation_dict.json", "w") as file:
         json.dump(translation_dict, file)